@@ -0,0 +1,21 @@
+from lightning_ir import BiEncoderModule, CrossEncoderModule, FaissSearchConfig, SearchServer
+
+# Define the models
+module = BiEncoderModule(model_name_or_path="webis/bert-bi-encoder")
+re_rank_module = CrossEncoderModule(model_name_or_path="webis/monoelectra-base")
+
+# Define the server
+server = SearchServer(
+    module,
+    index_dir="./msmarco-passage-index",
+    search_config=FaissSearchConfig(k=100),
+    re_rank_module=re_rank_module,
+    docs="msmarco-passage",
+    re_rank_depth=20,
+    max_batch_size=32,
+    max_wait=0.005,
+    port=8080,
+)
+
+# Answer requests, e.g., curl -d '{"query": "what is a bi-encoder", "k": 10}' localhost:8080/search
+server.run()
@@ -19,6 +19,8 @@ from .bi_encoder import (
     BiEncoderModule,
     BiEncoderOutput,
     BiEncoderTokenizer,
+    DocEmbeddingCache,
+    QueryEmbeddingCache,
     ScoringFunction,
 )
 from .cross_encoder import (
@@ -38,10 +40,12 @@ from .data import (
     RankSample,
     RunDataset,
     SearchBatch,
+    TokenizedDocCache,
     TrainBatch,
     TupleDataset,
 )
 from .lightning_utils import (
+    CascadeCallback,
     ConstantLRSchedulerWithLinearWarmup,
     GenericConstantSchedulerWithLinearWarmup,
     GenericConstantSchedulerWithQuadraticWarmup,
@@ -94,13 +98,23 @@ from .retrieve import (
     FaissSearcher,
     IndexConfig,
     Indexer,
+    PLAIDIndexConfig,
+    PLAIDIndexer,
+    PLAIDSearchConfig,
+    PLAIDSearcher,
+    ResidualCodec,
+    ResidualEmbeddingStore,
+    ResidualEmbeddingStoreConfig,
+    ResidualEmbeddingStoreWriter,
     SearchConfig,
     Searcher,
+    ShardedSearcher,
     SparseIndexConfig,
     SparseIndexer,
     SparseSearchConfig,
     SparseSearcher,
 )
+from .serve import MicroBatcher, SearchServer
 
 AutoConfig.register(BiEncoderConfig.model_type, BiEncoderConfig)
 AutoModel.register(BiEncoderConfig, BiEncoderModel)
@@ -135,6 +149,7 @@ __all__ = [
     "BiEncoderModule",
     "BiEncoderOutput",
     "BiEncoderTokenizer",
+    "CascadeCallback",
     "ColConfig",
     "ConstantLRSchedulerWithLinearWarmup",
     "ConstantMarginMSE",
@@ -144,6 +159,7 @@ __all__ = [
     "CrossEncoderOutput",
     "CrossEncoderTokenizer",
     "DocDataset",
+    "DocEmbeddingCache",
     "DocSample",
     "FaissFlatIndexConfig",
     "FaissFlatIndexer",
@@ -181,12 +197,22 @@ __all__ = [
     "LightningIRWandbLogger",
     "LinearLRSchedulerWithLinearWarmup",
     "LocalizedContrastiveEstimation",
+    "MicroBatcher",
+    "PLAIDIndexConfig",
+    "PLAIDIndexer",
+    "PLAIDSearchConfig",
+    "PLAIDSearcher",
     "QueryDataset",
+    "QueryEmbeddingCache",
     "QuerySample",
     "RankCallback",
     "RankNet",
     "RankSample",
     "ReRankCallback",
+    "ResidualCodec",
+    "ResidualEmbeddingStore",
+    "ResidualEmbeddingStoreConfig",
+    "ResidualEmbeddingStoreWriter",
     "RunDataset",
     "ScoreBasedInBatchCrossEntropy",
     "ScoreBasedInBatchLossFunction",
@@ -195,6 +221,8 @@ __all__ = [
     "SearchCallback",
     "SearchConfig",
     "Searcher",
+    "SearchServer",
+    "ShardedSearcher",
     "SparseIndexConfig",
     "SparseIndexer",
     "SparseSearchConfig",
@@ -203,6 +231,7 @@ __all__ = [
     "T5CrossEncoderConfig",
     "T5CrossEncoderModel",
     "T5CrossEncoderTokenizer",
+    "TokenizedDocCache",
     "TrainBatch",
     "TupleDataset",
     "WarmupLRScheduler",
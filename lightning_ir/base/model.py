@@ -14,7 +14,7 @@ import torch
 from transformers import MODEL_MAPPING, BatchEncoding, BertModel
 from transformers.modeling_outputs import ModelOutput
 
-from ..flash import FLASH_ATTENTION_MAP
+from ..flash import FLASH_ATTENTION_MAP, VARLEN_FORWARD_MAP
 from .class_factory import LightningIRModelClassFactory
 from .config import LightningIRConfig
 from .external_model_hub import CHECKPOINT_MAPPING, POST_LOAD_CALLBACKS, STATE_DICT_KEY_MAPPING
@@ -48,6 +48,10 @@ https://huggingface.co/transformers/main_classes/model.html#transformers.PreTrai
     """Flag to allow mini batches of documents for a single query. Set to false for listwise models to ensure
     correctness."""
 
+    UNPAD_INPUTS = True
+    """Flag to encode padded batches as packed variable-length sequences without padding tokens if the backbone model
+    supports it."""
+
     def __init__(self, config: LightningIRConfig, *args, **kwargs) -> None:
         """Initializes the model.
 
@@ -67,6 +71,36 @@ https://huggingface.co/transformers/main_classes/model.html#transformers.PreTrai
                     if name.endswith(self_attn_pattern):
                         module.forward = partial(flash_attn_forward, module)
 
+    def _backbone_embeddings(self, encoding: BatchEncoding, unpad: bool = True) -> torch.Tensor:
+        """Runs the backbone model and returns the contextualized embeddings. If the backbone model supports it and the
+        sequences contain padding, the padding tokens are removed and the sequences are encoded as packed
+        variable-length sequences. The embeddings of padding tokens are then zero. Relative position embeddings,
+        gradient checkpointing, and head masks are not supported by the packed encoding and use the backbone model's
+        forward method.
+
+        :param encoding: Tokenizer encodings for the text sequences
+        :type encoding: BatchEncoding
+        :param unpad: Whether the embeddings of padding tokens are unused and the padding may be removed, defaults to
+            True
+        :type unpad: bool, optional
+        :return: Contextualized embeddings of shape [batch_size x seq_len x hidden_size]
+        :rtype: torch.Tensor
+        """
+        attention_mask = encoding.get("attention_mask", None)
+        varlen_forward = VARLEN_FORWARD_MAP.get(self.config.backbone_model_type or "", None)
+        if (
+            unpad
+            and self.UNPAD_INPUTS
+            and varlen_forward is not None
+            and attention_mask is not None
+            and not attention_mask.all()
+            and getattr(self.config, "position_embedding_type", "absolute") == "absolute"
+            and not (self.is_gradient_checkpointing and self.training)
+            and encoding.get("head_mask", None) is None
+        ):
+            return varlen_forward(self, **encoding).last_hidden_state
+        return self._backbone_forward(**encoding).last_hidden_state
+
     def _backbone_forward(self, *args, **kwargs):
         """Runs the forward method of the backbone model. Is overridden in
         :class:`~lightning_ir.base.class_factory.LightningIRModelClassFactory`.
@@ -142,7 +142,11 @@ class LightningIRModule(LightningModule):
         raise NotImplementedError
 
     def prepare_input(
-        self, queries: Sequence[str] | None, docs: Sequence[str] | None, num_docs: Sequence[int] | int | None
+        self,
+        queries: Sequence[str] | None,
+        docs: Sequence[str] | None,
+        num_docs: Sequence[int] | int | None,
+        encodings: Dict[str, BatchEncoding] | None = None,
     ) -> Dict[str, BatchEncoding]:
         """Tokenizes queries and documents and returns the tokenized BatchEncoding_.
 
@@ -155,12 +159,16 @@ class LightningIRModule(LightningModule):
         :param num_docs: Number of documents per query, if None num_docs is inferred by `len(docs) // len(queries)`,
             defaults to None
         :type num_docs: Sequence[int] | int | None
+        :param encodings: Encodings of a batch that was already tokenized when collating. If set, the queries and
+            documents are not tokenized again, defaults to None
+        :type encodings: Dict[str, BatchEncoding] | None, optional
         :return: Tokenized queries and documents, format depends on the tokenizer
         :rtype: Dict[str, BatchEncoding]
         """
-        encodings = self.tokenizer.tokenize(
-            queries, docs, return_tensors="pt", padding=True, truncation=True, num_docs=num_docs
-        )
+        if encodings is None:
+            encodings = self.tokenizer.tokenize(
+                queries, docs, return_tensors="pt", padding=True, truncation=True, num_docs=num_docs
+            )
         for key in encodings:
             encodings[key] = encodings[key].to(self.device)
         return encodings
@@ -4,6 +4,7 @@ This module provides the main classes and functions for bi-encoder models, inclu
 modules, and tokenizers."""
 
 from .config import BiEncoderConfig
+from .embedding_cache import DocEmbeddingCache, QueryEmbeddingCache
 from .model import BiEncoderEmbedding, BiEncoderModel, BiEncoderOutput, ScoringFunction
 from .module import BiEncoderModule
 from .tokenizer import BiEncoderTokenizer
@@ -15,5 +16,7 @@ __all__ = [
     "BiEncoderModule",
     "BiEncoderOutput",
     "BiEncoderTokenizer",
+    "DocEmbeddingCache",
+    "QueryEmbeddingCache",
     "ScoringFunction",
 ]
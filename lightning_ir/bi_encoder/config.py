@@ -39,6 +39,7 @@ class BiEncoderConfig(LightningIRConfig):
             "sparsification",
             "embedding_dim",
             "projection",
+            "memory_budget",
         }
     ).union(TOKENIZER_ARGS)
     """Arguments added to the configuration."""
@@ -62,6 +63,7 @@ class BiEncoderConfig(LightningIRConfig):
         add_marker_tokens: bool = False,
         embedding_dim: int = 768,
         projection: Literal["linear", "linear_no_bias", "mlm"] | None = "linear",
+        memory_budget: int = 256 * 2**20,
         **kwargs,
     ):
         """Configuration class for a bi-encoder model.
@@ -103,6 +105,9 @@ class BiEncoderConfig(LightningIRConfig):
         :type embedding_dim: int, optional
         :param projection: Whether and how to project the output emeddings, defaults to "linear"
         :type projection: Literal['linear', 'linear_no_bias', 'mlm'] | None, optional
+        :param memory_budget: Maximum number of bytes of the intermediate tensors when scoring query and document
+            embeddings. Query--document pairs are scored in chunks that fit into the budget, defaults to 256 MiB
+        :type memory_budget: int, optional
         """
         super().__init__(query_length=query_length, doc_length=doc_length, **kwargs)
         self.similarity_function = similarity_function
@@ -120,6 +125,7 @@ class BiEncoderConfig(LightningIRConfig):
         self.add_marker_tokens = add_marker_tokens
         self.embedding_dim = embedding_dim
         self.projection = projection
+        self.memory_budget = memory_budget
 
     def to_dict(self) -> Dict[str, Any]:
         """Overrides the transformers.PretrainedConfig.to_dict_ method to include the added arguments, the backbone
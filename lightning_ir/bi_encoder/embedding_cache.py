@@ -0,0 +1,351 @@
+"""
+Embedding cache module for bi-encoder models.
+
+This module defines caches that store the embeddings of a bi-encoder model so that repeated inputs do not have to be
+encoded again.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import unicodedata
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from .model import BiEncoderEmbedding, BiEncoderModel
+
+
+class EmbeddingCache:
+    def __init__(self, max_size: int) -> None:
+        """Least-recently-used in-memory cache of the embeddings of single sequences. Embeddings are stored in
+        cpu memory with trailing padding removed and are padded again on the target device when a batch is assembled
+        from the cache.
+
+        :param max_size: Maximum number of embeddings kept in memory
+        :type max_size: int
+        :raises ValueError: If max_size is smaller than 1
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, BiEncoderEmbedding] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def get(self, key: str) -> BiEncoderEmbedding | None:
+        """Looks up the embedding of a single sequence.
+
+        :param key: Cache key of the sequence
+        :type key: str
+        :return: Embedding of shape [1 x seq_len x embedding_dim] or None if the sequence is not cached
+        :rtype: BiEncoderEmbedding | None
+        """
+        if key not in self._cache:
+            return None
+        self._cache.move_to_end(key)
+        return self._cache[key]
+
+    def put(self, key: str, embedding: BiEncoderEmbedding) -> None:
+        """Adds the embedding of a single sequence to the cache.
+
+        :param key: Cache key of the sequence
+        :type key: str
+        :param embedding: Embedding of shape [1 x seq_len x embedding_dim]
+        :type embedding: BiEncoderEmbedding
+        """
+        # entries are kept in cpu memory so that large caches do not occupy accelerator memory, they are moved to the
+        # target device when a batch is assembled
+        embedding = BiEncoderEmbedding(
+            embedding.embeddings.detach().to("cpu", copy=True), embedding.scoring_mask.detach().to("cpu", copy=True)
+        )
+        self._insert(key, embedding)
+
+    def _insert(self, key: str, embedding: BiEncoderEmbedding) -> None:
+        self._cache[key] = embedding
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all embeddings from memory and resets the hit and miss counters."""
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _encode(
+        self,
+        keys: Sequence[str],
+        encode_fn: Callable[[List[int]], BiEncoderEmbedding],
+        device: torch.device | None = None,
+    ) -> BiEncoderEmbedding:
+        """Assembles the embeddings of a batch from the cache. The positions of the sequences that are not cached are
+        passed to the encode function and its embeddings are added to the cache."""
+        embeddings: Dict[str, BiEncoderEmbedding] = {}
+        missing: Dict[str, int] = {}
+        for idx, key in enumerate(keys):
+            if key in embeddings or key in missing:
+                continue
+            embedding = self.get(key)
+            if embedding is None:
+                missing[key] = idx
+            else:
+                embeddings[key] = embedding
+        # repeated keys of a missing sequence are encoded once but are all misses
+        num_misses = sum(key in missing for key in keys)
+        self.misses += num_misses
+        self.hits += len(keys) - num_misses
+        if missing:
+            encoded = encode_fn(list(missing.values()))
+            for idx, key in enumerate(missing):
+                # trailing vectors that are masked out in the scoring mask are padding and are not cached
+                nonzero = encoded.scoring_mask[idx].nonzero()
+                length = int(nonzero[-1]) + 1 if nonzero.numel() else 1
+                embedding = BiEncoderEmbedding(
+                    encoded.embeddings[idx : idx + 1, :length], encoded.scoring_mask[idx : idx + 1, :length]
+                )
+                self.put(key, embedding)
+                embeddings[key] = embedding
+        return self._pad([embeddings[key] for key in keys], device)
+
+    @staticmethod
+    def _pad(embeddings: List[BiEncoderEmbedding], device: torch.device | None) -> BiEncoderEmbedding:
+        device = device or embeddings[0].device
+        dtype = embeddings[0].embeddings.dtype
+        return BiEncoderEmbedding(
+            pad_sequence(
+                [embedding.embeddings[0].to(device=device, dtype=dtype) for embedding in embeddings], batch_first=True
+            ),
+            pad_sequence(
+                [embedding.scoring_mask[0].to(device) for embedding in embeddings],
+                batch_first=True,
+                padding_value=False,
+            ),
+        )
+
+
+class QueryEmbeddingCache(EmbeddingCache):
+    def __init__(self, max_size: int = 10_000, cache_dir: Path | str | None = None) -> None:
+        """Least-recently-used cache of query embeddings. Queries are looked up by their normalized text and a
+        fingerprint of the model configuration and weights, so queries that were already encoded skip tokenization and
+        the backbone model entirely. Optionally, embeddings are additionally written to a directory so that they
+        persist across runs. Embeddings of a model with different weights, e.g., after fine-tuning, are not reused.
+
+        :param max_size: Maximum number of query embeddings kept in memory, defaults to 10_000
+        :type max_size: int, optional
+        :param cache_dir: Directory to persist query embeddings in, defaults to None
+        :type cache_dir: Path | str | None, optional
+        :raises ValueError: If max_size is smaller than 1
+        """
+        super().__init__(max_size)
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Normalizes a query by applying unicode NFKC normalization and collapsing whitespace. Casing is kept because
+        cased models embed differently cased queries differently.
+
+        :param query: Query text
+        :type query: str
+        :return: Normalized query text
+        :rtype: str
+        """
+        return " ".join(unicodedata.normalize("NFKC", query).split())
+
+    @staticmethod
+    def fingerprint(model: BiEncoderModel) -> str:
+        """Fingerprint of the model configuration and weights that determine the query embeddings of a model.
+
+        :param model: Bi-encoder model
+        :type model: BiEncoderModel
+        :return: Fingerprint of the model
+        :rtype: str
+        """
+        config = f"{model.__class__.__name__}\0{model.config.to_json_string(use_diff=False)}"
+        fingerprint = hashlib.sha1(config.encode("utf-8"))
+        for name, tensor in model.state_dict().items():
+            fingerprint.update(name.encode("utf-8"))
+            fingerprint.update(tensor.detach().reshape(-1).view(torch.uint8).cpu().numpy())
+        return fingerprint.hexdigest()
+
+    def key(self, query: str, fingerprint: str) -> str:
+        """Cache key of a query for a model fingerprint.
+
+        :param query: Query text
+        :type query: str
+        :param fingerprint: Fingerprint of the model, see :meth:`fingerprint`
+        :type fingerprint: str
+        :return: Cache key
+        :rtype: str
+        """
+        return hashlib.sha1(f"{fingerprint}\0{self.normalize(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> BiEncoderEmbedding | None:
+        """Looks up the embedding of a single query. Embeddings that are only found on disk are moved into memory.
+
+        :param key: Cache key of the query, see :meth:`key`
+        :type key: str
+        :return: Embedding of shape [1 x seq_len x embedding_dim] or None if the query is not cached
+        :rtype: BiEncoderEmbedding | None
+        """
+        embedding = super().get(key)
+        if embedding is not None or self.cache_dir is None or not (self.cache_dir / f"{key}.pt").exists():
+            return embedding
+        embedding = BiEncoderEmbedding(**torch.load(self.cache_dir / f"{key}.pt", weights_only=True))
+        self._insert(key, embedding)
+        return embedding
+
+    def put(self, key: str, embedding: BiEncoderEmbedding) -> None:
+        """Adds the embedding of a single query to the cache.
+
+        :param key: Cache key of the query, see :meth:`key`
+        :type key: str
+        :param embedding: Embedding of shape [1 x seq_len x embedding_dim]
+        :type embedding: BiEncoderEmbedding
+        """
+        super().put(key, embedding)
+        if self.cache_dir is not None:
+            torch.save({name: value.cpu() for name, value in self._cache[key].items()}, self.cache_dir / f"{key}.pt")
+
+    def clear(self) -> None:
+        """Removes all query embeddings from memory and disk and resets the hit and miss counters."""
+        super().clear()
+        if self.cache_dir is not None:
+            for path in self.cache_dir.glob("*.pt"):
+                path.unlink()
+
+    def encode(
+        self,
+        queries: Sequence[str],
+        encode_fn: Callable[[Sequence[str]], BiEncoderEmbedding],
+        fingerprint: str,
+        device: torch.device | None = None,
+    ) -> BiEncoderEmbedding:
+        """Embeds queries using cached embeddings where possible. Only queries that are not cached are passed to the
+        encode function and added to the cache.
+
+        :param queries: Queries to embed
+        :type queries: Sequence[str]
+        :param encode_fn: Function that embeds a sequence of queries
+        :type encode_fn: Callable[[Sequence[str]], BiEncoderEmbedding]
+        :param fingerprint: Fingerprint of the model, see :meth:`fingerprint`
+        :type fingerprint: str
+        :param device: Device to move the embeddings to, defaults to None
+        :type device: torch.device | None, optional
+        :return: Query embeddings and scoring mask
+        :rtype: BiEncoderEmbedding
+        """
+        keys = [self.key(query, fingerprint) for query in queries]
+        return self._encode(keys, lambda idcs: encode_fn([queries[idx] for idx in idcs]), device)
+
+
+class DocEmbeddingCache(EmbeddingCache):
+    def __init__(self, max_size: int = 100_000, index_dir: Path | str | None = None) -> None:
+        """Least-recently-used cache of document embeddings looked up by document id. Document embeddings do not depend
+        on the query, so documents that are re-ranked for multiple queries are only encoded once. Optionally, document
+        embeddings are read from an existing index that stores per-token embeddings, i.e., an index with a
+        residual-compressed embedding store (PLAID or faiss indexes written with one) or a faiss index that supports
+        reconstructing embeddings. Sharded indexes are read from all of their shards.
+
+        Embeddings read from an index are reconstructed and can differ from freshly encoded embeddings: embeddings of
+        a residual-compressed store or a quantized faiss index (e.g., PQ) are approximate, and faiss indexes for
+        cosine similarity store normalized embeddings. Scores of documents read from an index can therefore deviate
+        from scores of encoded documents.
+
+        Document ids are not tied to a model, so a cache (and the index) must only be used with the model that
+        produced its embeddings.
+
+        :param max_size: Maximum number of document embeddings kept in memory, defaults to 100_000
+        :type max_size: int, optional
+        :param index_dir: Directory of an index to read document embeddings from, defaults to None
+        :type index_dir: Path | str | None, optional
+        :raises ValueError: If max_size is smaller than 1
+        :raises ValueError: If the index (or a shard of a sharded index) does not store per-token document embeddings
+        """
+        super().__init__(max_size)
+        self.index_dir = None if index_dir is None else Path(index_dir)
+        # embedding lookup, embedding offsets of the documents, and index of the first document of every index shard
+        self._index_lookups: List[Callable[[torch.Tensor], torch.Tensor]] = []
+        self._doc_offsets: List[torch.Tensor] = []
+        self._shard_starts: List[int] = []
+        self._doc_id_to_idx: Dict[str, int] = {}
+        if self.index_dir is not None:
+            from ..retrieve import ShardedSearcher
+
+            shard_dirs = [self.index_dir]
+            if ShardedSearcher.is_sharded(self.index_dir):
+                shard_dirs = ShardedSearcher.shard_dirs(self.index_dir)
+            for shard_dir in shard_dirs:
+                self._load_index(shard_dir)
+
+    def _load_index(self, index_dir: Path) -> None:
+        from ..retrieve.embedding_store import ResidualEmbeddingStore
+        from ..retrieve.searcher import load_doc_ids
+
+        if ResidualEmbeddingStore.exists(index_dir):
+            self._index_lookups.append(ResidualEmbeddingStore(index_dir).lookup)
+        elif (index_dir / "index.faiss").exists():
+            import faiss
+
+            index = faiss.read_index(str(index_dir / "index.faiss"))
+            self._index_lookups.append(lambda idcs: torch.from_numpy(index.reconstruct_batch(idcs.numpy())))
+        else:
+            raise ValueError(f"No per-token document embeddings found in {index_dir}")
+        shard_start = sum(doc_offsets.shape[0] - 1 for doc_offsets in self._doc_offsets)
+        doc_ids = np.char.decode(load_doc_ids(index_dir), "utf-8").tolist()
+        self._doc_id_to_idx.update((doc_id, shard_start + idx) for idx, doc_id in enumerate(doc_ids))
+        self._shard_starts.append(shard_start)
+        doc_lengths = torch.load(index_dir / "doc_lengths.pt", weights_only=True)
+        self._doc_offsets.append(torch.nn.functional.pad(torch.cumsum(doc_lengths, dim=0), (1, 0)))
+
+    def get(self, key: str) -> BiEncoderEmbedding | None:
+        """Looks up the embedding of a single document. Embeddings that are only found in the index are moved into
+        memory.
+
+        :param key: Document id
+        :type key: str
+        :return: Embedding of shape [1 x seq_len x embedding_dim] or None if the document is not cached
+        :rtype: BiEncoderEmbedding | None
+        """
+        embedding = super().get(key)
+        if embedding is not None or key not in self._doc_id_to_idx:
+            return embedding
+        idx = self._doc_id_to_idx[key]
+        shard_idx = bisect_right(self._shard_starts, idx) - 1
+        doc_offsets = self._doc_offsets[shard_idx]
+        idx -= self._shard_starts[shard_idx]
+        start, end = int(doc_offsets[idx]), int(doc_offsets[idx + 1])
+        embeddings = self._index_lookups[shard_idx](torch.arange(start, end))
+        embedding = BiEncoderEmbedding(embeddings[None], torch.ones(1, end - start, dtype=torch.bool))
+        self._insert(key, embedding)
+        return embedding
+
+    def encode(
+        self,
+        doc_ids: Sequence[str],
+        encode_fn: Callable[[List[int]], BiEncoderEmbedding],
+        device: torch.device | None = None,
+    ) -> BiEncoderEmbedding:
+        """Embeds documents using cached embeddings where possible. Only documents that are not cached are encoded and
+        added to the cache.
+
+        :param doc_ids: Ids of the documents to embed
+        :type doc_ids: Sequence[str]
+        :param encode_fn: Function that embeds the documents at the given positions of the batch
+        :type encode_fn: Callable[[List[int]], BiEncoderEmbedding]
+        :param device: Device to move the embeddings to, defaults to None
+        :type device: torch.device | None, optional
+        :return: Document embeddings and scoring mask
+        :rtype: BiEncoderEmbedding
+        """
+        return self._encode(doc_ids, encode_fn, device)
@@ -5,10 +5,10 @@ This module defines the model class used to implement bi-encoder models.
 """
 
 import warnings
+from bisect import bisect_right
 from dataclasses import dataclass
-from functools import wraps
 from string import punctuation
-from typing import Callable, Iterable, Literal, Sequence, Tuple, Type, overload
+from typing import Iterable, Literal, Sequence, Tuple, Type, overload
 
 import torch
 from transformers import BatchEncoding
@@ -298,7 +298,8 @@ class BiEncoderModel(LightningIRModel):
         :return: Embeddings and scoring mask
         :rtype: BiEncoderEmbedding
         """
-        embeddings = self._backbone_forward(**encoding).last_hidden_state
+        # with expansion, the embeddings of tokens that are not attended to are still used for scoring
+        embeddings = self._backbone_embeddings(encoding, unpad=not expansion)
         if self.projection is not None:
             embeddings = self.projection(embeddings)
         embeddings = self._sparsification(embeddings, self.config.sparsification)
@@ -369,29 +370,11 @@ class BiEncoderModel(LightningIRModel):
         return scores
 
 
-def _batch_scoring(
-    similarity_function: Callable[[torch.Tensor, torch.Tensor], torch.Tensor]
-) -> Callable[[torch.Tensor, torch.Tensor], torch.Tensor]:
-    """Helper function to batch similarity functions to avoid memory issues with large batch sizes or high numbers
-    of documents per query."""
-    BATCH_SIZE = 1024
-
-    @wraps(similarity_function)
-    def batch_similarity_function(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
-        if x.shape[0] <= BATCH_SIZE:
-            return similarity_function(x, y)
-        out = torch.zeros(x.shape[0], x.shape[1], y.shape[2], device=x.device, dtype=x.dtype)
-        for i in range(0, x.shape[0], BATCH_SIZE):
-            out[i : i + BATCH_SIZE] = similarity_function(x[i : i + BATCH_SIZE], y[i : i + BATCH_SIZE])
-        return out
-
-    return batch_similarity_function
-
-
 class ScoringFunction(torch.nn.Module):
     def __init__(self, config: BiEncoderConfig) -> None:
         """Scoring function for bi-encoder models. Computes similarity scores between query and document embeddings. For
-        multi-vector models, the scores are aggregated to a single score per query-document pair.
+        multi-vector models, the scores are aggregated to a single score per query-document pair. Query--document
+        pairs are scored in chunks whose intermediate tensors fit into the memory budget of the configuration.
 
         :param config: Configuration for the bi-encoder model
         :type config: BiEncoderConfig
@@ -399,6 +382,7 @@ class ScoringFunction(torch.nn.Module):
         """
         super().__init__()
         self.config = config
+        self.memory_budget = config.memory_budget
         if self.config.similarity_function == "cosine":
             self.similarity_function = self._cosine_similarity
         elif self.config.similarity_function == "l2":
@@ -412,25 +396,128 @@ class ScoringFunction(torch.nn.Module):
     def _compute_similarity(
         self, query_embeddings: BiEncoderEmbedding, doc_embeddings: BiEncoderEmbedding
     ) -> torch.Tensor:
-        """Computes the similarity score between all query and document embedding vector pairs."""
-        # TODO compute similarity only for non-masked values
-        similarity = self.similarity_function(query_embeddings.embeddings, doc_embeddings.embeddings)
-        return similarity
+        """Computes the similarity score between all query and document embedding vector pairs of a group of
+        documents per query. The query embeddings of shape [num_queries x query_len x dim] are broadcast against the
+        document embeddings of shape [num_queries x num_docs x doc_len x dim] and the similarities have the shape
+        [num_queries x query_len x num_docs x doc_len]."""
+        num_queries, num_docs, doc_length, dim = doc_embeddings.embeddings.shape
+        similarity = self.similarity_function(
+            query_embeddings.embeddings, doc_embeddings.embeddings.reshape(num_queries, num_docs * doc_length, dim)
+        )
+        return similarity.view(num_queries, -1, num_docs, doc_length)
+
+    def _packed_scores(
+        self, query_embeddings: BiEncoderEmbedding, doc_embeddings: BiEncoderEmbedding, num_docs: torch.Tensor
+    ) -> torch.Tensor:
+        """Computes relevance scores on packed embeddings. Only the non-masked query and document vectors are
+        gathered, and the vectors of every query are only compared with the non-masked vectors of its own documents.
+        Neither masked vectors nor repeated query embeddings are materialized.
+
+        :param query_embeddings: Embeddings and scoring mask for the queries
+        :type query_embeddings: BiEncoderEmbedding
+        :param doc_embeddings: Embeddings and scoring mask for the documents
+        :type doc_embeddings: BiEncoderEmbedding
+        :param num_docs: Number of documents per query
+        :type num_docs: torch.Tensor
+        :return: Relevance scores
+        :rtype: torch.Tensor
+        """
+        query_vectors = query_embeddings.embeddings[query_embeddings.scoring_mask]
+        doc_vectors = doc_embeddings.embeddings[doc_embeddings.scoring_mask]
+        doc_lengths = doc_embeddings.scoring_mask.sum(dim=1)
+        # segment offsets of the vectors of every query, of the documents of every query, and of their vectors
+        query_offsets = torch.nn.functional.pad(query_embeddings.scoring_mask.sum(dim=1).cumsum(0), (1, 0))
+        doc_offsets = torch.nn.functional.pad(num_docs.cumsum(0), (1, 0))
+        doc_vector_offsets = torch.nn.functional.pad(doc_lengths.cumsum(0), (1, 0))
+        doc_idcs = torch.arange(doc_lengths.shape[0], device=doc_lengths.device).repeat_interleave(doc_lengths)
+        query_offsets_list = query_offsets.tolist()
+        doc_offsets_list = doc_offsets.tolist()
+        doc_vector_offsets_list = doc_vector_offsets.tolist()
+
+        scores = []
+        for query_idx in range(num_docs.shape[0]):
+            query = query_vectors[query_offsets_list[query_idx] : query_offsets_list[query_idx + 1]]
+            doc_start, doc_end = doc_offsets_list[query_idx], doc_offsets_list[query_idx + 1]
+            if not query.shape[0]:
+                # queries without non-masked vectors score like fully masked queries on the padded path
+                no_similarity = query.new_zeros((1, doc_end - doc_start))
+                no_mask = torch.zeros_like(no_similarity, dtype=torch.bool)
+                scores.append(self._aggregate(no_similarity, no_mask, self.query_aggregation_function, 0)[0])
+                continue
+            # number of document vectors whose similarities with the query vectors fit into the memory budget
+            max_vectors = self.memory_budget // self._bytes_per_doc_vector(query.shape[0], query_vectors)
+            while doc_start < doc_end:
+                # extend the chunk by whole documents while their vectors fit, but by at least one document
+                chunk_end = bisect_right(
+                    doc_vector_offsets_list,
+                    doc_vector_offsets_list[doc_start] + max_vectors,
+                    doc_start + 1,
+                    doc_end + 1,
+                )
+                chunk_end = max(chunk_end - 1, doc_start + 1)
+                vector_start, vector_end = doc_vector_offsets_list[doc_start], doc_vector_offsets_list[chunk_end]
+                similarity = self.similarity_function(query[None], doc_vectors[None, vector_start:vector_end])[0]
+                # max over the vectors of every document, documents without non-masked vectors score -inf
+                segment_idcs = (doc_idcs[vector_start:vector_end] - doc_start).expand_as(similarity)
+                max_similarity = similarity.new_full((query.shape[0], chunk_end - doc_start), float("-inf"))
+                max_similarity = max_similarity.scatter_reduce(1, segment_idcs, similarity, "amax", include_self=False)
+                scores.append(self._aggregate(max_similarity, None, self.query_aggregation_function, 0)[0])
+                doc_start = chunk_end
+        return torch.cat(scores)
+
+    def _bytes_per_doc_vector(self, query_length: int, embeddings: torch.Tensor) -> int:
+        """Number of bytes of the intermediate tensors per document vector that is compared with the vectors of a
+        query: the similarities and their masked or reduced copy, and, for cosine similarity, the normalized copy of
+        the document vector."""
+        num_elements = 2 * max(query_length, 1)
+        if self.config.similarity_function == "cosine":
+            num_elements += embeddings.shape[-1]
+        return num_elements * embeddings.element_size()
+
+    @staticmethod
+    def _use_packed_scoring(
+        query_embeddings: BiEncoderEmbedding, doc_embeddings: BiEncoderEmbedding, num_docs: torch.Tensor
+    ) -> bool:
+        """Decides whether to score on packed embeddings. Packing only compares non-masked vectors but loops over the
+        queries, while the broadcast path compares all vectors of the padded query--document groups in a few batched
+        operations. Packing is therefore only used if it compares less than half as many vector pairs.
+
+        :param query_embeddings: Embeddings and scoring mask for the queries
+        :type query_embeddings: BiEncoderEmbedding
+        :param doc_embeddings: Embeddings and scoring mask for the documents
+        :type doc_embeddings: BiEncoderEmbedding
+        :param num_docs: Number of documents per query
+        :type num_docs: torch.Tensor
+        :return: Whether to score on packed embeddings
+        :rtype: bool
+        """
+        query_mask, doc_mask = query_embeddings.scoring_mask, doc_embeddings.scoring_mask
+        if query_mask.all() and doc_mask.all():
+            return False
+        num_queries = num_docs.shape[0]
+        query_idcs = torch.arange(num_queries, device=num_docs.device).repeat_interleave(num_docs)
+        doc_vectors = torch.zeros(num_queries, dtype=torch.long, device=num_docs.device)
+        doc_vectors = doc_vectors.index_add_(0, query_idcs, doc_mask.sum(dim=1))
+        packed_pairs = (query_mask.sum(dim=1) * doc_vectors).sum()
+        padded_pairs = num_queries * int(num_docs.max().item()) * query_mask.shape[1] * doc_mask.shape[1]
+        return bool(2 * packed_pairs < padded_pairs)
+
+    # similarity functions between all pairs of vectors of shape [batch_size x num_x x dim] and [batch_size x num_y x
+    # dim], computed with batched matrix multiplications without materializing the broadcasted pairs
 
     @staticmethod
-    @_batch_scoring
     def _cosine_similarity(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
-        return torch.nn.functional.cosine_similarity(x, y, dim=-1)
+        x = torch.nn.functional.normalize(x, dim=-1)
+        y = torch.nn.functional.normalize(y, dim=-1)
+        return torch.bmm(x, y.transpose(-1, -2))
 
     @staticmethod
-    @_batch_scoring
     def _l2_similarity(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
-        return -1 * torch.cdist(x, y).squeeze(-2)
+        return -1 * torch.cdist(x, y)
 
     @staticmethod
-    @_batch_scoring
     def _dot_similarity(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
-        return torch.matmul(x, y.transpose(-1, -2)).squeeze(-2)
+        return torch.bmm(x, y.transpose(-1, -2))
 
     def _parse_num_docs(
         self,
@@ -451,16 +538,21 @@ class ScoringFunction(torch.nn.Module):
             num_docs = [doc_embeddings.embeddings.shape[0] // batch_size] * batch_size
         return torch.tensor(num_docs, device=query_embeddings.embeddings.device)
 
-    def _expand_query_embeddings(self, embeddings: BiEncoderEmbedding, num_docs: torch.Tensor) -> BiEncoderEmbedding:
-        """Helper function to expand query embeddings to match the number of documents per query."""
-        return BiEncoderEmbedding(
-            embeddings.embeddings.repeat_interleave(num_docs, dim=0).unsqueeze(2),
-            embeddings.scoring_mask.repeat_interleave(num_docs, dim=0).unsqueeze(2),
-        )
-
-    def _expand_doc_embeddings(self, embeddings: BiEncoderEmbedding, num_docs: torch.Tensor) -> BiEncoderEmbedding:
-        """Helper function to expand document embeddings to match the number documents per query."""
-        return BiEncoderEmbedding(embeddings.embeddings.unsqueeze(1), embeddings.scoring_mask.unsqueeze(1))
+    def _group_doc_embeddings(self, embeddings: BiEncoderEmbedding, num_docs: torch.Tensor) -> BiEncoderEmbedding:
+        """Helper function to group the document embeddings by query into the shape [num_queries x max_num_docs x
+        doc_len x dim]. Groups with fewer documents are padded with masked documents."""
+        num_queries = num_docs.shape[0]
+        max_num_docs = int(num_docs.max().item()) if num_queries else 0
+        if bool((num_docs == max_num_docs).all()):
+            return BiEncoderEmbedding(
+                embeddings.embeddings.view(num_queries, max_num_docs, *embeddings.embeddings.shape[1:]),
+                embeddings.scoring_mask.view(num_queries, max_num_docs, -1),
+            )
+        doc_offsets = torch.nn.functional.pad(num_docs.cumsum(0), (1, 0))[:-1]
+        doc_slots = torch.arange(max_num_docs, device=num_docs.device)
+        valid = doc_slots[None] < num_docs[:, None]
+        doc_idcs = (doc_offsets[:, None] + doc_slots[None]).clamp(max=embeddings.embeddings.shape[0] - 1)
+        return BiEncoderEmbedding(embeddings.embeddings[doc_idcs], embeddings.scoring_mask[doc_idcs] & valid[..., None])
 
     def _aggregate(
         self,
@@ -487,12 +579,17 @@ class ScoringFunction(torch.nn.Module):
         else:
             num_non_masked = mask.sum(dim, keepdim=True)
         if query_aggregation_function == "mean":
+            if mask is not None:
+                scores = scores.masked_fill(~mask, 0)
             return torch.where(num_non_masked == 0, 0, scores.sum(dim, keepdim=True) / num_non_masked)
         if query_aggregation_function == "harmonic_mean":
+            inverse_scores = 1 / scores
+            if mask is not None:
+                inverse_scores = inverse_scores.masked_fill(~mask, 0)
             return torch.where(
                 num_non_masked == 0,
                 0,
-                num_non_masked / (1 / scores).sum(dim, keepdim=True),
+                num_non_masked / inverse_scores.sum(dim, keepdim=True),
             )
         raise ValueError(f"Unknown aggregation {query_aggregation_function}")
 
@@ -518,9 +615,45 @@ class ScoringFunction(torch.nn.Module):
         :rtype: torch.Tensor
         """
         num_docs_t = self._parse_num_docs(query_embeddings, doc_embeddings, num_docs)
-        query_embeddings = self._expand_query_embeddings(query_embeddings, num_docs_t)
-        doc_embeddings = self._expand_doc_embeddings(doc_embeddings, num_docs_t)
+        if self._use_packed_scoring(query_embeddings, doc_embeddings, num_docs_t):
+            return self._packed_scores(query_embeddings, doc_embeddings, num_docs_t)
+        grouped_doc_embeddings = self._group_doc_embeddings(doc_embeddings, num_docs_t)
+        num_queries, max_num_docs = grouped_doc_embeddings.scoring_mask.shape[:2]
+        # number of query--document pairs whose intermediate tensors fit into the memory budget, chunks of documents
+        # are additionally copied when their vectors are flattened
+        query_length = query_embeddings.embeddings.shape[1]
+        doc_length, dim = grouped_doc_embeddings.embeddings.shape[2:]
+        bytes_per_vector = self._bytes_per_doc_vector(query_length, query_embeddings.embeddings)
+        bytes_per_pair = doc_length * (bytes_per_vector + dim * query_embeddings.embeddings.element_size())
+        num_pairs = max(1, self.memory_budget // max(bytes_per_pair, 1))
+        docs_per_chunk = max(1, min(max_num_docs, num_pairs))
+        queries_per_chunk = max(1, num_pairs // max(max_num_docs, 1))
+
+        scores = []
+        for query_start in range(0, num_queries, queries_per_chunk):
+            query_slice = slice(query_start, query_start + queries_per_chunk)
+            chunk_query_embeddings = BiEncoderEmbedding(
+                query_embeddings.embeddings[query_slice], query_embeddings.scoring_mask[query_slice]
+            )
+            chunk_scores = []
+            for doc_start in range(0, max_num_docs, docs_per_chunk):
+                doc_slice = slice(doc_start, doc_start + docs_per_chunk)
+                chunk_doc_embeddings = BiEncoderEmbedding(
+                    grouped_doc_embeddings.embeddings[query_slice, doc_slice],
+                    grouped_doc_embeddings.scoring_mask[query_slice, doc_slice],
+                )
+                chunk_scores.append(self._score_groups(chunk_query_embeddings, chunk_doc_embeddings))
+            scores.append(torch.cat(chunk_scores, dim=1))
+        valid = torch.arange(max_num_docs, device=num_docs_t.device)[None] < num_docs_t[:, None]
+        return torch.cat(scores)[valid]
+
+    def _score_groups(self, query_embeddings: BiEncoderEmbedding, doc_embeddings: BiEncoderEmbedding) -> torch.Tensor:
+        """Computes the similarities of a chunk of queries and their grouped documents and directly reduces them to
+        relevance scores of shape [num_queries x num_docs], so only the similarities of a single chunk are stored at a
+        time."""
         similarity = self._compute_similarity(query_embeddings, doc_embeddings)
-        scores = self._aggregate(similarity, doc_embeddings.scoring_mask, "max", -1)
-        scores = self._aggregate(scores, query_embeddings.scoring_mask, self.query_aggregation_function, -2)
-        return scores[..., 0, 0]
+        scores = self._aggregate(similarity, doc_embeddings.scoring_mask[:, None], "max", -1)
+        scores = self._aggregate(
+            scores, query_embeddings.scoring_mask[:, :, None, None], self.query_aggregation_function, 1
+        )
+        return scores[:, 0, :, 0]
@@ -5,15 +5,18 @@ This module defines the Lightning IR module class used to implement bi-encoder m
 """
 
 from pathlib import Path
-from typing import List, Sequence, Tuple
+from typing import Dict, List, Sequence, Tuple
 
 import torch
+from lightning.pytorch.trainer.states import TrainerFn
+from transformers import BatchEncoding
 
 from ..base import LightningIRModule, LightningIROutput
 from ..data import IndexBatch, RankBatch, SearchBatch, TrainBatch
 from ..loss.loss import EmbeddingLossFunction, InBatchLossFunction, LossFunction, ScoringLossFunction
-from ..retrieve import SearchConfig, Searcher
+from ..retrieve import SearchConfig, Searcher, ShardedSearcher
 from .config import BiEncoderConfig
+from .embedding_cache import DocEmbeddingCache, QueryEmbeddingCache
 from .model import BiEncoderEmbedding, BiEncoderModel, BiEncoderOutput
 from .tokenizer import BiEncoderTokenizer
 
@@ -28,6 +31,8 @@ class BiEncoderModule(LightningIRModule):
         evaluation_metrics: Sequence[str] | None = None,
         index_dir: Path | None = None,
         search_config: SearchConfig | None = None,
+        query_cache: QueryEmbeddingCache | None = None,
+        doc_cache: DocEmbeddingCache | None = None,
     ):
         """:class:`.LightningIRModule` for bi-encoder models. It contains a :class:`.BiEncoderModel` and a
         :class:`.BiEncoderTokenizer` and implements the training, validation, and testing steps for the model.
@@ -48,6 +53,12 @@ class BiEncoderModule(LightningIRModule):
         :type index_dir: Path | None, optional
         :param search_config: Configuration to use during retrieval, defaults to None
         :type search_config: SearchConfig | None, optional
+        :param query_cache: Cache of query embeddings used outside of fitting to skip encoding repeated queries,
+            defaults to None
+        :type query_cache: QueryEmbeddingCache | None, optional
+        :param doc_cache: Cache of document embeddings used outside of fitting to skip encoding documents that were
+            already encoded when re-ranking, defaults to None
+        :type doc_cache: DocEmbeddingCache | None, optional
         """
         super().__init__(model_name_or_path, config, model, loss_functions, evaluation_metrics)
         self.model: BiEncoderModel
@@ -59,23 +70,29 @@ class BiEncoderModule(LightningIRModule):
         self._searcher = None
         self.search_config = search_config
         self.index_dir = index_dir
+        self.query_cache = query_cache
+        self.doc_cache = doc_cache
+        self._query_fingerprint: str | None = None
 
     @property
-    def searcher(self) -> Searcher | None:
+    def searcher(self) -> Searcher | ShardedSearcher | None:
         """Searcher used for retrieval if `index_dir` and `search_config` are set.
 
         :return: Searcher class
-        :rtype: Searcher | None
+        :rtype: Searcher | ShardedSearcher | None
         """
         return self._searcher
 
     @searcher.setter
-    def searcher(self, searcher: Searcher):
+    def searcher(self, searcher: Searcher | ShardedSearcher):
         self._searcher = searcher
 
     def _init_searcher(self) -> None:
         if self.search_config is not None and self.index_dir is not None:
-            self.searcher = self.search_config.search_class(self.index_dir, self.search_config, self)
+            if ShardedSearcher.is_sharded(self.index_dir):
+                self.searcher = ShardedSearcher(self.index_dir, self.search_config, self)
+            else:
+                self.searcher = self.search_config.search_class(self.index_dir, self.search_config, self)
 
     def on_test_start(self) -> None:
         """Called at the beginning of testing. Initializes the searcher if `index_dir` and `search_config` are set."""
@@ -87,7 +104,8 @@ class BiEncoderModule(LightningIRModule):
         the batch is a :class`.RankBatch`, query and document embeddings are computed and the relevance score is
         computed using the :attr:`.scoring_function`. If the batch is an :class:`.IndexBatch`, only document embeddings
         are comuputed. If the batch is a :class:`.SearchBatch`, only query embeddings are computed and
-        the model will additionally retrieve documents if :attr:`.searcher` is set.
+        the model will additionally retrieve documents if :attr:`.searcher` is set. Outside of fitting, query and
+        document embeddings are looked up in :attr:`.query_cache` and :attr:`.doc_cache` if they are set.
 
         :param batch: Input batch containg
         :type batch: RankBatch | IndexBatch | SearchBatch
@@ -97,17 +115,48 @@ class BiEncoderModule(LightningIRModule):
         """
         queries = getattr(batch, "queries", None)
         docs = getattr(batch, "docs", None)
+        doc_input_ids = getattr(batch, "doc_input_ids", None)
         num_docs = None
         if isinstance(batch, RankBatch):
             num_docs = None if docs is None else [len(d) for d in docs]
             docs = [d for nested in docs for d in nested] if docs is not None else None
-        encodings = self.prepare_input(queries, docs, num_docs)
+            if doc_input_ids is not None:
+                doc_input_ids = [ids for nested in doc_input_ids for ids in nested]
+        encodings = batch.encodings
+        if encodings is None and doc_input_ids is not None:
+            # documents were pre-tokenized, only pad them
+            encodings = self.tokenizer.tokenize(
+                queries, docs, doc_input_ids=doc_input_ids, return_tensors="pt", padding=True, truncation=True
+            )
+        query_embeddings = None
+        use_caches = self._use_embedding_caches()
+        if self.query_cache is not None and queries is not None and use_caches:
+            query_embeddings = self._encode_cached_queries(queries)
+            queries = None
+            if encodings is not None:
+                encodings = {key: value for key, value in encodings.items() if key != "query_encoding"}
+        doc_embeddings = None
+        doc_ids = getattr(batch, "doc_ids", None)
+        if self.doc_cache is not None and isinstance(batch, RankBatch) and doc_ids is not None and use_caches:
+            doc_ids = [doc_id for nested in doc_ids for doc_id in nested]
+            doc_embeddings = self._encode_cached_docs(doc_ids, docs, encodings)
+            docs = None
+            if encodings is not None:
+                encodings = {key: value for key, value in encodings.items() if key != "doc_encoding"}
+        encodings = self.prepare_input(queries, docs, num_docs, encodings)
 
-        if not encodings:
+        if not encodings and query_embeddings is None and doc_embeddings is None:
             raise ValueError("No encodings were generated.")
         output = self.model.forward(
             encodings.get("query_encoding", None), encodings.get("doc_encoding", None), num_docs
         )
+        if query_embeddings is not None or doc_embeddings is not None:
+            if query_embeddings is not None:
+                output.query_embeddings = query_embeddings
+            if doc_embeddings is not None:
+                output.doc_embeddings = doc_embeddings
+            if output.query_embeddings is not None and output.doc_embeddings is not None:
+                output.scores = self.model.score(output.query_embeddings, output.doc_embeddings, num_docs)
         if isinstance(batch, SearchBatch) and self.searcher is not None:
             scores, doc_ids, num_docs = self.searcher.search(output)
             output.scores = scores
@@ -116,6 +165,47 @@ class BiEncoderModule(LightningIRModule):
             batch.doc_ids = doc_ids
         return output
 
+    def _use_embedding_caches(self) -> bool:
+        # the weights change while fitting, so embeddings are neither cached during training nor during validation
+        return not self.training and not (self._trainer is not None and self.trainer.state.fn == TrainerFn.FITTING)
+
+    def on_train_end(self) -> None:
+        """Called at the end of training. Cached document embeddings were computed with the weights before training
+        and are removed, and the query cache fingerprint is recomputed from the new weights."""
+        super().on_train_end()
+        self._query_fingerprint = None
+        if self.doc_cache is not None:
+            self.doc_cache.clear()
+
+    def _encode_cached_queries(self, queries: Sequence[str]) -> BiEncoderEmbedding:
+        """Embeds queries using the query cache, only queries that are not cached are tokenized and encoded."""
+        assert self.query_cache is not None
+        if self._query_fingerprint is None:
+            self._query_fingerprint = QueryEmbeddingCache.fingerprint(self.model)
+
+        def encode_fn(uncached_queries: Sequence[str]) -> BiEncoderEmbedding:
+            query_encoding = self.prepare_input(uncached_queries, None, None)["query_encoding"]
+            return self.model.encode_query(query_encoding)
+
+        return self.query_cache.encode(queries, encode_fn, self._query_fingerprint, self.device)
+
+    def _encode_cached_docs(
+        self, doc_ids: Sequence[str], docs: Sequence[str] | None, encodings: Dict[str, BatchEncoding] | None
+    ) -> BiEncoderEmbedding:
+        """Embeds documents using the document cache, only documents that are not cached are encoded."""
+        assert self.doc_cache is not None
+
+        def encode_fn(idcs: List[int]) -> BiEncoderEmbedding:
+            if encodings is not None and "doc_encoding" in encodings:
+                doc_encoding = BatchEncoding({key: value[idcs] for key, value in encodings["doc_encoding"].items()})
+                doc_encoding = self.prepare_input(None, None, None, {"doc_encoding": doc_encoding})["doc_encoding"]
+            else:
+                assert docs is not None
+                doc_encoding = self.prepare_input(None, [docs[idx] for idx in idcs], None)["doc_encoding"]
+            return self.model.encode_doc(doc_encoding)
+
+        return self.doc_cache.encode(doc_ids, encode_fn, self.device)
+
     def score(self, queries: Sequence[str] | str, docs: Sequence[Sequence[str]] | Sequence[str]) -> BiEncoderOutput:
         """Computes relevance scores for queries and documents.
 
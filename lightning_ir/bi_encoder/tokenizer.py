@@ -5,8 +5,9 @@ This module contains the tokenizer class bi-encoder models.
 """
 
 import warnings
-from typing import Dict, Sequence, Type
+from typing import Dict, List, Sequence, Type
 
+import numpy as np
 from tokenizers.processors import TemplateProcessing
 from transformers import BatchEncoding, BertTokenizer, BertTokenizerFast
 
@@ -210,10 +211,58 @@ https://huggingface.co/docs/transformers/en/main_classes/tokenizer#transformers.
             self._expand(encoding, self.attend_to_doc_expanded_tokens)
         return encoding
 
+    def pre_tokenize_doc(self, docs: Sequence[str]) -> List[List[int]]:
+        """Tokenizes input documents without padding or expansion, e.g., to cache the token ids of a corpus. Use
+        :meth:`.pad_doc` to turn the token ids into the same encoding as :meth:`.tokenize_doc`.
+
+        :param docs: Documents to tokenize
+        :type docs: Sequence[str]
+        :return: Token ids of the documents
+        :rtype: List[List[int]]
+        """
+        encoding = self._encode(
+            docs,
+            post_processor=self.doc_post_processor,
+            max_length=self.doc_length,
+            truncation=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return encoding["input_ids"]
+
+    def pad_doc(self, doc_input_ids: Sequence[Sequence[int]], **kwargs) -> BatchEncoding:
+        """Pads pre-tokenized documents (see :meth:`.pre_tokenize_doc`) and applies document expansion.
+
+        :param doc_input_ids: Token ids of the documents
+        :type doc_input_ids: Sequence[Sequence[int]]
+        :return: Tokenized documents
+        :rtype: BatchEncoding
+        """
+        features = {
+            "input_ids": [np.asarray(input_ids).tolist() for input_ids in doc_input_ids],
+        }
+        if "token_type_ids" in self.model_input_names:
+            features["token_type_ids"] = [[0] * len(input_ids) for input_ids in features["input_ids"]]
+        # the pre-tokenized documents are already truncated, max_length is only needed to pad expanded documents
+        kwargs.pop("truncation", None)
+        kwargs.pop("max_length", None)
+        if self.doc_expansion:
+            kwargs["max_length"] = self.doc_length
+            kwargs["padding"] = "max_length"
+        else:
+            kwargs["padding"] = True
+        if kwargs.get("return_tensors", None) is not None:
+            kwargs["pad_to_multiple_of"] = 8
+        encoding = self.pad(features, **kwargs)
+        if self.doc_expansion:
+            self._expand(encoding, self.attend_to_doc_expanded_tokens)
+        return encoding
+
     def tokenize(
         self,
         queries: str | Sequence[str] | None = None,
         docs: str | Sequence[str] | None = None,
+        doc_input_ids: Sequence[Sequence[int]] | None = None,
         **kwargs,
     ) -> Dict[str, BatchEncoding]:
         """Tokenizes queries and documents.
@@ -222,6 +271,9 @@ https://huggingface.co/docs/transformers/en/main_classes/tokenizer#transformers.
         :type queries: str | Sequence[str] | None, optional
         :param docs: Documents to tokenize, defaults to None
         :type docs: str | Sequence[str] | None, optional
+        :param doc_input_ids: Pre-tokenized documents (see :meth:`.pre_tokenize_doc`) which are only padded. Takes
+            precedence over `docs`, defaults to None
+        :type doc_input_ids: Sequence[Sequence[int]] | None, optional
         :return: Dictionary of tokenized queries and documents
         :rtype: Dict[str, BatchEncoding]
         """
@@ -229,6 +281,8 @@ https://huggingface.co/docs/transformers/en/main_classes/tokenizer#transformers.
         kwargs.pop("num_docs", None)
         if queries is not None:
             encodings["query_encoding"] = self.tokenize_query(queries, **kwargs)
-        if docs is not None:
+        if doc_input_ids is not None:
+            encodings["doc_encoding"] = self.pad_doc(doc_input_ids, **kwargs)
+        elif docs is not None:
             encodings["doc_encoding"] = self.tokenize_doc(docs, **kwargs)
         return encodings
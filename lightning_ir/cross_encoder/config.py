@@ -4,7 +4,7 @@ Configuration module for cross-encoder models.
 This module defines the configuration class used to instantiate cross-encoder models.
 """
 
-from typing import Literal
+from typing import Literal, Sequence
 
 from ..base import LightningIRConfig
 
@@ -13,7 +13,9 @@ class CrossEncoderConfig(LightningIRConfig):
     model_type: str = "cross-encoder"
     """Model type for cross-encoder models."""
 
-    ADDED_ARGS = LightningIRConfig.ADDED_ARGS.union({"pooling_strategy", "linear_bias"})
+    ADDED_ARGS = LightningIRConfig.ADDED_ARGS.union(
+        {"pooling_strategy", "linear_bias", "exit_layers", "exit_k", "exit_margin"}
+    )
     """Arguments added to the configuration."""
 
     def __init__(
@@ -22,6 +24,9 @@ class CrossEncoderConfig(LightningIRConfig):
         doc_length: int = 512,
         pooling_strategy: Literal["first", "mean", "max", "sum"] = "first",
         linear_bias: bool = False,
+        exit_layers: Sequence[int] | None = None,
+        exit_k: int = 10,
+        exit_margin: float = 0.0,
         **kwargs
     ):
         """Configuration class for a cross-encoder model
@@ -35,7 +40,20 @@ class CrossEncoderConfig(LightningIRConfig):
         :type pooling_strategy: Literal['first', 'mean', 'max', 'sum'], optional
         :param linear_bias: Whether to use a bias in the prediction linear layer, defaults to False
         :type linear_bias: bool, optional
+        :param exit_layers: Layers after which the candidates are scored with the pooling and linear layer of the
+            model. At inference, candidates whose score after an exit layer cannot reach the top-k candidates of their
+            query are not encoded by the remaining layers. None disables early exiting, defaults to None
+        :type exit_layers: Sequence[int] | None, optional
+        :param exit_k: Number of top candidates per query whose scores a candidate must reach to pass an exit layer,
+            defaults to 10
+        :type exit_k: int, optional
+        :param exit_margin: Margin below the k-th highest score of a query within which candidates still pass an exit
+            layer, defaults to 0.0
+        :type exit_margin: float, optional
         """
         super().__init__(query_length=query_length, doc_length=doc_length, **kwargs)
         self.pooling_strategy = pooling_strategy
         self.linear_bias = linear_bias
+        self.exit_layers = sorted(set(exit_layers)) if exit_layers is not None else None
+        self.exit_k = exit_k
+        self.exit_margin = exit_margin
@@ -5,7 +5,7 @@ This module defines the model class used to implement cross-encoder models.
 """
 
 from dataclasses import dataclass
-from typing import Type
+from typing import Sequence, Tuple, Type
 
 import torch
 from transformers import BatchEncoding
@@ -21,6 +21,10 @@ class CrossEncoderOutput(LightningIROutput):
 
     embeddings: torch.Tensor | None = None
     """Joint query-document embeddings"""
+    exit_scores: torch.Tensor | None = None
+    """Scores of the candidates after each exit layer of shape [batch_size x num_exit_layers]"""
+    num_layers: torch.Tensor | None = None
+    """Number of layers each candidate was encoded with when exiting early"""
 
 
 class CrossEncoderModel(LightningIRModel):
@@ -37,6 +41,10 @@ class CrossEncoderModel(LightningIRModel):
         super().__init__(config, *args, **kwargs)
         self.config: CrossEncoderConfig
         self.linear = torch.nn.Linear(config.hidden_size, 1, bias=config.linear_bias)
+        num_hidden_layers = getattr(config, "num_hidden_layers", None)
+        if config.exit_layers is not None and num_hidden_layers is not None:
+            if any(not 0 < exit_layer < num_hidden_layers for exit_layer in config.exit_layers):
+                raise ValueError(f"Exit layers must be between 1 and {num_hidden_layers - 1}")
 
     @batch_encoding_wrapper
     def forward(self, encoding: BatchEncoding) -> CrossEncoderOutput:
@@ -48,9 +56,134 @@ class CrossEncoderModel(LightningIRModel):
         :return: Output of the model
         :rtype: CrossEncoderOutput
         """
-        embeddings = self._backbone_forward(**encoding).last_hidden_state
-        embeddings = self._pooling(
-            embeddings, encoding.get("attention_mask", None), pooling_strategy=self.config.pooling_strategy
+        attention_mask = encoding.get("attention_mask", None)
+        exit_scores = None
+        if self.config.exit_layers is not None:
+            hidden_states = self._backbone_forward(**encoding, output_hidden_states=True).hidden_states
+            embeddings = hidden_states[-1]
+            exit_scores = torch.stack(
+                [self._score(hidden_states[exit_layer], attention_mask)[0] for exit_layer in self.config.exit_layers],
+                dim=1,
+            )
+        else:
+            embeddings = self._backbone_embeddings(encoding)
+        scores, embeddings = self._score(embeddings, attention_mask)
+        return CrossEncoderOutput(scores=scores, embeddings=embeddings, exit_scores=exit_scores)
+
+    def _score(
+        self, embeddings: torch.Tensor, attention_mask: torch.Tensor | None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        embeddings = self._pooling(embeddings, attention_mask, pooling_strategy=self.config.pooling_strategy)
+        return self.linear(embeddings).view(-1), embeddings
+
+    def early_exit_forward(self, encoding: BatchEncoding, num_docs: Sequence[int]) -> CrossEncoderOutput:
+        """Computes relevance scores and skips the remaining layers for candidates that cannot reach the top-k
+        candidates of their query. After every exit layer, the candidates are scored with the pooling and linear layer
+        of the model and only the candidates within ``exit_margin`` of the ``exit_k``-th highest score of their query
+        are encoded further. Eliminated candidates are ranked below all candidates of their query that passed the
+        exit layer, in the order of their scores at the exit layer. Requires a BERT-style backbone.
+
+        :param encoding: Tokenizer encoding for the joint query-document input sequence
+        :type encoding: BatchEncoding
+        :param num_docs: Number of documents per query
+        :type num_docs: Sequence[int]
+        :raises ValueError: If no exit layers are configured
+        :raises ValueError: If the backbone model does not support early exiting
+        :return: Output of the model with the ranking scores and the number of layers of each candidate
+        :rtype: CrossEncoderOutput
+        """
+        if self.config.exit_layers is None:
+            raise ValueError("No exit layers are configured")
+        embeddings_layer = getattr(self, "embeddings", None)
+        encoder = getattr(self, "encoder", None)
+        if embeddings_layer is None or not hasattr(encoder, "layer"):
+            raise ValueError(f"Early exiting is not supported for {self.__class__.__name__}")
+        input_ids = encoding["input_ids"]
+        attention_mask = encoding.get("attention_mask", torch.ones_like(input_ids))
+        hidden_states = embeddings_layer(input_ids=input_ids, token_type_ids=encoding.get("token_type_ids", None))
+        if hasattr(self, "embeddings_project"):
+            # electra projects the embeddings to the hidden size
+            hidden_states = self.embeddings_project(hidden_states)
+        extended_attention_mask = self.get_extended_attention_mask(attention_mask, input_ids.shape)
+
+        num_exits = len(self.config.exit_layers)
+        stage_scores = hidden_states.new_zeros(input_ids.shape[0], num_exits + 1)
+        exit_stage = torch.full((input_ids.shape[0],), num_exits, dtype=torch.long, device=input_ids.device)
+        idcs = torch.arange(input_ids.shape[0], device=input_ids.device)
+        for layer_idx, layer in enumerate(encoder.layer, start=1):
+            hidden_states = layer(hidden_states, attention_mask=extended_attention_mask)[0]
+            if layer_idx not in self.config.exit_layers:
+                continue
+            stage = self.config.exit_layers.index(layer_idx)
+            stage_scores[idcs, stage] = self._score(hidden_states, attention_mask)[0]
+            alive = torch.zeros_like(exit_stage, dtype=torch.bool)
+            alive[idcs] = True
+            keep = self._eliminate(stage_scores[:, stage], alive, num_docs)[idcs]
+            exit_stage[idcs[~keep]] = stage
+            idcs = idcs[keep]
+            hidden_states = hidden_states[keep]
+            attention_mask = attention_mask[keep]
+            extended_attention_mask = extended_attention_mask[keep]
+        stage_scores[idcs, num_exits] = self._score(hidden_states, attention_mask)[0]
+
+        num_layers = torch.tensor(self.config.exit_layers + [len(encoder.layer)], device=exit_stage.device)
+        return CrossEncoderOutput(
+            scores=self._rank_scores(stage_scores, exit_stage, num_docs), num_layers=num_layers[exit_stage]
+        )
+
+    def simulate_early_exit(self, output: CrossEncoderOutput, num_docs: Sequence[int]) -> CrossEncoderOutput:
+        """Applies the candidate elimination of :meth:`early_exit_forward` to the output of a full forward pass. As
+        every candidate is encoded independently, the scores equal the scores of :meth:`early_exit_forward`. Used to
+        measure the effectiveness lost by exiting early.
+
+        :param output: Output of :meth:`forward` containing the scores after the exit layers
+        :type output: CrossEncoderOutput
+        :param num_docs: Number of documents per query
+        :type num_docs: Sequence[int]
+        :raises ValueError: If the output does not contain scores after the exit layers
+        :return: Output of the model with the ranking scores and the number of layers of each candidate
+        :rtype: CrossEncoderOutput
+        """
+        if output.scores is None or output.exit_scores is None or self.config.exit_layers is None:
+            raise ValueError("Expected scores and exit_scores in CrossEncoderOutput")
+        stage_scores = torch.cat([output.exit_scores, output.scores.view(-1, 1)], dim=1)
+        num_exits = len(self.config.exit_layers)
+        exit_stage = torch.full_like(output.scores.view(-1), num_exits, dtype=torch.long)
+        alive = torch.ones_like(exit_stage, dtype=torch.bool)
+        for stage in range(num_exits):
+            keep = self._eliminate(stage_scores[:, stage], alive, num_docs)
+            exit_stage[alive & ~keep] = stage
+            alive = keep
+        num_layers = torch.tensor(self.config.exit_layers + [self.config.num_hidden_layers], device=exit_stage.device)
+        return CrossEncoderOutput(
+            scores=self._rank_scores(stage_scores, exit_stage, num_docs), num_layers=num_layers[exit_stage]
         )
-        scores = self.linear(embeddings).view(-1)
-        return CrossEncoderOutput(scores=scores, embeddings=embeddings)
+
+    def _eliminate(self, scores: torch.Tensor, alive: torch.Tensor, num_docs: Sequence[int]) -> torch.Tensor:
+        """Candidates that are alive and score within the margin of the k-th highest score of their query."""
+        keep = alive.clone()
+        for group_scores, group_alive, group_keep in zip(
+            scores.split(list(num_docs)), alive.split(list(num_docs)), keep.split(list(num_docs))
+        ):
+            alive_scores = group_scores[group_alive]
+            if alive_scores.shape[0] <= self.config.exit_k:
+                continue
+            threshold = alive_scores.topk(self.config.exit_k).values[-1] - self.config.exit_margin
+            group_keep &= group_scores >= threshold
+        return keep
+
+    @staticmethod
+    def _rank_scores(stage_scores: torch.Tensor, exit_stage: torch.Tensor, num_docs: Sequence[int]) -> torch.Tensor:
+        """Scores of the candidates at their exit stage, shifted so that candidates eliminated at an earlier stage are
+        ranked below all candidates of their query that passed the stage."""
+        scores = stage_scores.gather(1, exit_stage.unsqueeze(1)).view(-1)
+        for group_scores, group_stage in zip(scores.split(list(num_docs)), exit_stage.split(list(num_docs))):
+            floor = None
+            for stage in range(stage_scores.shape[1] - 1, -1, -1):
+                mask = group_stage == stage
+                if not mask.any():
+                    continue
+                if floor is not None:
+                    group_scores[mask] += floor - 1 - group_scores[mask].max()
+                floor = group_scores[mask].min()
+        return scores
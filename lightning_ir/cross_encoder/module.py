@@ -4,7 +4,7 @@ Module module for cross-encoder models.
 This module defines the Lightning IR module class used to implement cross-encoder models.
 """
 
-from typing import List, Sequence, Tuple
+from typing import Dict, List, Sequence, Tuple
 
 import torch
 
@@ -47,7 +47,10 @@ class CrossEncoderModule(LightningIRModule):
 
     def forward(self, batch: RankBatch | TrainBatch | SearchBatch) -> CrossEncoderOutput:
         """Runs a forward pass of the model on a batch of data and returns the contextualized embeddings from the
-        backbone model as well as the relevance scores.
+        backbone model as well as the relevance scores. If the model has exit layers, candidates that cannot reach the
+        top-k candidates of their query exit early outside of training and validation. During validation, all
+        candidates are encoded by all layers so that the effectiveness of exiting early can be compared to the full
+        model.
 
         :param batch: Batch of data to run the forward pass on
         :type batch: RankBatch | TrainBatch | SearchBatch
@@ -60,10 +63,15 @@ class CrossEncoderModule(LightningIRModule):
         queries = batch.queries
         docs = [d for docs in batch.docs for d in docs]
         num_docs = [len(docs) for docs in batch.docs]
-        encoding = self.prepare_input(queries, docs, num_docs)
+        encoding = self.prepare_input(queries, docs, num_docs, batch.encodings)
+        if self.config.exit_layers is not None and not self.training and not self._validating():
+            return self.model.early_exit_forward(encoding["encoding"], num_docs)
         output = self.model.forward(encoding["encoding"])
         return output
 
+    def _validating(self) -> bool:
+        return self._trainer is not None and self.trainer.validating
+
     def _compute_losses(self, batch: TrainBatch, output: CrossEncoderOutput) -> List[torch.Tensor]:
         """Computes the losses for a training batch."""
         if self.loss_functions is None:
@@ -79,5 +87,33 @@ class CrossEncoderModule(LightningIRModule):
         for loss_function, _ in self.loss_functions:
             if not isinstance(loss_function, ScoringLossFunction):
                 raise RuntimeError(f"Loss function {loss_function} is not a scoring loss function")
-            losses.append(loss_function.compute_loss(output, batch))
+            loss = loss_function.compute_loss(output, batch)
+            if output.exit_scores is not None:
+                # the pooling and linear layer are shared by all exit layers and trained on the scores of every layer
+                for exit_scores in output.exit_scores.unbind(1):
+                    exit_output = CrossEncoderOutput(scores=exit_scores.view(output.scores.shape))
+                    loss = loss + loss_function.compute_loss(exit_output, batch)
+            losses.append(loss)
         return losses
+
+    def validate_metrics(self, output: CrossEncoderOutput, batch: TrainBatch | RankBatch) -> Dict[str, float]:
+        """Validates the model output with the evaluation metrics. If the output contains the scores after the exit
+        layers, the metrics of the ranking with early exiting and the average number of layers the candidates were
+        encoded with are added with the ``early-exit-`` prefix.
+
+        :param output: Model output
+        :type output: CrossEncoderOutput
+        :param batch: Batch of validation or testing data
+        :type batch: TrainBatch | RankBatch
+        :return: Evaluation metrics
+        :rtype: Dict[str, float]
+        """
+        metrics = super().validate_metrics(output, batch)
+        if output.exit_scores is None or output.scores is None or batch.doc_ids is None:
+            return metrics
+        early_exit_output = self.model.simulate_early_exit(output, [len(doc_ids) for doc_ids in batch.doc_ids])
+        for key, value in super().validate_metrics(early_exit_output, batch).items():
+            metrics[f"early-exit-{key}"] = value
+        assert early_exit_output.num_layers is not None
+        metrics["early-exit-layers"] = early_exit_output.num_layers.float().mean().item()
+        return metrics
@@ -4,13 +4,15 @@ Tokenizer module for cross-encoder models.
 This module contains the tokenizer class cross-encoder models.
 """
 
-from typing import Dict, List, Sequence, Tuple, Type
+from typing import Dict, List, Sequence, Tuple, Type, TypeVar
 
 from transformers import BatchEncoding
 
 from ..base import LightningIRTokenizer
 from .config import CrossEncoderConfig
 
+T = TypeVar("T")
+
 
 class CrossEncoderTokenizer(LightningIRTokenizer):
 
@@ -29,55 +31,89 @@ class CrossEncoderTokenizer(LightningIRTokenizer):
         """
         super().__init__(*args, query_length=query_length, doc_length=doc_length, **kwargs)
 
+    def _input_ids(self, text: Sequence[str], max_length: int) -> List[List[int]]:
+        """Encodes a list of texts without special tokens and truncates them to a maximum number of tokens."""
+        return self(
+            text,
+            add_special_tokens=False,
+            truncation=True,
+            max_length=max_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        ).input_ids
+
     def _truncate(self, text: Sequence[str], max_length: int) -> List[str]:
         """Encodes a list of texts, truncates them to a maximum number of tokens and decodes them to strings."""
-        return self.batch_decode(
-            self(
-                text,
-                add_special_tokens=False,
-                truncation=True,
-                max_length=max_length,
-                return_attention_mask=False,
-                return_token_type_ids=False,
-            ).input_ids
-        )
+        return self.batch_decode(self._input_ids(text, max_length))
 
-    def _repeat_queries(self, queries: Sequence[str], num_docs: Sequence[int]) -> List[str]:
+    def _repeat_queries(self, queries: Sequence[T], num_docs: Sequence[int]) -> List[T]:
         """Repeats queries to match the number of documents."""
         return [query for query_idx, query in enumerate(queries) for _ in range(num_docs[query_idx])]
 
-    def _preprocess(
+    def _validate(
         self,
         queries: str | Sequence[str] | None,
         docs: str | Sequence[str] | None,
         num_docs: Sequence[int] | int | None,
-    ) -> Tuple[str | Sequence[str], str | Sequence[str]]:
-        """Preprocesses queries and documents to ensure that they are truncated their respective maximum lengths."""
+    ) -> Tuple[Sequence[str], Sequence[str], Sequence[int]]:
+        """Checks that queries and documents are both provided, wraps single strings in lists, and infers the number of
+        documents per query."""
         if queries is None or docs is None:
             raise ValueError("Both queries and docs must be provided.")
         queries_is_string = isinstance(queries, str)
         docs_is_string = isinstance(docs, str)
         if queries_is_string != docs_is_string:
             raise ValueError("Queries and docs must be both lists or both strings.")
-        if queries_is_string and docs_is_string:
-            queries = [queries]
-            docs = [docs]
+        if isinstance(queries, str) and isinstance(docs, str):
+            return [queries], [docs], [1]
+        if num_docs is None:
+            if len(docs) % len(queries) != 0:
+                raise ValueError("Number of documents must be divisible by the number of queries.")
+            num_docs = [len(docs) // len(queries) for _ in range(len(queries))]
+        elif isinstance(num_docs, int):
+            num_docs = [num_docs] * len(queries)
+        return queries, docs, num_docs
+
+    def _preprocess(
+        self,
+        queries: str | Sequence[str] | None,
+        docs: str | Sequence[str] | None,
+        num_docs: Sequence[int] | int | None,
+    ) -> Tuple[str | Sequence[str], str | Sequence[str]]:
+        """Preprocesses queries and documents to ensure that they are truncated their respective maximum lengths."""
+        is_string = isinstance(queries, str)
+        queries, docs, num_docs = self._validate(queries, docs, num_docs)
         truncated_queries = self._truncate(queries, self.query_length)
         truncated_docs = self._truncate(docs, self.doc_length)
-        if not queries_is_string:
-            if num_docs is None:
-                if isinstance(num_docs, int):
-                    num_docs = [num_docs] * len(queries)
+        if is_string:
+            return truncated_queries[0], truncated_docs[0]
+        return self._repeat_queries(truncated_queries, num_docs), truncated_docs
+
+    def _pair_input_ids(
+        self, query_input_ids: List[int], doc_input_ids: List[int], max_length: int | None
+    ) -> Dict[str, List[int]]:
+        """Joins the token ids of a query and a document and adds special tokens. If the joint sequence exceeds the
+        maximum length, the sequences are truncated like the longest_first strategy of fast tokenizers: only the longer
+        sequence is truncated if that suffices, otherwise both are truncated to half of the maximum length."""
+        if max_length is not None:
+            max_length -= self.num_special_tokens_to_add(pair=True)
+            num_query_tokens, num_doc_tokens = len(query_input_ids), len(doc_input_ids)
+            if num_query_tokens + num_doc_tokens > max_length:
+                num_short, num_long = sorted((num_query_tokens, num_doc_tokens))
+                num_long = max(num_short, max_length - num_short) if num_short <= max_length else num_short
+                if num_short + num_long > max_length:
+                    num_short = max_length // 2
+                    num_long = num_short + max_length % 2
+                if num_query_tokens <= num_doc_tokens:
+                    num_query_tokens, num_doc_tokens = num_short, num_long
                 else:
-                    if len(docs) % len(queries) != 0:
-                        raise ValueError("Number of documents must be divisible by the number of queries.")
-                    num_docs = [len(docs) // len(queries) for _ in range(len(queries))]
-            repeated_queries = self._repeat_queries(truncated_queries, num_docs)
-            docs = truncated_docs
-        else:
-            repeated_queries = truncated_queries[0]
-            docs = truncated_docs[0]
-        return repeated_queries, docs
+                    num_query_tokens, num_doc_tokens = num_long, num_short
+                query_input_ids = query_input_ids[:num_query_tokens]
+                doc_input_ids = doc_input_ids[:num_doc_tokens]
+        pair_input_ids = {"input_ids": self.build_inputs_with_special_tokens(query_input_ids, doc_input_ids)}
+        if "token_type_ids" in self.model_input_names:
+            pair_input_ids["token_type_ids"] = self.create_token_type_ids_from_sequences(query_input_ids, doc_input_ids)
+        return pair_input_ids
 
     def tokenize(
         self,
@@ -86,7 +122,8 @@ class CrossEncoderTokenizer(LightningIRTokenizer):
         num_docs: Sequence[int] | int | None = None,
         **kwargs,
     ) -> Dict[str, BatchEncoding]:
-        """Tokenizes queries and documents into a single sequence of tokens.
+        """Tokenizes queries and documents into a single sequence of tokens. Every query is only tokenized once and its
+        token ids are shared by all query-document sequences of the query.
 
         :param queries: Queries to tokenize, defaults to None
         :type queries: str | Sequence[str] | None, optional
@@ -101,8 +138,23 @@ class CrossEncoderTokenizer(LightningIRTokenizer):
         :return: Tokenized query-document sequence
         :rtype: Dict[str, BatchEncoding]
         """
-        repeated_queries, docs = self._preprocess(queries, docs, num_docs)
+        is_string = isinstance(queries, str)
+        queries, docs, num_docs = self._validate(queries, docs, num_docs)
+        query_input_ids = self._repeat_queries(self._input_ids(queries, self.query_length), num_docs)
+        doc_input_ids = self._input_ids(docs, self.doc_length)
+        max_length = kwargs.get("max_length", None)
+        if max_length is None and kwargs.get("truncation", False):
+            max_length = self.model_max_length
+        pairs = [self._pair_input_ids(*input_ids, max_length) for input_ids in zip(query_input_ids, doc_input_ids)]
         return_tensors = kwargs.get("return_tensors", None)
-        if return_tensors is not None:
-            kwargs["pad_to_multiple_of"] = 8
-        return {"encoding": self(repeated_queries, docs, **kwargs)}
+        encoding = self.pad(
+            pairs[0] if is_string else pairs,
+            padding=kwargs.get("padding", False),
+            max_length=kwargs.get("max_length", None),
+            pad_to_multiple_of=8 if return_tensors is not None else None,
+            return_attention_mask=kwargs.get("return_attention_mask", None),
+            return_tensors=return_tensors,
+        )
+        if kwargs.get("return_token_type_ids", None) is False:
+            encoding.pop("token_type_ids", None)
+        return {"encoding": encoding}
@@ -7,6 +7,7 @@ This module provides classes for handling data in Lightning IR, including data m
 from .data import DocSample, IndexBatch, QuerySample, RankBatch, RankSample, SearchBatch, TrainBatch
 from .datamodule import LightningIRDataModule
 from .dataset import DocDataset, QueryDataset, RunDataset, TupleDataset
+from .tokenized_cache import TokenizedDocCache
 
 __all__ = [
     "DocDataset",
@@ -19,6 +20,7 @@ __all__ = [
     "RankSample",
     "RunDataset",
     "SearchBatch",
+    "TokenizedDocCache",
     "TrainBatch",
     "TupleDataset",
 ]
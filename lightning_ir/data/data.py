@@ -10,6 +10,7 @@ from typing import Any, Dict, List, Sequence
 
 import torch
 from ir_datasets.formats.base import GenericDoc, GenericQuery
+from transformers import BatchEncoding
 
 
 @dataclass
@@ -27,6 +28,10 @@ class RankSample:
     :param targets: Optional list of target labels denoting the relevane of a document for the query
     :type targets: torch.Tensor, optional
     :param qrels: Optional list of dictionaries mapping document ids to relevance labels
+    :param doc_input_ids: Optional list of pre-tokenized document token ids
+    :type doc_input_ids: Sequence[Sequence[int]], optional
+    :param position: Optional position of the sample in the dataset if the samples were sorted by length
+    :type position: int, optional
     """
 
     query_id: str
@@ -35,6 +40,8 @@ class RankSample:
     docs: Sequence[str]
     targets: torch.Tensor | None = None
     qrels: List[Dict[str, Any]] | None = None
+    doc_input_ids: Sequence[Sequence[int]] | None = None
+    position: int | None = None
 
 
 @dataclass
@@ -45,10 +52,13 @@ class QuerySample:
     :type query_id: str
     :param query: Query text
     :type query_id: str
+    :param position: Optional position of the sample in the dataset if the samples were sorted by length
+    :type position: int, optional
     """
 
     query_id: str
     query: str
+    position: int | None = None
 
     @classmethod
     def from_ir_dataset_sample(cls, sample: GenericQuery) -> "QuerySample":
@@ -70,10 +80,16 @@ class DocSample:
     :type doc_id: str
     :param doc: Document text
     :type doc
+    :param doc_input_ids: Optional pre-tokenized document token ids
+    :type doc_input_ids: Sequence[int], optional
+    :param position: Optional position of the sample in the dataset if the samples were sorted by length
+    :type position: int, optional
     """
 
     doc_id: str
     doc: str
+    doc_input_ids: Sequence[int] | None = None
+    position: int | None = None
 
     @classmethod
     def from_ir_dataset_sample(cls, sample: GenericDoc, text_fields: Sequence[str] | None = None) -> "DocSample":
@@ -106,6 +122,13 @@ class RankBatch:
     :type doc_ids: Sequence[Sequence[str]], optional
     :param qrels: Optional list of dictionaries mapping document ids to relevance labels
     :type qrels: List[Dict[str, Any]], optional
+    :param doc_input_ids: Optional list of list of pre-tokenized document token ids
+    :type doc_input_ids: Sequence[Sequence[Sequence[int]]], optional
+    :param encodings: Optional tokenizer encodings of the queries and documents if the batch was tokenized when
+        collating
+    :type encodings: Dict[str, BatchEncoding], optional
+    :param positions: Optional positions of the samples in the dataset if the samples were sorted by length
+    :type positions: Sequence[int], optional
     """
 
     queries: Sequence[str]
@@ -113,6 +136,9 @@ class RankBatch:
     query_ids: Sequence[str] | None = None
     doc_ids: Sequence[Sequence[str]] | None = None
     qrels: List[Dict[str, int]] | None = None
+    doc_input_ids: Sequence[Sequence[Sequence[int]]] | None = None
+    encodings: Dict[str, BatchEncoding] | None = None
+    positions: Sequence[int] | None = None
 
 
 @dataclass
@@ -129,6 +155,13 @@ class TrainBatch(RankBatch):
     :type doc_ids: Sequence[Sequence[str]], optional
     :param qrels: Optional list of dictionaries mapping document ids to relevance labels
     :type qrels: List[Dict[str, Any]], optional
+    :param doc_input_ids: Optional list of list of pre-tokenized document token ids
+    :type doc_input_ids: Sequence[Sequence[Sequence[int]]], optional
+    :param encodings: Optional tokenizer encodings of the queries and documents if the batch was tokenized when
+        collating
+    :type encodings: Dict[str, BatchEncoding], optional
+    :param positions: Optional positions of the samples in the dataset if the samples were sorted by length
+    :type positions: Sequence[int], optional
     :param targets: Optional list of target labels denoting the relevane of a document for the query
     :type targets: torch.Tensor, optional
     """
@@ -144,10 +177,19 @@ class IndexBatch:
     :type doc_ids: Sequence[str]
     :param docs: List of document texts
     :type docs: Sequence[str]
+    :param doc_input_ids: Optional list of pre-tokenized document token ids
+    :type doc_input_ids: Sequence[Sequence[int]], optional
+    :param encodings: Optional tokenizer encodings of the documents if the batch was tokenized when collating
+    :type encodings: Dict[str, BatchEncoding], optional
+    :param positions: Optional positions of the samples in the dataset if the samples were sorted by length
+    :type positions: Sequence[int], optional
     """
 
     doc_ids: Sequence[str]
     docs: Sequence[str]
+    doc_input_ids: Sequence[Sequence[int]] | None = None
+    encodings: Dict[str, BatchEncoding] | None = None
+    positions: Sequence[int] | None = None
 
 
 @dataclass
@@ -163,9 +205,15 @@ class SearchBatch:
     :type doc_ids: Sequence[Sequence[str]], optional
     :param qrels: Optional list of dictionaries mapping document ids to relevance labels
     :type qrels: List[Dict[str, Any]], optional
+    :param encodings: Optional tokenizer encodings of the queries if the batch was tokenized when collating
+    :type encodings: Dict[str, BatchEncoding], optional
+    :param positions: Optional positions of the samples in the dataset if the samples were sorted by length
+    :type positions: Sequence[int], optional
     """
 
     query_ids: Sequence[str]
     queries: Sequence[str]
     doc_ids: Sequence[Sequence[str]] | None = None
     qrels: List[Dict[str, int]] | None = None
+    encodings: Dict[str, BatchEncoding] | None = None
+    positions: Sequence[int] | None = None
@@ -8,15 +8,19 @@ inference in Lightning IR.
 from __future__ import annotations
 
 from collections import defaultdict
-from typing import Any, Dict, List, Literal, Sequence
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Sequence
 
 import torch
 from lightning import LightningDataModule
 from torch.utils.data import DataLoader, IterableDataset
+from transformers import BatchEncoding
 
 from .data import IndexBatch, RankBatch, SearchBatch, TrainBatch
 from .dataset import DocDataset, DocSample, QueryDataset, QuerySample, RankSample, RunDataset, TupleDataset
 
+if TYPE_CHECKING:
+    from ..base import LightningIRTokenizer
+
 
 class LightningIRDataModule(LightningDataModule):
     def __init__(
@@ -27,6 +31,8 @@ class LightningIRDataModule(LightningDataModule):
         inference_datasets: Sequence[RunDataset | TupleDataset | QueryDataset | DocDataset] | None = None,
         inference_batch_size: int | None = None,
         num_workers: int = 0,
+        tokenize: bool = False,
+        inference_sort_window: int | None = None,
     ) -> None:
         """Initializes a new Lightning IR DataModule.
 
@@ -43,15 +49,27 @@ class LightningIRDataModule(LightningDataModule):
         :type inference_batch_size: int | None, optional
         :param num_workers: Number of workers for loading data in parallel, defaults to 0
         :type num_workers: int, optional
+        :param tokenize: Whether to tokenize batches with the tokenizer of the trainer's module when collating them.
+            Tokenization then runs in the dataloader workers in parallel to the model. The tokenizer can also be set
+            directly with the `tokenizer` attribute, defaults to False
+        :type tokenize: bool, optional
+        :param inference_sort_window: Number of consecutive inference batches whose samples are sorted by their
+            approximate length before batching. Batches then contain samples of similar length and require less
+            padding. The samples keep their original positions, which the callbacks use to write the results in the
+            original order. If None, the samples are not sorted, defaults to None
+        :type inference_sort_window: int | None, optional
         """
         super().__init__()
         self.num_workers = num_workers
+        self.tokenize = tokenize
+        self.tokenizer: LightningIRTokenizer | None = None
 
         self.train_dataset = train_dataset
         self.train_batch_size = train_batch_size
         self.shuffle_train = shuffle_train
         self.inference_datasets = inference_datasets
         self.inference_batch_size = inference_batch_size
+        self.inference_sort_window = inference_sort_window
 
         if (self.train_batch_size is not None) != (self.train_dataset is not None):
             raise ValueError("Both train_batch_size and train_dataset must be provided.")
@@ -68,8 +86,13 @@ class LightningIRDataModule(LightningDataModule):
             elif isinstance(inference_dataset, RunDataset):
                 if inference_dataset.sampling_strategy == "single_relevant":
                     raise ValueError("Inference RunDataset cannot use the single_relevant sampling strategy.")
+                if self.inference_batch_size is not None and self.inference_sort_window is not None:
+                    inference_dataset.sort_window = self.inference_batch_size * self.inference_sort_window
             elif isinstance(inference_dataset, (QueryDataset, DocDataset)):
-                pass
+                if self.inference_batch_size is not None:
+                    # samples are only sorted within a chunk, so a chunk spans all batches of a window
+                    inference_dataset.worker_chunk_size = self.inference_batch_size * (self.inference_sort_window or 1)
+                    inference_dataset.sort_by_length = self.inference_sort_window is not None
             else:
                 raise ValueError(
                     "Inference Dataset must be of type RunDataset, TupleDataset, QueryDataset, or DocDataset."
@@ -81,6 +104,7 @@ class LightningIRDataModule(LightningDataModule):
         :param stage: Stage to set up the data module for
         :type stage: Literal['fit', 'validate', 'test']
         :raises ValueError: If the stage is `fit` and no training dataset is provided
+        :raises ValueError: If a tokenized document cache of a dataset does not match the tokenizer
         """
         if stage == "fit":
             if self.train_dataset is None:
@@ -88,6 +112,15 @@ class LightningIRDataModule(LightningDataModule):
         if stage == "fit":
             stage = "validate"
         self._setup_inference(stage)
+        if self.tokenize and self.tokenizer is None and self.trainer is not None:
+            self.tokenizer = self.trainer.lightning_module.tokenizer
+        tokenizer = self.tokenizer
+        if tokenizer is None and self.trainer is not None:
+            tokenizer = self.trainer.lightning_module.tokenizer
+        if tokenizer is not None:
+            datasets = [self.train_dataset] if self.train_dataset is not None else []
+            for dataset in datasets + list(self.inference_datasets or []):
+                dataset.check_tokenized_cache(tokenizer)
 
     def train_dataloader(self) -> DataLoader:
         """Returns a dataloader for training.
@@ -152,6 +185,8 @@ class LightningIRDataModule(LightningDataModule):
             "docs": {"extend": False},
             "targets": {"extend": True},
             "qrels": {"extend": True},
+            "doc_input_ids": {"extend": False},
+            "position": {"extend": False},
         }
         for sample in samples:
             for field in sample.__dict__:
@@ -197,4 +232,22 @@ class LightningIRDataModule(LightningDataModule):
             samples = [samples]
         aggregated = self._aggregate_samples(samples)
         kwargs = self._clean_sample(aggregated)
-        return self._parse_batch(samples[0], **kwargs)
+        batch = self._parse_batch(samples[0], **kwargs)
+        if self.tokenize and self.tokenizer is not None:
+            batch.encodings = self._tokenize_batch(batch)
+        return batch
+
+    def _tokenize_batch(self, batch: RankBatch | IndexBatch | SearchBatch) -> Dict[str, BatchEncoding]:
+        assert self.tokenizer is not None
+        queries = getattr(batch, "queries", None)
+        docs = getattr(batch, "docs", None)
+        doc_input_ids = getattr(batch, "doc_input_ids", None)
+        kwargs: Dict[str, Any] = {}
+        if isinstance(batch, RankBatch):
+            kwargs["num_docs"] = [len(d) for d in docs]
+            docs = [d for nested in docs for d in nested]
+            if doc_input_ids is not None:
+                doc_input_ids = [ids for nested in doc_input_ids for ids in nested]
+        if doc_input_ids is not None and hasattr(self.tokenizer, "pad_doc"):
+            kwargs["doc_input_ids"] = doc_input_ids
+        return self.tokenizer.tokenize(queries, docs, return_tensors="pt", padding=True, truncation=True, **kwargs)
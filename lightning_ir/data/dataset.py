@@ -5,9 +5,9 @@ This module defines several datasets that handle loading and sampling data for t
 """
 
 import warnings
-from itertools import islice
+from itertools import groupby, islice
 from pathlib import Path
-from typing import Any, Dict, Iterator, Literal, Sequence, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Literal, Sequence, Tuple, TypeVar
 
 import ir_datasets
 import numpy as np
@@ -19,17 +19,57 @@ from torch.utils.data import Dataset, IterableDataset, get_worker_info
 
 from .data import DocSample, QuerySample, RankSample
 from .ir_datasets_utils import ScoredDocTuple
+from .tokenized_cache import TokenizedDocCache
+
+if TYPE_CHECKING:
+    from ..base import LightningIRTokenizer
 
 RUN_HEADER = ["query_id", "q0", "doc_id", "rank", "score", "system"]
 
+T = TypeVar("T")
+S = TypeVar("S", QuerySample, DocSample)
+
 
 class _IRDataset:
-    def __init__(self, dataset: str) -> None:
+    def __init__(self, dataset: str, tokenized_cache_dir: Path | str | None = None) -> None:
         super().__init__()
         self._dataset = dataset
         self._queries = None
         self._docs = None
         self._qrels = None
+        self.tokenized_cache_dir = tokenized_cache_dir
+        self._tokenized_cache: TokenizedDocCache | None = None
+
+    @property
+    def tokenized_cache(self) -> TokenizedDocCache | None:
+        """Cache of pre-tokenized documents if `tokenized_cache_dir` is set.
+
+        :return: Tokenized document cache
+        :rtype: TokenizedDocCache | None
+        """
+        if self._tokenized_cache is None and self.tokenized_cache_dir is not None:
+            self._tokenized_cache = TokenizedDocCache(self.tokenized_cache_dir)
+        return self._tokenized_cache
+
+    def check_tokenized_cache(self, tokenizer: "LightningIRTokenizer") -> None:
+        """Checks that the tokenized document cache, if set, can be used with a tokenizer. Only bi-encoder tokenizers
+        can pad pre-tokenized documents, other tokenizers would tokenize the empty document texts of cached samples.
+
+        :param tokenizer: Tokenizer of the module that processes the samples
+        :type tokenizer: LightningIRTokenizer
+        :raises ValueError: If the tokenizer does not support pre-tokenized documents or the cache was built with a
+            different tokenizer
+        """
+        if self.tokenized_cache is None:
+            return
+        if not hasattr(tokenizer, "pad_doc"):
+            raise ValueError(
+                f"Tokenized document caches are only supported for bi-encoders, got {tokenizer.__class__.__name__}"
+            )
+        if not self.tokenized_cache.matches(tokenizer):
+            raise ValueError(
+                f"Tokenized document cache in {self.tokenized_cache.cache_dir} was built with a different tokenizer"
+            )
 
     @property
     def dataset(self) -> str:
@@ -139,21 +179,138 @@ class _DataParallelIterableDataset(IterableDataset):
     # https://github.com/Lightning-AI/pytorch-lightning/issues/15734
     def __init__(self) -> None:
         super().__init__()
-        # TODO add support for multi-gpu and multi-worker inference; currently
-        # doesn't work
-        worker_info = get_worker_info()
-        num_workers = worker_info.num_workers if worker_info is not None else 1
-        worker_id = worker_info.id if worker_info is not None else 0
+        # number of consecutive samples of a process that are read by the same dataloader worker, set to a multiple of
+        # the batch size so that every batch is read by a single worker and the order of the samples is preserved
+        self.worker_chunk_size = 1
+        # whether to sort the samples of every chunk by their length, grouping samples of similar length into batches
+        self.sort_by_length = False
 
+    @staticmethod
+    def _process_info() -> Tuple[int, int]:
         try:
-            world_size = get_world_size()
-            process_rank = get_rank()
+            return get_world_size(), get_rank()
         except (RuntimeError, ValueError):
-            world_size = 1
-            process_rank = 0
+            return 1, 0
+
+    @staticmethod
+    def _worker_info() -> Tuple[int, int]:
+        worker_info = get_worker_info()
+        if worker_info is None:
+            return 1, 0
+        return worker_info.num_workers, worker_info.id
+
+    @property
+    def num_replicas(self) -> int:
+        """Number of processes times the number of dataloader workers iterating over the dataset. Evaluated lazily
+        because the worker info is only available inside of the dataloader workers.
 
-        self.num_replicas = num_workers * world_size
-        self.rank = process_rank * num_workers + worker_id
+        :return: Number of replicas
+        :rtype: int
+        """
+        world_size, _ = self._process_info()
+        num_workers, _ = self._worker_info()
+        return world_size * num_workers
+
+    @property
+    def rank(self) -> int:
+        """Rank of the current dataloader worker among all replicas.
+
+        :return: Rank of the replica
+        :rtype: int
+        """
+        _, process_rank = self._process_info()
+        num_workers, worker_id = self._worker_info()
+        return process_rank * num_workers + worker_id
+
+    def _process_range(self, num_samples: int) -> Tuple[int, int]:
+        world_size, process_rank = self._process_info()
+        return num_samples * process_rank // world_size, num_samples * (process_rank + 1) // world_size
+
+    def _num_samples(self) -> int | None:
+        """Number of samples the processes read from the dataset. Subclasses override this to let every process read
+        a contiguous range of the samples. Defaults to None, in which case the processes read interleaved samples.
+
+        :return: Number of samples, None if unknown
+        :rtype: int | None
+        """
+        return None
+
+    def global_position(self, position: int) -> int:
+        """Maps the position of a sample among the samples of the current process, as set when sorting samples by
+        length, to its position in the dataset, so that the samples of all processes can be ordered together.
+
+        :param position: Position of the sample among the samples of the current process
+        :type position: int
+        :return: Position of the sample in the dataset
+        :rtype: int
+        """
+        world_size, process_rank = self._process_info()
+        num_samples = self._num_samples()
+        if num_samples is None:
+            # the processes read interleaved samples if the number of samples is unknown
+            return position * world_size + process_rank
+        start, _ = self._process_range(num_samples)
+        return start + position
+
+    def _num_process_samples(self, num_samples: int) -> int:
+        start, stop = self._process_range(num_samples)
+        return stop - start
+
+    def _shard(
+        self, samples: Iterator[T], num_samples: int | None, seekable: bool = False
+    ) -> Iterator[List[Tuple[int, T]]]:
+        """Yields the chunks of samples of the current process and dataloader worker. Every process reads a contiguous
+        range of the samples, and the workers of a process take turns reading chunks of ``worker_chunk_size`` samples
+        from that range, matching the order in which a dataloader collects batches from its workers. If the samples
+        support indexed slicing (e.g., an ``ir_datasets`` docstore), every worker only reads its own chunks. Otherwise,
+        every worker iterates over the samples and skips the chunks of the other workers.
+
+        :param samples: Samples of the full dataset
+        :type samples: Iterator[T]
+        :param num_samples: Number of samples to read from the dataset, None if unknown
+        :type num_samples: int | None
+        :param seekable: Whether slicing the samples seeks to the start of the slice, defaults to False
+        :type seekable: bool, optional
+        :yield: Chunks of samples of the current replica paired with their positions among the samples of the current
+            process
+        :rtype: Iterator[List[Tuple[int, T]]]
+        """
+        world_size, process_rank = self._process_info()
+        num_workers, worker_id = self._worker_info()
+        chunk_size = self.worker_chunk_size
+        if num_samples is None:
+            # contiguous ranges require the number of samples, fall back to interleaving the processes
+            process_samples = islice(samples, process_rank, None, world_size)
+        else:
+            start, stop = self._process_range(num_samples)
+            if seekable:
+                for chunk_start in range(start + worker_id * chunk_size, stop, num_workers * chunk_size):
+                    chunk = samples[chunk_start : min(chunk_start + chunk_size, stop)]
+                    yield list(enumerate(chunk, chunk_start - start))
+                return
+            process_samples = islice(samples, start, stop)
+        for chunk_idx, chunk in groupby(enumerate(process_samples), key=lambda item: item[0] // chunk_size):
+            if chunk_idx % num_workers == worker_id:
+                yield list(chunk)
+
+    def _sort_chunk(self, chunk: List[Tuple[int, S]], length: Callable[[S], int]) -> Iterator[S]:
+        """Yields the samples of a chunk. If ``sort_by_length`` is set, the samples are sorted by their approximate
+        length and annotated with their position so that the original order can be restored.
+
+        :param chunk: Samples paired with their positions
+        :type chunk: List[Tuple[int, S]]
+        :param length: Function returning the approximate length of a sample
+        :type length: Callable[[S], int]
+        :yield: Samples of the chunk
+        :rtype: Iterator[S]
+        """
+        if not self.sort_by_length:
+            for _, sample in chunk:
+                yield sample
+            return
+        for position, sample in sorted(chunk, key=lambda item: length(item[1])):
+            sample.position = position
+            yield sample
 
 
 class QueryDataset(_IRDataset, _DataParallelIterableDataset):
@@ -171,40 +328,57 @@ class QueryDataset(_IRDataset, _DataParallelIterableDataset):
         self.num_queries = num_queries
 
     def __len__(self) -> int:
-        """Number of queries in the dataset.
+        """Number of queries the current process iterates over.
 
+        :raises ValueError: If no `num_queries` was not provided in the constructor and the number of queries cannot
+            be inferred
         :return: Number of queries
         :rtype: int
         """
-        # TODO fix len for multi-gpu and multi-worker inference
+        num_queries = self._num_queries()
+        if num_queries is None:
+            raise ValueError("Unable to determine number of queries.")
+        return self._num_process_samples(num_queries)
+
+    def _num_queries(self) -> int | None:
         return self.num_queries or self.ir_dataset.queries_count()
 
+    def _num_samples(self) -> int | None:
+        return self._num_queries()
+
     def __iter__(self) -> Iterator[QuerySample]:
         """Iterate over queries in the dataset.
 
         :yield: Query sample
         :rtype: Iterator[QuerySample]
         """
-        start = self.rank
-        stop = self.num_queries
-        step = self.num_replicas
-        for sample in islice(self.ir_dataset.queries_iter(), start, stop, step):
-            query_sample = QuerySample.from_ir_dataset_sample(sample)
-            if self.qrels is not None:
-                qrels = (
-                    self.qrels.loc[[query_sample.query_id]]
-                    .stack()
-                    .rename("relevance")
-                    .astype(int)
-                    .reset_index()
-                    .to_dict(orient="records")
-                )
-                query_sample.qrels = qrels
-            yield query_sample
+        for chunk in self._shard(self.ir_dataset.queries_iter(), self._num_queries()):
+            samples = [(position, self._query_sample(sample)) for position, sample in chunk]
+            yield from self._sort_chunk(samples, lambda sample: len(sample.query))
+
+    def _query_sample(self, sample: Any) -> QuerySample:
+        query_sample = QuerySample.from_ir_dataset_sample(sample)
+        if self.qrels is not None:
+            qrels = (
+                self.qrels.loc[[query_sample.query_id]]
+                .stack()
+                .rename("relevance")
+                .astype(int)
+                .reset_index()
+                .to_dict(orient="records")
+            )
+            query_sample.qrels = qrels
+        return query_sample
 
 
 class DocDataset(_IRDataset, _DataParallelIterableDataset):
-    def __init__(self, doc_dataset: str, num_docs: int | None = None, text_fields: Sequence[str] | None = None) -> None:
+    def __init__(
+        self,
+        doc_dataset: str,
+        num_docs: int | None = None,
+        text_fields: Sequence[str] | None = None,
+        tokenized_cache_dir: Path | str | None = None,
+    ) -> None:
         """Dataset containing documents.
 
         :param doc_dataset: Path to file containing documents or valid ir_datasets id
@@ -214,25 +388,35 @@ class DocDataset(_IRDataset, _DataParallelIterableDataset):
         :type num_docs: int | None, optional
         :param text_fields: Fields to parse the document text from, defaults to None
         :type text_fields: Sequence[str] | None, optional
+        :param tokenized_cache_dir: Directory of a :class:`.TokenizedDocCache` of the documents. If set, pre-tokenized
+            documents are read from the cache instead of the document texts, defaults to None
+        :type tokenized_cache_dir: Path | str | None, optional
         """
-        super().__init__(doc_dataset)
+        super().__init__(doc_dataset, tokenized_cache_dir)
         super(_IRDataset, self).__init__()
         self.num_docs = num_docs
         self.text_fields = text_fields
 
     def __len__(self) -> int:
-        """Number of documents in the dataset.
+        """Number of documents the current process iterates over.
 
         :raises ValueError: If no `num_docs` was not provided in the constructor and the number of documents cannot
             be inferred
         :return: Number of documents
         :rtype: int
         """
-        # TODO fix len for multi-gpu and multi-worker inference
-        num_docs = self.num_docs or self.ir_dataset.docs_count()
+        num_docs = self._num_docs()
         if num_docs is None:
             raise ValueError("Unable to determine number of documents.")
-        return num_docs
+        return self._num_process_samples(num_docs)
+
+    def _num_docs(self) -> int | None:
+        if self.tokenized_cache is not None:
+            return min(self.num_docs or len(self.tokenized_cache), len(self.tokenized_cache))
+        return self.num_docs or self.ir_dataset.docs_count()
+
+    def _num_samples(self) -> int | None:
+        return self._num_docs()
 
     def __iter__(self) -> Iterator[DocSample]:
         """Iterate over documents in the dataset.
@@ -240,11 +424,19 @@ class DocDataset(_IRDataset, _DataParallelIterableDataset):
         :yield: Doc sample
         :rtype: Iterator[DocSample]
         """
-        start = self.rank
-        stop = self.num_docs
-        step = self.num_replicas
-        for sample in islice(self.ir_dataset.docs_iter(), start, stop, step):
-            yield DocSample.from_ir_dataset_sample(sample, self.text_fields)
+        if self.tokenized_cache is not None:
+            num_docs = self._num_docs()
+            for chunk in self._shard(range(num_docs), num_docs, seekable=True):
+                samples = [(position, self.tokenized_cache.doc_sample(idx)) for position, idx in chunk]
+                yield from self._sort_chunk(samples, lambda sample: len(sample.doc_input_ids))
+            return
+        # ir_datasets docs iterators support seeking to a document with indexed slicing (docs_iter()[a:b])
+        docs_iter = self.ir_dataset.docs_iter()
+        for chunk in self._shard(docs_iter, self._num_docs(), seekable=hasattr(docs_iter, "__getitem__")):
+            samples = [
+                (position, DocSample.from_ir_dataset_sample(sample, self.text_fields)) for position, sample in chunk
+            ]
+            yield from self._sort_chunk(samples, lambda sample: len(sample.doc))
 
 
 class Sampler:
@@ -364,6 +556,7 @@ class RunDataset(_IRDataset, Dataset):
         targets: Literal["relevance", "subtopic_relevance", "rank", "score"] | None = None,
         normalize_targets: bool = False,
         add_docs_not_in_ranking: bool = False,
+        tokenized_cache_dir: Path | str | None = None,
     ) -> None:
         """Dataset containing a list of queries with a ranked list of documents per query. Subsets of the ranked list
         can be sampled using different sampling strategies.
@@ -384,6 +577,9 @@ class RunDataset(_IRDataset, Dataset):
         :param add_docs_not_in_ranking: Whether to add relevant to a sample that are in the qrels but not in the
             ranking, defaults to False
         :type add_docs_not_in_ranking: bool, optional
+        :param tokenized_cache_dir: Directory of a :class:`.TokenizedDocCache` of the documents. If set, samples
+            additionally contain the pre-tokenized documents, defaults to None
+        :type tokenized_cache_dir: Path | str | None, optional
         """
         self.run_path = None
         if Path(run_path_or_id).is_file():
@@ -391,7 +587,7 @@ class RunDataset(_IRDataset, Dataset):
             dataset = self.run_path.name.split(".")[0].split("__")[-1]
         else:
             dataset = str(run_path_or_id)
-        super().__init__(dataset)
+        super().__init__(dataset, tokenized_cache_dir)
         self.depth = depth
         self.sample_size = sample_size
         self.sampling_strategy = sampling_strategy
@@ -407,6 +603,13 @@ class RunDataset(_IRDataset, Dataset):
             )
 
         self.run: pd.DataFrame | None = None
+        # number of consecutive queries that are sorted by the length of their documents, set by the datamodule to
+        # group queries with documents of similar length into batches
+        self.sort_window: int | None = None
+        # sorted query indices of every window that was read, keyed by the index of the first query of the window
+        self._window_orders: Dict[int, List[int]] = {}
+        # texts of the documents fetched to sort the most recently sorted window, reused when reading its queries
+        self._window_texts: Dict[str, str] = {}
 
     def _setup(self):
         if self.run is not None:
@@ -590,13 +793,16 @@ class RunDataset(_IRDataset, Dataset):
         :rtype: RankSample
         """
         self._setup()
+        position = None
+        if self.sort_window is not None:
+            idx = position = self._sorted_idx(idx)
         query_id = str(self.query_ids[idx])
         group = self.run_groups.get_group(query_id).copy()
         query = self.queries[query_id]
         group = Sampler.sample(group, self.sample_size, self.sampling_strategy)
 
         doc_ids = tuple(group["doc_id"])
-        docs = tuple(self.docs.get(doc_id).default_text() for doc_id in doc_ids)
+        docs = tuple(self._doc_text(doc_id) for doc_id in doc_ids)
 
         targets = None
         if self.targets is not None:
@@ -621,7 +827,65 @@ class RunDataset(_IRDataset, Dataset):
                 .reset_index()
                 .to_dict(orient="records")
             )
-        return RankSample(query_id, query, doc_ids, docs, targets, qrels)
+        doc_input_ids = None
+        if self.tokenized_cache is not None:
+            doc_input_ids = tuple(self.tokenized_cache.lookup(doc_id) for doc_id in doc_ids)
+        return RankSample(query_id, query, doc_ids, docs, targets, qrels, doc_input_ids, position)
+
+    def _approximate_length(self, query_id: str) -> int:
+        doc_ids = self.run_groups.get_group(query_id)["doc_id"]
+        if self.sample_size != -1:
+            doc_ids = doc_ids.head(self.sample_size)
+        if self.tokenized_cache is not None:
+            return max((len(self.tokenized_cache.lookup(doc_id)) for doc_id in doc_ids), default=0)
+        return max((len(self._doc_text(doc_id, cache=True)) for doc_id in doc_ids), default=0)
+
+    def _doc_text(self, doc_id: str, cache: bool = False) -> str:
+        """Text of a document. Texts fetched to sort a window are reused, so the documents of the queries of a sorted
+        window are only fetched once.
+
+        :param doc_id: Document id
+        :type doc_id: str
+        :param cache: Whether to keep the text for reading the queries of the window, defaults to False
+        :type cache: bool, optional
+        :return: Document text
+        :rtype: str
+        """
+        text = self._window_texts.get(doc_id)
+        if text is None:
+            text = self.docs.get(doc_id).default_text()
+            if cache:
+                self._window_texts[doc_id] = text
+        return text
+
+    def _sorted_idx(self, idx: int) -> int:
+        """Index of the query that is read at the given position if ``sort_window`` is set. Within every window of
+        ``sort_window`` consecutive queries, the queries are sorted by the approximate length of their longest document
+        (number of characters or, for pre-tokenized documents, number of tokens). The lengths of a window are only
+        computed when the window is first read.
+
+        :param idx: Position at which the query is read
+        :type idx: int
+        :return: Index of the query
+        :rtype: int
+        """
+        assert self.sort_window is not None
+        start = idx - idx % self.sort_window
+        if start not in self._window_orders:
+            window = range(start, min(start + self.sort_window, len(self.query_ids)))
+            self._window_texts = {}
+            self._window_orders[start] = sorted(window, key=lambda i: self._approximate_length(self.query_ids[i]))
+        return self._window_orders[start][idx - start]
+
+    def global_position(self, position: int) -> int:
+        """Position of a sample in the dataset. Positions of samples of a run dataset already refer to the full dataset.
+
+        :param position: Position of the sample as set when sorting samples by length
+        :type position: int
+        :return: Position of the sample in the dataset
+        :rtype: int
+        """
+        return position
 
 
 class TupleDataset(_IRDataset, IterableDataset):
@@ -630,6 +894,7 @@ class TupleDataset(_IRDataset, IterableDataset):
         tuples_dataset: str,
         targets: Literal["order", "score"] = "order",
         num_docs: int | None = None,
+        tokenized_cache_dir: Path | str | None = None,
     ) -> None:
         """Dataset containing tuples of a query and n-documents. Used for fine-tuning models on ranking tasks.
 
@@ -639,8 +904,11 @@ class TupleDataset(_IRDataset, IterableDataset):
         :type targets: Literal["order", "score"], optional
         :param num_docs: Maximum number of documents per query, defaults to None
         :type num_docs: int | None, optional
+        :param tokenized_cache_dir: Directory of a :class:`.TokenizedDocCache` of the documents. If set, samples
+            additionally contain the pre-tokenized documents, defaults to None
+        :type tokenized_cache_dir: Path | str | None, optional
         """
-        super().__init__(tuples_dataset)
+        super().__init__(tuples_dataset, tokenized_cache_dir)
         super(_IRDataset, self).__init__()
         self.targets = targets
         self.num_docs = num_docs
@@ -681,4 +949,7 @@ class TupleDataset(_IRDataset, IterableDataset):
             doc_ids, docs, targets = self._parse_sample(sample)
             if targets is not None:
                 targets = torch.tensor(targets)
-            yield RankSample(query_id, query, doc_ids, docs, targets)
+            doc_input_ids = None
+            if self.tokenized_cache is not None:
+                doc_input_ids = tuple(self.tokenized_cache.lookup(doc_id) for doc_id in doc_ids)
+            yield RankSample(query_id, query, doc_ids, docs, targets, doc_input_ids=doc_input_ids)
@@ -0,0 +1,189 @@
+"""
+Pre-tokenized document cache for Lightning IR.
+
+This module defines a cache that stores the token ids of all documents of a corpus in a flat memory-mapped array, so
+that datasets can yield pre-tokenized documents instead of re-tokenizing them for every indexing run and epoch.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Sequence
+
+import ir_datasets
+import numpy as np
+
+from .data import DocSample
+
+if TYPE_CHECKING:
+    from ..bi_encoder import BiEncoderTokenizer
+
+
+class TokenizedDocCache:
+    def __init__(self, cache_dir: Path | str) -> None:
+        """Opens a pre-tokenized document cache created with :meth:`.build`. The token ids of all documents are stored
+        in a single memory-mapped array together with the offsets of every document.
+
+        :param cache_dir: Directory of the cache
+        :type cache_dir: Path | str
+        :raises ValueError: If the directory does not contain a cache
+        """
+        self.cache_dir = Path(cache_dir)
+        if not (self.cache_dir / "config.json").exists():
+            raise ValueError(f"No tokenized document cache found in {self.cache_dir}")
+        self.config = json.loads((self.cache_dir / "config.json").read_text())
+        input_ids_path = self.cache_dir / "input_ids.bin"
+        self.input_ids = (
+            np.memmap(input_ids_path, dtype=np.int32, mode="r")
+            if input_ids_path.stat().st_size
+            else np.empty(0, dtype=np.int32)
+        )
+        self.offsets = np.load(self.cache_dir / "offsets.npy", mmap_mode="r")
+        self.doc_ids = np.load(self.cache_dir / "doc_ids.npy", mmap_mode="r")
+        self._doc_id_to_idx: Dict[str, int] | None = None
+
+    def __len__(self) -> int:
+        return self.doc_ids.shape[0]
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        """Token ids of the document at the given position in the corpus.
+
+        :param idx: Position of the document
+        :type idx: int
+        :return: Token ids of the document
+        :rtype: np.ndarray
+        """
+        return np.asarray(self.input_ids[self.offsets[idx] : self.offsets[idx + 1]])
+
+    def doc_id(self, idx: int) -> str:
+        """Id of the document at the given position in the corpus.
+
+        :param idx: Position of the document
+        :type idx: int
+        :return: Document id
+        :rtype: str
+        """
+        return self.doc_ids[idx].decode("utf-8")
+
+    def lookup(self, doc_id: str) -> np.ndarray:
+        """Token ids of the document with the given id.
+
+        :param doc_id: Document id
+        :type doc_id: str
+        :raises KeyError: If the document is not in the cache
+        :return: Token ids of the document
+        :rtype: np.ndarray
+        """
+        if self._doc_id_to_idx is None:
+            doc_ids = np.char.decode(self.doc_ids, "utf-8").tolist()
+            self._doc_id_to_idx = {doc_id: idx for idx, doc_id in enumerate(doc_ids)}
+        return self[self._doc_id_to_idx[doc_id]]
+
+    def doc_sample(self, idx: int) -> DocSample:
+        """Document sample with the token ids of the document at the given position in the corpus. The document text
+        is not read from the corpus.
+
+        :param idx: Position of the document
+        :type idx: int
+        :return: Document sample
+        :rtype: DocSample
+        """
+        return DocSample(self.doc_id(idx), "", self[idx])
+
+    def matches(self, tokenizer: BiEncoderTokenizer) -> bool:
+        """Checks whether the cache was built with a tokenizer that produces the same token ids.
+
+        :param tokenizer: Tokenizer to check
+        :type tokenizer: BiEncoderTokenizer
+        :return: Whether the cache matches the tokenizer
+        :rtype: bool
+        """
+        return self.config["key"] == self.cache_key(tokenizer)
+
+    @staticmethod
+    def _tokenizer_config(tokenizer: BiEncoderTokenizer) -> Dict[str, Any]:
+        # document expansion is applied when padding the token ids and does not change the cached token ids
+        return {
+            "tokenizer_class": tokenizer.__class__.__name__,
+            "name_or_path": tokenizer.name_or_path,
+            "vocab_size": len(tokenizer),
+            "doc_length": tokenizer.doc_length,
+            "add_marker_tokens": tokenizer.add_marker_tokens,
+        }
+
+    @classmethod
+    def cache_key(cls, tokenizer: BiEncoderTokenizer) -> str:
+        """Key of the token ids a tokenizer produces for documents.
+
+        :param tokenizer: Tokenizer
+        :type tokenizer: BiEncoderTokenizer
+        :return: Cache key
+        :rtype: str
+        """
+        config = json.dumps(cls._tokenizer_config(tokenizer), sort_keys=True)
+        return hashlib.sha1(config.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def build(
+        cls,
+        doc_dataset: str,
+        tokenizer: BiEncoderTokenizer,
+        cache_root: Path | str,
+        num_docs: int | None = None,
+        text_fields: Sequence[str] | None = None,
+        batch_size: int = 10_000,
+        overwrite: bool = False,
+    ) -> TokenizedDocCache:
+        """Tokenizes all documents of a corpus and writes their token ids to
+        ``cache_root/<docs dataset id>/<tokenizer cache key>``. An existing cache is reused unless overwrite is set.
+
+        :param doc_dataset: Path to file containing documents or valid ir_datasets id
+        :type doc_dataset: str
+        :param tokenizer: Tokenizer used to tokenize the documents
+        :type tokenizer: BiEncoderTokenizer
+        :param cache_root: Root directory of the caches
+        :type cache_root: Path | str
+        :param num_docs: Number of documents to tokenize, None tokenizes all documents, defaults to None
+        :type num_docs: int | None, optional
+        :param text_fields: Fields to parse the document text from, defaults to None
+        :type text_fields: Sequence[str] | None, optional
+        :param batch_size: Number of documents to tokenize at once, defaults to 10_000
+        :type batch_size: int, optional
+        :param overwrite: Whether to overwrite an existing cache, defaults to False
+        :type overwrite: bool, optional
+        :return: The cache
+        :rtype: TokenizedDocCache
+        """
+        dataset = ir_datasets.load(doc_dataset)
+        cache_dir = (
+            Path(cache_root)
+            / ir_datasets.docs_parent_id(dataset.dataset_id()).replace("/", "-")
+            / cls.cache_key(tokenizer)
+        )
+        if (cache_dir / "config.json").exists() and not overwrite:
+            return cls(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        (cache_dir / "config.json").unlink(missing_ok=True)
+
+        offsets = [0]
+        doc_ids = []
+        docs_iter = islice(dataset.docs_iter(), num_docs)
+        with open(cache_dir / "input_ids.bin", "wb") as f:
+            while True:
+                samples = [DocSample.from_ir_dataset_sample(doc, text_fields) for doc in islice(docs_iter, batch_size)]
+                if not samples:
+                    break
+                for input_ids in tokenizer.pre_tokenize_doc([sample.doc for sample in samples]):
+                    f.write(np.asarray(input_ids, dtype=np.int32).tobytes())
+                    offsets.append(offsets[-1] + len(input_ids))
+                doc_ids.extend(sample.doc_id.strip().encode("utf-8") for sample in samples)
+
+        np.save(cache_dir / "offsets.npy", np.array(offsets, dtype=np.int64))
+        np.save(cache_dir / "doc_ids.npy", np.array(doc_ids, dtype=np.bytes_))
+        # written last so that interrupted builds are not mistaken for a complete cache
+        config = {"key": cls.cache_key(tokenizer), **cls._tokenizer_config(tokenizer)}
+        (cache_dir / "config.json").write_text(json.dumps(config, indent=2))
+        return cls(cache_dir)
@@ -5,3 +5,9 @@ FLASH_ATTENTION_MAP = {
     "roberta": (flash_bert.flash_attention_forward, flash_bert.SELF_ATTENTION_PATTERN),
     "electra": (flash_bert.flash_attention_forward, flash_bert.SELF_ATTENTION_PATTERN),
 }
+
+VARLEN_FORWARD_MAP = {
+    "bert": flash_bert.varlen_forward,
+    "roberta": flash_bert.varlen_forward,
+    "electra": flash_bert.varlen_forward,
+}
@@ -1,12 +1,14 @@
 from typing import Tuple
 
 import torch
-from transformers.models.bert.modeling_bert import BertSelfAttention
+from transformers.modeling_outputs import BaseModelOutput
+from transformers.models.bert.modeling_bert import BertModel, BertSelfAttention
 
 try:
-    from flash_attn import flash_attn_func
+    from flash_attn import flash_attn_func, flash_attn_varlen_func
 except ImportError:
     flash_attn_func = None
+    flash_attn_varlen_func = None
 
 
 def flash_attention_forward(
@@ -49,4 +51,87 @@ def flash_attention_forward(
     return (context,)
 
 
+def varlen_attention_forward(
+    self: BertSelfAttention, hidden_states: torch.Tensor, cu_seqlens: torch.Tensor, max_seqlen: int
+) -> torch.Tensor:
+    """Self-attention over packed sequences. Every token only attends to the tokens of its own sequence.
+
+    :param self: Self-attention module
+    :type self: BertSelfAttention
+    :param hidden_states: Packed hidden states of shape [num_tokens x hidden_size]
+    :type hidden_states: torch.Tensor
+    :param cu_seqlens: Cumulative sequence lengths of shape [num_sequences + 1]
+    :type cu_seqlens: torch.Tensor
+    :param max_seqlen: Length of the longest sequence
+    :type max_seqlen: int
+    :return: Packed context of shape [num_tokens x hidden_size]
+    :rtype: torch.Tensor
+    """
+    shape = (hidden_states.shape[0], self.num_attention_heads, self.attention_head_size)
+    query = self.query(hidden_states).view(shape)
+    key = self.key(hidden_states).view(shape)
+    value = self.value(hidden_states).view(shape)
+    dropout_p = self.dropout.p if self.training else 0
+
+    # flash attention only supports half precision, full precision inputs are not downcast
+    if (
+        flash_attn_varlen_func is not None
+        and hidden_states.is_cuda
+        and hidden_states.dtype in (torch.float16, torch.bfloat16)
+    ):
+        context = flash_attn_varlen_func(query, key, value, cu_seqlens, cu_seqlens, max_seqlen, max_seqlen, dropout_p)
+    else:
+        # nested tensors with a jagged layout share the packed buffer and dispatch to the fused sdpa kernels
+        offsets = cu_seqlens.long()
+        query, key, value = (
+            torch.nested.nested_tensor_from_jagged(tensor, offsets).transpose(1, 2) for tensor in (query, key, value)
+        )
+        context = torch.nn.functional.scaled_dot_product_attention(query, key, value, dropout_p=dropout_p)
+        context = context.transpose(1, 2).values()
+    return context.reshape(hidden_states.shape[0], self.all_head_size)
+
+
+def varlen_forward(
+    self: BertModel,
+    input_ids: torch.Tensor,
+    attention_mask: torch.Tensor,
+    token_type_ids: torch.Tensor | None = None,
+    **kwargs,
+) -> BaseModelOutput:
+    """Runs a BERT-style backbone without computing on padding tokens. After the embedding layer, the padding tokens
+    are removed and the remaining tokens of all sequences are concatenated. The feed-forward layers run on the packed
+    tokens and the self-attention layers attend within each sequence using the cumulative sequence lengths. The
+    contextualized embeddings are scattered back into the padded shape, with zeros at padding positions.
+
+    :param self: Backbone model
+    :type self: BertModel
+    :param input_ids: Padded input ids of shape [batch_size x seq_len]
+    :type input_ids: torch.Tensor
+    :param attention_mask: Attention mask of shape [batch_size x seq_len]
+    :type attention_mask: torch.Tensor
+    :param token_type_ids: Token type ids of shape [batch_size x seq_len], defaults to None
+    :type token_type_ids: torch.Tensor | None, optional
+    :return: Output of the backbone model containing the last hidden state
+    :rtype: BaseModelOutput
+    """
+    embeddings = self.embeddings(input_ids=input_ids, token_type_ids=token_type_ids)
+    if hasattr(self, "embeddings_project"):
+        # electra projects the embeddings to the hidden size
+        embeddings = self.embeddings_project(embeddings)
+    mask = attention_mask.bool()
+    seqlens = mask.sum(dim=1, dtype=torch.int32)
+    cu_seqlens = torch.nn.functional.pad(seqlens.cumsum(0, dtype=torch.int32), (1, 0))
+    max_seqlen = int(seqlens.max().item())
+
+    hidden_states = embeddings[mask]
+    for layer in self.encoder.layer:
+        context = varlen_attention_forward(layer.attention.self, hidden_states, cu_seqlens, max_seqlen)
+        attention_output = layer.attention.output(context, hidden_states)
+        hidden_states = layer.output(layer.intermediate(attention_output), attention_output)
+
+    last_hidden_state = hidden_states.new_zeros(*mask.shape, hidden_states.shape[-1])
+    last_hidden_state = last_hidden_state.masked_scatter(mask.unsqueeze(-1), hidden_states)
+    return BaseModelOutput(last_hidden_state=last_hidden_state)
+
+
 SELF_ATTENTION_PATTERN = "self"
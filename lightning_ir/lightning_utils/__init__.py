@@ -1,4 +1,4 @@
-from .callbacks import IndexCallback, RankCallback, ReRankCallback, SearchCallback
+from .callbacks import CascadeCallback, IndexCallback, RankCallback, ReRankCallback, SearchCallback
 from .lr_schedulers import ConstantLRSchedulerWithLinearWarmup, LinearLRSchedulerWithLinearWarmup, WarmupLRScheduler
 from .schedulers import (
     GenericConstantSchedulerWithLinearWarmup,
@@ -7,6 +7,7 @@ from .schedulers import (
 )
 
 __all__ = [
+    "CascadeCallback",
     "ConstantLRSchedulerWithLinearWarmup",
     "GenericConstantSchedulerWithLinearWarmup",
     "GenericConstantSchedulerWithQuadraticWarmup",
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import itertools
-from dataclasses import is_dataclass
+import json
+from dataclasses import is_dataclass, replace
 from pathlib import Path
 from typing import TYPE_CHECKING, Any, Callable, Dict, List, Literal, Sequence, Tuple, TypeVar
 
@@ -10,14 +11,23 @@ import torch
 from lightning import LightningModule, Trainer
 from lightning.pytorch.callbacks import BasePredictionWriter, Callback, TQDMProgressBar
 
-from ..data import RankBatch, SearchBatch
+from ..bi_encoder import BiEncoderEmbedding, BiEncoderOutput
+from ..data import IndexBatch, RankBatch, SearchBatch
 from ..data.dataset import RUN_HEADER, DocDataset, QueryDataset, RunDataset
 from ..data.ir_datasets_utils import _register_local_dataset
-from ..retrieve import IndexConfig, Indexer, SearchConfig, Searcher
+from ..retrieve import (
+    IndexConfig,
+    Indexer,
+    ResidualEmbeddingStoreConfig,
+    ResidualEmbeddingStoreWriter,
+    SearchConfig,
+    Searcher,
+    ShardedSearcher,
+)
 
 if TYPE_CHECKING:
     from ..base import LightningIRModule, LightningIROutput
-    from ..bi_encoder import BiEncoderModule, BiEncoderOutput
+    from ..bi_encoder import BiEncoderModule
 
 T = TypeVar("T")
 
@@ -38,11 +48,91 @@ def format_large_number(number: float) -> str:
     return formatted_number
 
 
+def fetch_doc_texts(docs: Any, doc_ids: Sequence[str]) -> Dict[str, str]:
+    """Looks up the texts of documents. Documents of an ``ir_datasets`` docstore are fetched with a single lookup.
+
+    :param docs: Docstore or mapping of document ids to documents
+    :type docs: ir_datasets.indices.Docstore | Dict[str, GenericDoc]
+    :param doc_ids: Ids of the documents
+    :type doc_ids: Sequence[str]
+    :raises KeyError: If a document is not found
+    :return: Texts of the documents keyed by document id
+    :rtype: Dict[str, str]
+    """
+    if isinstance(docs, dict):
+        return {doc_id: docs[doc_id].default_text() for doc_id in doc_ids}
+    fetched = docs.get_many(doc_ids)
+    missing = [doc_id for doc_id in doc_ids if doc_id not in fetched]
+    if missing:
+        raise KeyError(f"Documents {missing} not found")
+    return {doc_id: doc.default_text() for doc_id, doc in fetched.items()}
+
+
+def re_rank_candidates(
+    module: LightningIRModule,
+    queries: Sequence[str],
+    query_ids: Sequence[str],
+    candidates: List[List[Tuple[str, float]]],
+    doc_texts: Dict[str, str],
+    batch_size: int,
+) -> List[List[Tuple[str, float]]]:
+    """Scores the candidates of all queries with a re-ranking module in batches of at most batch_size query-document
+    pairs. A query with more candidates than fit into a batch is scored in a batch of its own.
+
+    :param module: Re-ranking module
+    :type module: LightningIRModule
+    :param queries: Query texts
+    :type queries: Sequence[str]
+    :param query_ids: Query ids
+    :type query_ids: Sequence[str]
+    :param candidates: Document ids and scores of the candidates of every query
+    :type candidates: List[List[Tuple[str, float]]]
+    :param doc_texts: Texts of the candidates keyed by document id
+    :type doc_texts: Dict[str, str]
+    :param batch_size: Maximum number of query-document pairs scored at once
+    :type batch_size: int
+    :raises ValueError: If the module does not return scores
+    :return: Document ids and re-ranking scores of the candidates of every query, in the order of the candidates
+    :rtype: List[List[Tuple[str, float]]]
+    """
+    re_ranked: List[List[Tuple[str, float]]] = []
+    query_idx = 0
+    while query_idx < len(candidates):
+        # at least one query per batch, even if it has more candidates than fit into a batch
+        end_idx = query_idx + 1
+        num_pairs = len(candidates[query_idx])
+        while end_idx < len(candidates) and num_pairs + len(candidates[end_idx]) <= batch_size:
+            num_pairs += len(candidates[end_idx])
+            end_idx += 1
+        query_idcs = [idx for idx in range(query_idx, end_idx) if candidates[idx]]
+        if query_idcs:
+            doc_ids = [tuple(doc_id for doc_id, _ in candidates[idx]) for idx in query_idcs]
+            rank_batch = RankBatch(
+                [queries[idx] for idx in query_idcs],
+                [tuple(doc_texts[doc_id] for doc_id in _doc_ids) for _doc_ids in doc_ids],
+                [query_ids[idx] for idx in query_idcs],
+                doc_ids,
+            )
+            with torch.no_grad():
+                output = module.forward(rank_batch)
+            if output.scores is None:
+                raise ValueError(f"{module.__class__.__name__} did not return scores")
+            scores = iter(output.scores.view(-1).tolist())
+        for idx in range(query_idx, end_idx):
+            re_ranked.append([(doc_id, next(scores)) for doc_id, _ in candidates[idx]])
+        query_idx = end_idx
+    return re_ranked
+
+
 class _GatherMixin:
     def gather(self, pl_module: LightningIRModule, dataclass: T) -> T:
         if is_dataclass(dataclass):
+            # encodings of a batch are padded per process and cannot be gathered
             return dataclass.__class__(
-                **{k: self.gather(pl_module, getattr(dataclass, k)) for k in dataclass.__dataclass_fields__}
+                **{
+                    k: None if k == "encodings" else self.gather(pl_module, getattr(dataclass, k))
+                    for k in dataclass.__dataclass_fields__
+                }
             )
         return pl_module.all_gather(dataclass)
 
@@ -81,20 +171,26 @@ class _OverwriteMixin:
                 del trainer.datamodule.inference_datasets[dataset_idx]
 
 
-class IndexCallback(Callback, _GatherMixin, _IndexDirMixin, _OverwriteMixin):
+class IndexCallback(Callback, _IndexDirMixin, _OverwriteMixin):
     def __init__(
         self,
         index_config: IndexConfig,
         index_dir: Path | str | None = None,
         overwrite: bool = False,
         verbose: bool = False,
+        embedding_store_config: ResidualEmbeddingStoreConfig | None = None,
     ) -> None:
         super().__init__()
         self.index_config = index_config
         self.index_dir = index_dir
         self.overwrite = overwrite
         self.verbose = verbose
+        self.embedding_store_config = embedding_store_config
         self.indexer: Indexer
+        self.embedding_store_writer: ResidualEmbeddingStoreWriter | None = None
+        # documents of batches sorted by length that wait for the documents preceding them in the dataset
+        self._pending_docs: Dict[int, Tuple[str, torch.Tensor, torch.Tensor]] = {}
+        self._next_position = 0
 
     def setup(self, trainer: Trainer, pl_module: BiEncoderModule, stage: str) -> None:
         if stage != "test":
@@ -112,17 +208,58 @@ class IndexCallback(Callback, _GatherMixin, _IndexDirMixin, _OverwriteMixin):
         if not all(isinstance(dataset, DocDataset) for dataset in datasets):
             raise ValueError("Expected DocDatasets for indexing")
 
-    def get_indexer(self, trainer: Trainer, pl_module: BiEncoderModule, dataset_idx: int) -> Indexer:
+    def get_shard_dir(self, trainer: Trainer, pl_module: BiEncoderModule, dataset_idx: int) -> Path:
+        """Returns the directory the current process writes its part of the index to. With multiple devices, every
+        rank indexes the documents of its own dataloader into a separate shard of the index.
+
+        :param trainer: Trainer
+        :type trainer: Trainer
+        :param pl_module: Bi-encoder module
+        :type pl_module: BiEncoderModule
+        :param dataset_idx: Index of the dataset
+        :type dataset_idx: int
+        :return: Directory of the index shard
+        :rtype: Path
+        """
         dataloaders = trainer.test_dataloaders
         if dataloaders is None:
             raise ValueError("No test_dataloaders found")
         dataset = dataloaders[dataset_idx].dataset
 
         index_dir = self.get_index_dir(pl_module, dataset)
+        if trainer.world_size > 1:
+            index_dir = index_dir / f"shard-{trainer.global_rank}"
+        return index_dir
+
+    def write_shards(self, trainer: Trainer, pl_module: BiEncoderModule, dataset_idx: int) -> None:
+        dataloaders = trainer.test_dataloaders
+        if dataloaders is None:
+            raise ValueError("No test_dataloaders found")
+        index_dir = self.get_index_dir(pl_module, dataloaders[dataset_idx].dataset)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        # ranks without any documents do not save a shard
+        shards = [
+            f"shard-{rank}"
+            for rank in range(trainer.world_size)
+            if (index_dir / f"shard-{rank}" / "config.json").exists()
+        ]
+        (index_dir / "shards.json").write_text(json.dumps({"shards": shards}))
+
+    def get_indexer(self, trainer: Trainer, pl_module: BiEncoderModule, dataset_idx: int) -> Indexer:
+        index_dir = self.get_shard_dir(trainer, pl_module, dataset_idx)
 
         indexer = self.index_config.indexer_class(index_dir, self.index_config, pl_module.config, self.verbose)
         return indexer
 
+    def get_embedding_store_writer(
+        self, trainer: Trainer, pl_module: BiEncoderModule, dataset_idx: int
+    ) -> ResidualEmbeddingStoreWriter | None:
+        if self.embedding_store_config is None:
+            return None
+        index_dir = self.get_shard_dir(trainer, pl_module, dataset_idx)
+
+        return ResidualEmbeddingStoreWriter(index_dir, self.embedding_store_config, pl_module.config, self.verbose)
+
     def log_to_pg(self, info: Dict[str, Any], trainer: Trainer):
         pg_callback = trainer.progress_bar_callback
         if pg_callback is None or not isinstance(pg_callback, TQDMProgressBar):
@@ -132,11 +269,52 @@ class IndexCallback(Callback, _GatherMixin, _IndexDirMixin, _OverwriteMixin):
         if pg is not None:
             pg.set_postfix(info)
 
+    def add(self, batch: IndexBatch, outputs: BiEncoderOutput) -> None:
+        self.indexer.add(batch, outputs)
+        if self.embedding_store_writer is not None:
+            self.embedding_store_writer.add(batch, outputs)
+
+    def add_in_order(self, batch: IndexBatch, outputs: BiEncoderOutput) -> None:
+        """Adds the documents of a batch whose samples were sorted by length. The documents are buffered until all
+        documents preceding them in the dataset were added, so the index stores the documents in their original order.
+
+        :param batch: Batch of documents with positions
+        :type batch: IndexBatch
+        :param outputs: Output of the bi-encoder module
+        :type outputs: BiEncoderOutput
+        """
+        doc_embeddings = outputs.doc_embeddings
+        if doc_embeddings is None or batch.positions is None:
+            raise ValueError("Expected doc_embeddings in BiEncoderOutput and positions in IndexBatch")
+        for doc_id, position, embeddings, scoring_mask in zip(
+            batch.doc_ids, batch.positions, doc_embeddings.embeddings, doc_embeddings.scoring_mask
+        ):
+            self._pending_docs[int(position)] = (doc_id, embeddings, scoring_mask)
+        positions = []
+        while self._next_position in self._pending_docs:
+            positions.append(self._next_position)
+            self._next_position += 1
+        self.add_pending_docs(positions)
+
+    def add_pending_docs(self, positions: Sequence[int]) -> None:
+        if not positions:
+            return
+        doc_ids, embeddings, scoring_masks = zip(*(self._pending_docs.pop(position) for position in positions))
+        # re-pad the embeddings of the documents, which were padded per batch
+        doc_embeddings = BiEncoderEmbedding(
+            torch.nn.utils.rnn.pad_sequence(list(embeddings), batch_first=True),
+            torch.nn.utils.rnn.pad_sequence(list(scoring_masks), batch_first=True),
+        )
+        self.add(IndexBatch(list(doc_ids), [""] * len(doc_ids)), BiEncoderOutput(doc_embeddings=doc_embeddings))
+
     def on_test_batch_start(
         self, trainer: Trainer, pl_module: LightningIRModule, batch: Any, batch_idx: int, dataloader_idx: int = 0
     ) -> None:
         if batch_idx == 0:
             self.indexer = self.get_indexer(trainer, pl_module, dataloader_idx)
+            self.embedding_store_writer = self.get_embedding_store_writer(trainer, pl_module, dataloader_idx)
+            self._pending_docs = {}
+            self._next_position = 0
         super().on_test_batch_start(trainer, pl_module, batch, batch_idx, dataloader_idx)
 
     def on_test_batch_end(
@@ -148,13 +326,11 @@ class IndexCallback(Callback, _GatherMixin, _IndexDirMixin, _OverwriteMixin):
         batch_idx: int,
         dataloader_idx: int = 0,
     ) -> None:
-        batch = self.gather(pl_module, batch)
-        outputs = self.gather(pl_module, outputs)
-
-        if not trainer.is_global_zero:
-            return
-
-        self.indexer.add(batch, outputs)
+        # every rank indexes its own batches into its own shard, so indexing scales with the number of devices
+        if batch.positions is None:
+            self.add(batch, outputs)
+        else:
+            self.add_in_order(batch, outputs)
         self.log_to_pg(
             {
                 "num_docs": self.indexer.num_docs,
@@ -164,9 +340,22 @@ class IndexCallback(Callback, _GatherMixin, _IndexDirMixin, _OverwriteMixin):
         )
         if batch_idx == trainer.num_test_batches[dataloader_idx] - 1:
             assert hasattr(self, "indexer")
+            self.add_pending_docs(sorted(self._pending_docs))
             self.indexer.save()
+            if self.embedding_store_writer is not None:
+                self.embedding_store_writer.save()
         return super().on_test_batch_end(trainer, pl_module, outputs, batch, batch_idx, dataloader_idx)
 
+    def on_test_epoch_end(self, trainer: Trainer, pl_module: BiEncoderModule) -> None:
+        # every rank reaches the end of the epoch, also ranks without any batches, so the barrier cannot deadlock.
+        # only list the shards once every rank has saved its shard
+        if trainer.world_size > 1:
+            trainer.strategy.barrier()
+            if trainer.is_global_zero:
+                for dataset_idx in range(len(trainer.num_test_batches)):
+                    self.write_shards(trainer, pl_module, dataset_idx)
+        super().on_test_epoch_end(trainer, pl_module)
+
 
 class RankCallback(BasePredictionWriter, _GatherMixin, _OverwriteMixin):
     def __init__(
@@ -239,6 +428,9 @@ class RankCallback(BasePredictionWriter, _GatherMixin, _OverwriteMixin):
         run_file_path = self.get_save_path(trainer, pl_module, dataloader_idx)
         run_file_path.parent.mkdir(parents=True, exist_ok=True)
         run_df = pd.concat(self.run_dfs, ignore_index=True)
+        if "position" in run_df:
+            # restore the original order of the queries if the samples were sorted by length
+            run_df = run_df.sort_values("position", kind="stable").drop(columns="position")
         run_df.to_csv(run_file_path, header=False, index=False, sep="\t")
 
     def on_test_batch_end(
@@ -264,6 +456,10 @@ class RankCallback(BasePredictionWriter, _GatherMixin, _OverwriteMixin):
         batch_idx: int,
         dataloader_idx: int,
     ) -> None:
+        if batch.positions is not None:
+            # positions are relative to the samples of a process, map them to the dataset before gathering
+            dataset = trainer.datamodule.inference_datasets[dataloader_idx]
+            batch = replace(batch, positions=[dataset.global_position(int(position)) for position in batch.positions])
         batch = self.gather(pl_module, batch)
         prediction = self.gather(pl_module, prediction)
         if not trainer.is_global_zero:
@@ -284,6 +480,9 @@ class RankCallback(BasePredictionWriter, _GatherMixin, _OverwriteMixin):
         run_df["q0"] = 0
         run_df["system"] = pl_module.model.__class__.__name__
         run_df = run_df[RUN_HEADER]
+        if batch.positions is not None:
+            positions = [int(position) for position in batch.positions]
+            run_df["position"] = pd.Series(dict(zip(batch.query_ids, positions)))[run_df["query_id"]].values
 
         self.run_dfs.append(run_df)
 
@@ -307,7 +506,7 @@ class SearchCallback(RankCallback, _IndexDirMixin):
         self.index_dir = index_dir
         self.overwrite = overwrite
         self.use_gpu = use_gpu
-        self.searcher: Searcher
+        self.searcher: Searcher | ShardedSearcher
 
     def on_test_start(self, trainer: Trainer, pl_module: BiEncoderModule) -> None:
         dataloaders = trainer.test_dataloaders
@@ -317,7 +516,9 @@ class SearchCallback(RankCallback, _IndexDirMixin):
         if not all(isinstance(dataset, QueryDataset) for dataset in datasets):
             raise ValueError("Expected QueryDatasets for indexing")
 
-    def get_searcher(self, trainer: Trainer, pl_module: BiEncoderModule, dataset_idx: int) -> Searcher:
+    def get_searcher(
+        self, trainer: Trainer, pl_module: BiEncoderModule, dataset_idx: int
+    ) -> Searcher | ShardedSearcher:
         dataloaders = trainer.test_dataloaders
         if dataloaders is None:
             raise ValueError("No test_dataloaders found")
@@ -325,6 +526,8 @@ class SearchCallback(RankCallback, _IndexDirMixin):
 
         index_dir = self.get_index_dir(pl_module, dataset)
 
+        if ShardedSearcher.is_sharded(index_dir):
+            return ShardedSearcher(index_dir, self.search_config, pl_module, self.use_gpu)
         searcher = self.search_config.search_class(index_dir, self.search_config, pl_module, self.use_gpu)
         return searcher
 
@@ -350,6 +553,123 @@ class ReRankCallback(RankCallback):
     pass
 
 
+class CascadeCallback(SearchCallback):
+    def __init__(
+        self,
+        search_config: SearchConfig,
+        re_rank_modules: Sequence[LightningIRModule],
+        depths: Sequence[int] | None = None,
+        index_dir: Path | str | None = None,
+        save_dir: Path | str | None = None,
+        run_name: str | None = None,
+        overwrite: bool = False,
+        use_gpu: bool = True,
+        re_rank_batch_size: int = 256,
+    ) -> None:
+        """Retrieves documents with the searcher of a bi-encoder and re-ranks them with a cascade of re-ranking
+        modules in the same run. Every stage re-ranks the top documents of the previous stage, the candidates and
+        their texts are kept in memory between stages and the documents' texts are only fetched once. The run file
+        contains the documents re-ranked by the last stage.
+
+        :param search_config: Configuration of the searcher of the first stage
+        :type search_config: SearchConfig
+        :param re_rank_modules: Modules that re-rank the candidates of the previous stage
+        :type re_rank_modules: Sequence[LightningIRModule]
+        :param depths: Number of candidates of the previous stage each re-ranking module re-ranks, None re-ranks all
+            candidates, defaults to None
+        :type depths: Sequence[int] | None, optional
+        :param index_dir: Directory of the index to search, defaults to None
+        :type index_dir: Path | str | None, optional
+        :param save_dir: Directory to save the run files to, defaults to None
+        :type save_dir: Path | str | None, optional
+        :param run_name: Name of the run file, defaults to None
+        :type run_name: str | None, optional
+        :param overwrite: Whether to overwrite existing run files, defaults to False
+        :type overwrite: bool, optional
+        :param use_gpu: Whether to search on the gpu, defaults to True
+        :type use_gpu: bool, optional
+        :param re_rank_batch_size: Maximum number of query-document pairs re-ranked at once, defaults to 256
+        :type re_rank_batch_size: int, optional
+        :raises ValueError: If the number of depths does not match the number of re-ranking modules
+        :raises ValueError: If the depths are not decreasing
+        """
+        super().__init__(
+            search_config,
+            index_dir=index_dir,
+            save_dir=save_dir,
+            run_name=run_name,
+            overwrite=overwrite,
+            use_gpu=use_gpu,
+        )
+        if depths is None:
+            depths = [search_config.k] * len(re_rank_modules)
+        if len(depths) != len(re_rank_modules):
+            raise ValueError("Expected one depth per re-ranking module")
+        if any(depth > previous_depth for previous_depth, depth in zip(depths, depths[1:])):
+            raise ValueError("Expected the depths of the re-ranking modules to be decreasing")
+        self.re_rank_modules = list(re_rank_modules)
+        self.depths = list(depths)
+        self.re_rank_batch_size = re_rank_batch_size
+        self._docs: Any = None
+
+    def on_test_start(self, trainer: Trainer, pl_module: BiEncoderModule) -> None:
+        super().on_test_start(trainer, pl_module)
+        for module in self.re_rank_modules:
+            module.to(pl_module.device)
+            module.eval()
+
+    def on_test_batch_start(
+        self, trainer: Trainer, pl_module: LightningIRModule, batch: Any, batch_idx: int, dataloader_idx: int = 0
+    ) -> None:
+        if batch_idx == 0:
+            dataloaders = trainer.test_dataloaders
+            if dataloaders is None:
+                raise ValueError("No test_dataloaders found")
+            self._docs = dataloaders[dataloader_idx].dataset.docs
+        return super().on_test_batch_start(trainer, pl_module, batch, batch_idx, dataloader_idx)
+
+    def on_test_batch_end(
+        self,
+        trainer: Trainer,
+        pl_module: LightningIRModule,
+        outputs: LightningIROutput,
+        batch: Any,
+        batch_idx: int,
+        dataloader_idx: int = 0,
+    ) -> None:
+        self.re_rank(batch, outputs)
+        super().on_test_batch_end(trainer, pl_module, outputs, batch, batch_idx, dataloader_idx)
+
+    def re_rank(self, batch: SearchBatch, output: LightningIROutput) -> None:
+        """Re-ranks the retrieved documents of a batch with all stages of the cascade. Replaces the document ids of the
+        batch and the scores of the output with the documents and scores of the last stage.
+
+        :param batch: Batch of queries with retrieved document ids
+        :type batch: SearchBatch
+        :param output: Output of the bi-encoder with the retrieval scores
+        :type output: LightningIROutput
+        """
+        if batch.doc_ids is None or output.scores is None:
+            raise ValueError("BiEncoderModule did not return doc_ids and scores when searching")
+        scores = iter(output.scores.view(-1).tolist())
+        candidates = [[(doc_id, next(scores)) for doc_id in doc_ids] for doc_ids in batch.doc_ids]
+        doc_texts: Dict[str, str] = {}
+        for module, depth in zip(self.re_rank_modules, self.depths):
+            candidates = [sorted(_candidates, key=lambda c: c[1], reverse=True)[:depth] for _candidates in candidates]
+            # the texts of all candidates of a stage that were not fetched by a previous stage are fetched at once
+            missing = {doc_id for doc_id, _ in itertools.chain.from_iterable(candidates) if doc_id not in doc_texts}
+            if missing:
+                doc_texts.update(fetch_doc_texts(self._docs, list(missing)))
+            candidates = re_rank_candidates(
+                module, batch.queries, batch.query_ids, candidates, doc_texts, self.re_rank_batch_size
+            )
+        candidates = [sorted(_candidates, key=lambda c: c[1], reverse=True) for _candidates in candidates]
+        batch.doc_ids = tuple(tuple(doc_id for doc_id, _ in _candidates) for _candidates in candidates)
+        output.scores = torch.tensor(
+            [score for _candidates in candidates for _, score in _candidates], device=output.scores.device
+        )
+
+
 class RegisterLocalDatasetCallback(Callback):
 
     def __init__(
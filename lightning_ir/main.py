@@ -79,6 +79,17 @@ class LightningIRTrainer(Trainer):
         """Re-rank a set of retrieved documents."""
         return super().test(model, dataloaders, ckpt_path, verbose, datamodule)
 
+    def cascade(
+        self,
+        model: LightningModule | None = None,
+        dataloaders: Any | LightningDataModule | None = None,
+        ckpt_path: str | Path | None = None,
+        verbose: bool = True,
+        datamodule: LightningDataModule | None = None,
+    ) -> List[Mapping[str, float]]:
+        """Search for relevant documents and re-rank them with a cascade of re-ranking models."""
+        return super().test(model, dataloaders, ckpt_path, verbose, datamodule)
+
 
 class LightningIRCLI(LightningCLI):
     @staticmethod
@@ -105,6 +116,7 @@ class LightningIRCLI(LightningCLI):
             "index": {"model", "dataloaders", "datamodule"},
             "search": {"model", "dataloaders", "datamodule"},
             "re_rank": {"model", "dataloaders", "datamodule"},
+            "cascade": {"model", "dataloaders", "datamodule"},
         }
 
     def _add_configure_optimizers_method_to_model(self, subcommand: str | None) -> None:
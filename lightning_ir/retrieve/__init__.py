@@ -1,3 +1,9 @@
+from .embedding_store import (
+    ResidualCodec,
+    ResidualEmbeddingStore,
+    ResidualEmbeddingStoreConfig,
+    ResidualEmbeddingStoreWriter,
+)
 from .faiss_indexer import (
     FaissFlatIndexConfig,
     FaissFlatIndexer,
@@ -10,7 +16,10 @@ from .faiss_indexer import (
 )
 from .faiss_searcher import FaissSearchConfig, FaissSearcher
 from .indexer import IndexConfig, Indexer
+from .plaid_indexer import PLAIDIndexConfig, PLAIDIndexer
+from .plaid_searcher import PLAIDSearchConfig, PLAIDSearcher
 from .searcher import SearchConfig, Searcher
+from .sharded_searcher import ShardedSearcher
 from .sparse_indexer import SparseIndexConfig, SparseIndexer
 from .sparse_searcher import SparseSearchConfig, SparseSearcher
 
@@ -27,8 +36,17 @@ __all__ = [
     "FaissSearcher",
     "IndexConfig",
     "Indexer",
+    "PLAIDIndexConfig",
+    "PLAIDIndexer",
+    "PLAIDSearchConfig",
+    "PLAIDSearcher",
+    "ResidualCodec",
+    "ResidualEmbeddingStore",
+    "ResidualEmbeddingStoreConfig",
+    "ResidualEmbeddingStoreWriter",
     "SearchConfig",
     "Searcher",
+    "ShardedSearcher",
     "SparseIndexConfig",
     "SparseIndexer",
     "SparseSearcher",
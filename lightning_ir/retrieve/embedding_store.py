@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import json
+import warnings
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple
+
+import torch
+
+if TYPE_CHECKING:
+    from ..bi_encoder import BiEncoderConfig, BiEncoderOutput
+    from ..data import IndexBatch
+
+
+class ResidualCodec:
+    def __init__(
+        self, centroids: torch.Tensor, bucket_cutoffs: torch.Tensor, bucket_weights: torch.Tensor, n_bits: int
+    ) -> None:
+        """Compresses embeddings into the id of their nearest centroid and a per-dimension quantized residual
+        (ColBERTv2-style). Each residual dimension is quantized into one of 2^n_bits buckets and the bucket indices are
+        bit-packed into bytes.
+
+        :param centroids: Centroids of shape [num_centroids x embedding_dim]
+        :type centroids: torch.Tensor
+        :param bucket_cutoffs: Residual values separating the buckets of shape [2^n_bits - 1]
+        :type bucket_cutoffs: torch.Tensor
+        :param bucket_weights: Residual value each bucket is decompressed to of shape [2^n_bits]
+        :type bucket_weights: torch.Tensor
+        :param n_bits: Number of bits per residual dimension
+        :type n_bits: int
+        :raises ValueError: If n_bits is not 1, 2, 4, or 8
+        :raises ValueError: If the embedding dimension is not divisible by the number of values per byte
+        """
+        if n_bits not in (1, 2, 4, 8):
+            raise ValueError(f"n_bits must be 1, 2, 4, or 8, got {n_bits}")
+        if centroids.shape[1] % (8 // n_bits) != 0:
+            raise ValueError(f"embedding_dim must be divisible by {8 // n_bits} for n_bits={n_bits}")
+        self.centroids = centroids
+        self.bucket_cutoffs = bucket_cutoffs
+        self.bucket_weights = bucket_weights
+        self.n_bits = n_bits
+        self._shifts = torch.arange(0, 8, n_bits, dtype=torch.uint8, device=centroids.device)
+
+    @property
+    def num_centroids(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def embedding_dim(self) -> int:
+        return self.centroids.shape[1]
+
+    @classmethod
+    def train(cls, embeddings: torch.Tensor, num_centroids: int, n_bits: int, verbose: bool = False) -> ResidualCodec:
+        """Trains centroids with k-means and derives the residual buckets from quantiles of the training residuals.
+
+        :param embeddings: Training embeddings of shape [num_embeddings x embedding_dim]
+        :type embeddings: torch.Tensor
+        :param num_centroids: Number of centroids
+        :type num_centroids: int
+        :param n_bits: Number of bits per residual dimension
+        :type n_bits: int
+        :param verbose: Whether to log k-means progress, defaults to False
+        :type verbose: bool, optional
+        :return: Trained codec
+        :rtype: ResidualCodec
+        """
+        import faiss
+
+        embeddings = embeddings.float().cpu()
+        if num_centroids > embeddings.shape[0]:
+            warnings.warn(
+                f"Fewer training embeddings ({embeddings.shape[0]}) than num_centroids ({num_centroids}). "
+                "Reducing num_centroids."
+            )
+            num_centroids = embeddings.shape[0]
+        kmeans = faiss.Kmeans(embeddings.shape[1], num_centroids, niter=20, verbose=verbose)
+        kmeans.train(embeddings.numpy())
+        centroids = torch.from_numpy(kmeans.centroids).clone()
+        num_buckets = 2**n_bits
+        codec = cls(centroids, torch.zeros(num_buckets - 1), torch.zeros(num_buckets), n_bits)
+        residuals = embeddings - centroids[codec.encode_centroids(embeddings)]
+        # torch.quantile supports at most 2^24 values
+        residuals = residuals.view(-1)[: 2**24]
+        quantiles = torch.arange(num_buckets, dtype=torch.float32) / num_buckets
+        codec.bucket_cutoffs = torch.quantile(residuals, quantiles[1:])
+        codec.bucket_weights = torch.quantile(residuals, quantiles + 0.5 / num_buckets)
+        return codec
+
+    def encode_centroids(self, embeddings: torch.Tensor, batch_size: int = 4096) -> torch.Tensor:
+        """Assigns each embedding to its nearest centroid by euclidean distance.
+
+        :param embeddings: Embeddings of shape [num_embeddings x embedding_dim]
+        :type embeddings: torch.Tensor
+        :param batch_size: Number of embeddings to assign at once, defaults to 4096
+        :type batch_size: int, optional
+        :return: Centroid ids of shape [num_embeddings]
+        :rtype: torch.Tensor
+        """
+        embeddings = embeddings.to(self.centroids)
+        # argmin ||e - c||^2 = argmax e * c - ||c||^2 / 2
+        half_centroid_norms = 0.5 * self.centroids.pow(2).sum(dim=-1)
+        codes = torch.empty(embeddings.shape[0], dtype=torch.int32, device=self.centroids.device)
+        for i in range(0, embeddings.shape[0], batch_size):
+            similarities = embeddings[i : i + batch_size] @ self.centroids.T - half_centroid_norms
+            codes[i : i + batch_size] = similarities.argmax(dim=-1)
+        return codes
+
+    def compress(self, embeddings: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compresses embeddings into centroid ids and bit-packed residual buckets.
+
+        :param embeddings: Embeddings of shape [num_embeddings x embedding_dim]
+        :type embeddings: torch.Tensor
+        :return: Centroid ids of shape [num_embeddings] and packed residuals of shape
+            [num_embeddings x embedding_dim * n_bits / 8]
+        :rtype: Tuple[torch.Tensor, torch.Tensor]
+        """
+        embeddings = embeddings.to(self.centroids)
+        codes = self.encode_centroids(embeddings)
+        residuals = embeddings - self.centroids[codes]
+        buckets = torch.bucketize(residuals, self.bucket_cutoffs).to(torch.uint8)
+        buckets = buckets.unflatten(-1, (-1, self._shifts.shape[0]))
+        packed = (buckets << self._shifts).sum(dim=-1, dtype=torch.uint8)
+        return codes, packed
+
+    def decompress(self, codes: torch.Tensor, packed_residuals: torch.Tensor) -> torch.Tensor:
+        """Decompresses centroid ids and bit-packed residual buckets into approximate embeddings.
+
+        :param codes: Centroid ids of shape [num_embeddings]
+        :type codes: torch.Tensor
+        :param packed_residuals: Packed residuals of shape [num_embeddings x embedding_dim * n_bits / 8]
+        :type packed_residuals: torch.Tensor
+        :return: Approximate embeddings of shape [num_embeddings x embedding_dim]
+        :rtype: torch.Tensor
+        """
+        codes = codes.to(self.centroids.device).long()
+        packed_residuals = packed_residuals.to(self.centroids.device)
+        mask = 2**self.n_bits - 1
+        buckets = (packed_residuals[..., None] >> self._shifts) & mask
+        residuals = self.bucket_weights[buckets.flatten(-2).long()]
+        return self.centroids[codes] + residuals
+
+    def to(self, device: torch.device) -> ResidualCodec:
+        self.centroids = self.centroids.to(device)
+        self.bucket_cutoffs = self.bucket_cutoffs.to(device)
+        self.bucket_weights = self.bucket_weights.to(device)
+        self._shifts = self._shifts.to(device)
+        return self
+
+    def save(self, index_dir: Path) -> None:
+        torch.save(
+            {
+                "centroids": self.centroids.cpu(),
+                "bucket_cutoffs": self.bucket_cutoffs.cpu(),
+                "bucket_weights": self.bucket_weights.cpu(),
+                "n_bits": self.n_bits,
+            },
+            index_dir / "residual_codec.pt",
+        )
+
+    @classmethod
+    def from_pretrained(cls, index_dir: Path) -> ResidualCodec:
+        data = torch.load(index_dir / "residual_codec.pt", weights_only=True)
+        return cls(data["centroids"], data["bucket_cutoffs"], data["bucket_weights"], data["n_bits"])
+
+
+class ResidualEmbeddingStoreWriter:
+    def __init__(
+        self,
+        index_dir: Path,
+        store_config: ResidualEmbeddingStoreConfig,
+        bi_encoder_config: BiEncoderConfig,
+        verbose: bool = False,
+    ) -> None:
+        """Writes a residual-compressed copy of all document token embeddings next to an index. The codec is trained
+        on the first num_train_embeddings embeddings, which are buffered until then.
+
+        :param index_dir: Directory to write the store to
+        :type index_dir: Path
+        :param store_config: Configuration of the store
+        :type store_config: ResidualEmbeddingStoreConfig
+        :param bi_encoder_config: Configuration of the bi-encoder model
+        :type bi_encoder_config: BiEncoderConfig
+        :param verbose: Whether to log codec training progress, defaults to False
+        :type verbose: bool, optional
+        """
+        self.index_dir = index_dir
+        self.store_config = store_config
+        self.bi_encoder_config = bi_encoder_config
+        self.verbose = verbose
+        self.num_train_embeddings = store_config.num_train_embeddings or store_config.num_centroids * 64
+        self.codec: ResidualCodec | None = None
+        self._train_embeddings: List[torch.Tensor] = []
+        self._num_buffered_embeddings = 0
+        self.codes: List[torch.Tensor] = []
+        self.residuals: List[torch.Tensor] = []
+        self.num_embeddings = 0
+
+    def add(self, index_batch: IndexBatch, output: BiEncoderOutput) -> None:
+        doc_embeddings = output.doc_embeddings
+        if doc_embeddings is None:
+            raise ValueError("Expected doc_embeddings in BiEncoderOutput")
+        embeddings = doc_embeddings.embeddings[doc_embeddings.scoring_mask].float().cpu()
+        self.num_embeddings += embeddings.shape[0]
+        if self.codec is None:
+            self._train_embeddings.append(embeddings)
+            self._num_buffered_embeddings += embeddings.shape[0]
+            if self._num_buffered_embeddings >= self.num_train_embeddings:
+                self._train()
+            return
+        self._compress(embeddings)
+
+    def _train(self) -> None:
+        embeddings = torch.cat(self._train_embeddings)
+        self.codec = ResidualCodec.train(
+            embeddings[: self.num_train_embeddings],
+            self.store_config.num_centroids,
+            self.store_config.n_bits,
+            self.verbose,
+        )
+        self._train_embeddings = []
+        self._compress(embeddings)
+
+    def _compress(self, embeddings: torch.Tensor) -> None:
+        assert self.codec is not None
+        codes, residuals = self.codec.compress(embeddings)
+        self.codes.append(codes)
+        self.residuals.append(residuals)
+
+    def save(self) -> None:
+        if self.codec is None:
+            self._train()
+        assert self.codec is not None
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.store_config.save(self.index_dir)
+        self.codec.save(self.index_dir)
+        residuals = {
+            "codes": torch.cat(self.codes),
+            "residuals": torch.cat(self.residuals),
+        }
+        # saved as plain tensors so that the store can be memory-mapped
+        torch.save(residuals, self.index_dir / "residuals.pt")
+
+
+class ResidualEmbeddingStore:
+    def __init__(self, index_dir: Path | str, use_gpu: bool = False) -> None:
+        """Memory-mapped residual-compressed document token embeddings written by a
+        :class:`ResidualEmbeddingStoreWriter`.
+
+        :param index_dir: Directory of the store
+        :type index_dir: Path | str
+        :param use_gpu: Whether to decompress embeddings on the gpu, defaults to False
+        :type use_gpu: bool, optional
+        """
+        index_dir = Path(index_dir)
+        self.device = torch.device("cuda") if use_gpu and torch.cuda.is_available() else torch.device("cpu")
+        self.codec = ResidualCodec.from_pretrained(index_dir).to(self.device)
+        residuals = torch.load(index_dir / "residuals.pt", mmap=True, weights_only=True)
+        self.codes: torch.Tensor = residuals["codes"]
+        self.residuals: torch.Tensor = residuals["residuals"]
+
+    @staticmethod
+    def exists(index_dir: Path | str) -> bool:
+        return (Path(index_dir) / "residuals.pt").exists()
+
+    @property
+    def num_embeddings(self) -> int:
+        return self.codes.shape[0]
+
+    def lookup(self, embedding_idcs: torch.Tensor) -> torch.Tensor:
+        """Decompresses the embeddings with the given indices.
+
+        :param embedding_idcs: Embedding indices
+        :type embedding_idcs: torch.Tensor
+        :return: Approximate embeddings of shape [num_embedding_idcs x embedding_dim]
+        :rtype: torch.Tensor
+        """
+        embedding_idcs = embedding_idcs.cpu()
+        return self.codec.decompress(self.codes[embedding_idcs], self.residuals[embedding_idcs])
+
+
+class ResidualEmbeddingStoreConfig:
+    def __init__(self, num_centroids: int = 16384, n_bits: int = 2, num_train_embeddings: int | None = None) -> None:
+        self.num_centroids = num_centroids
+        self.n_bits = n_bits
+        self.num_train_embeddings = num_train_embeddings
+
+    @classmethod
+    def from_pretrained(cls, index_dir: Path) -> ResidualEmbeddingStoreConfig:
+        with open(index_dir / "embedding_store_config.json", "r") as f:
+            return cls(**json.load(f))
+
+    def save(self, index_dir: Path) -> None:
+        index_dir.mkdir(parents=True, exist_ok=True)
+        with open(index_dir / "embedding_store_config.json", "w") as f:
+            json.dump(self.__dict__, f)
@@ -6,7 +6,8 @@ from typing import TYPE_CHECKING, List, Literal, Tuple
 import torch
 
 from ..bi_encoder.model import BiEncoderEmbedding
-from .searcher import SearchConfig, Searcher
+from .embedding_store import ResidualEmbeddingStore
+from .searcher import SearchConfig, Searcher, segment_arange
 
 if TYPE_CHECKING:
     from ..bi_encoder import BiEncoderModule
@@ -33,6 +34,11 @@ class FaissSearcher(Searcher):
                 hnsw = getattr(downcasted_quantizer, "hnsw", None)
                 if hnsw is not None:
                     hnsw.efSearch = search_config.ef_search
+        # a residual-compressed embedding store written next to the index replaces reconstructing document
+        # embeddings from the faiss index, which requires a direct map
+        self.embedding_store = (
+            ResidualEmbeddingStore(index_dir, use_gpu) if ResidualEmbeddingStore.exists(index_dir) else None
+        )
         super().__init__(index_dir, search_config, module, use_gpu)
 
     @property
@@ -64,46 +70,33 @@ class FaissSearcher(Searcher):
         if self.doc_is_single_vector:
             candidate_doc_idcs = candidate_idcs.to(self.cumulative_doc_lengths.device)
         else:
-            candidate_doc_idcs = torch.searchsorted(
-                self.cumulative_doc_lengths,
-                candidate_idcs.to(self.cumulative_doc_lengths.device),
-                side="right",
-            )
+            candidate_idcs = candidate_idcs.to(self.cumulative_doc_lengths.device)
+            candidate_doc_idcs = torch.searchsorted(self.cumulative_doc_lengths, candidate_idcs, side="right")
+            # faiss pads missing candidates with -1, which must not be mapped to the first document
+            candidate_doc_idcs = candidate_doc_idcs.masked_fill(candidate_idcs < 0, -1)
         return candidate_scores, candidate_doc_idcs
 
+    def _reconstruct(self, embedding_idcs: torch.Tensor) -> torch.Tensor:
+        return torch.from_numpy(self.index.reconstruct_batch(embedding_idcs.cpu()))
+
     def gather_imputation(
         self, candidate_doc_idcs: torch.Tensor, query_lengths: torch.Tensor
     ) -> Tuple[BiEncoderEmbedding, torch.Tensor, List[int]]:
-        # unique doc_idcs per query
-        doc_idcs_per_query = [
-            list(sorted(set(idcs.reshape(-1).tolist())))
-            for idcs in torch.split(candidate_doc_idcs, query_lengths.tolist())
-        ]
-        num_docs = [len(idcs) for idcs in doc_idcs_per_query]
-        doc_idcs = torch.tensor(sum(doc_idcs_per_query, [])).to(candidate_doc_idcs)
-        unique_doc_idcs, inverse_idcs = torch.unique(doc_idcs, return_inverse=True)
-
-        # gather all vectors for unique doc_idcs
-        doc_lengths = self.doc_lengths[unique_doc_idcs]
-        start_doc_idcs = self.cumulative_doc_lengths[unique_doc_idcs - 1]
-        start_doc_idcs[unique_doc_idcs == 0] = 0
-        all_doc_idcs = torch.cat(
-            [
-                torch.arange(start.item(), start.item() + length.item())
-                for start, length in zip(start_doc_idcs.cpu(), doc_lengths.cpu())
-            ]
+        # unique doc_idcs per query, sorted by doc_idx
+        query_idcs = torch.arange(query_lengths.shape[0], device=query_lengths.device).repeat_interleave(
+            query_lengths * candidate_doc_idcs.shape[1]
         )
-        all_doc_embeddings = torch.from_numpy(self.index.reconstruct_batch(all_doc_idcs))
-        unique_embeddings = torch.nn.utils.rnn.pad_sequence(
-            [embeddings for embeddings in torch.split(all_doc_embeddings, doc_lengths.tolist())],
-            batch_first=True,
-        ).to(inverse_idcs.device)
-        embeddings = unique_embeddings[inverse_idcs]
-
-        # mask out padding
-        doc_lengths = doc_lengths[inverse_idcs]
-        scoring_mask = torch.arange(embeddings.shape[1], device=embeddings.device) < doc_lengths[:, None]
-        doc_embeddings = BiEncoderEmbedding(embeddings=embeddings, scoring_mask=scoring_mask)
+        candidate_doc_idcs = candidate_doc_idcs.reshape(-1).to(query_idcs)
+        # faiss pads missing candidates with -1
+        is_valid = candidate_doc_idcs >= 0
+        paired_idcs = torch.unique(query_idcs[is_valid] * self.num_docs + candidate_doc_idcs[is_valid])
+        doc_idcs = paired_idcs % self.num_docs
+        num_docs = torch.bincount(paired_idcs // self.num_docs, minlength=query_lengths.shape[0]).tolist()
+        if self.embedding_store is not None:
+            lookup = self.embedding_store.lookup
+        else:
+            lookup = self._reconstruct
+        doc_embeddings = self._gather_doc_embeddings(doc_idcs, lookup)
         return doc_embeddings, doc_idcs, num_docs
 
     def intra_ranking_imputation(
@@ -116,17 +109,17 @@ class FaissSearcher(Searcher):
         query_is_single_vector = max_query_length == 1
 
         if self.doc_is_single_vector:
-            scores = candidate_scores.view(-1)
-            doc_idcs = candidate_doc_idcs.view(-1)
-            num_docs = torch.full((candidate_scores.shape[0],), candidate_scores.shape[1])
+            # faiss pads missing candidates with -1
+            is_valid = candidate_doc_idcs >= 0
+            scores = candidate_scores.to(is_valid.device)[is_valid]
+            doc_idcs = candidate_doc_idcs[is_valid]
+            num_docs = is_valid.sum(-1)
         else:
             # grab unique doc ids per query candidate
             query_idcs = torch.arange(query_lengths.shape[0], device=query_lengths.device).repeat_interleave(
                 query_lengths
             )
-            query_candidate_idcs = torch.cat(
-                [torch.arange(length.item(), device=query_lengths.device) for length in query_lengths]
-            )
+            query_candidate_idcs = segment_arange(torch.zeros_like(query_lengths), query_lengths)
             paired_idcs = torch.stack(
                 [
                     query_idcs.repeat_interleave(candidate_scores.shape[1]),
@@ -134,9 +127,13 @@ class FaissSearcher(Searcher):
                     candidate_doc_idcs.view(-1),
                 ]
             ).T
+            # faiss pads missing candidates with -1
+            is_valid = paired_idcs[:, 2] >= 0
+            paired_idcs = paired_idcs[is_valid]
+            candidate_scores = candidate_scores.view(-1)[is_valid.to(candidate_scores.device)]
             unique_paired_idcs, inverse_idcs = torch.unique(paired_idcs[:, [0, 2]], return_inverse=True, dim=0)
             doc_idcs = unique_paired_idcs[:, 1]
-            num_docs = unique_paired_idcs[:, 0].bincount()
+            num_docs = unique_paired_idcs[:, 0].bincount(minlength=query_lengths.shape[0])
 
             # accumulate max score per doc
             ranking_doc_idcs = torch.arange(doc_idcs.shape[0], device=query_lengths.device)[inverse_idcs]
@@ -6,6 +6,7 @@ from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import TYPE_CHECKING
 
+import numpy as np
 import torch
 
 if TYPE_CHECKING:
@@ -35,7 +36,10 @@ class Indexer(ABC):
 
     def save(self) -> None:
         self.index_config.save(self.index_dir)
-        (self.index_dir / "doc_ids.txt").write_text("\n".join(self.doc_ids))
+        # doc_ids are stored as a fixed-width byte array so that searchers can memory-map them and resolve document
+        # indices to ids with a single gather. surrounding whitespace is stripped as with plain text doc_ids
+        doc_ids = np.array([doc_id.strip().encode("utf-8") for doc_id in self.doc_ids], dtype=np.bytes_)
+        np.save(self.index_dir / "doc_ids.npy", doc_ids)
         doc_lengths = torch.tensor(self.doc_lengths)
         torch.save(doc_lengths, self.index_dir / "doc_lengths.pt")
 
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import torch
+
+from ..bi_encoder import BiEncoderConfig, BiEncoderOutput
+from ..data import IndexBatch
+from .embedding_store import ResidualEmbeddingStoreConfig, ResidualEmbeddingStoreWriter
+from .indexer import IndexConfig, Indexer
+
+
+class PLAIDIndexer(Indexer):
+    def __init__(
+        self,
+        index_dir: Path,
+        index_config: PLAIDIndexConfig,
+        bi_encoder_config: BiEncoderConfig,
+        verbose: bool = False,
+    ) -> None:
+        super().__init__(index_dir, index_config, bi_encoder_config, verbose)
+        self.index_config: PLAIDIndexConfig
+        store_config = ResidualEmbeddingStoreConfig(
+            index_config.num_centroids, index_config.n_bits, index_config.num_train_embeddings
+        )
+        self.embedding_store_writer = ResidualEmbeddingStoreWriter(index_dir, store_config, bi_encoder_config, verbose)
+
+    def add(self, index_batch: IndexBatch, output: BiEncoderOutput) -> None:
+        doc_embeddings = output.doc_embeddings
+        if doc_embeddings is None:
+            raise ValueError("Expected doc_embeddings in BiEncoderOutput")
+        doc_lengths = doc_embeddings.scoring_mask.sum(dim=1)
+        self.embedding_store_writer.add(index_batch, output)
+
+        self.num_embeddings += int(doc_lengths.sum().item())
+        self.num_docs += len(index_batch.doc_ids)
+        self.doc_lengths.extend(doc_lengths.cpu().tolist())
+        self.doc_ids.extend(index_batch.doc_ids)
+
+    def save(self) -> None:
+        super().save()
+        self.embedding_store_writer.save()
+        assert self.embedding_store_writer.codec is not None
+        num_centroids = self.embedding_store_writer.codec.num_centroids
+        codes = torch.cat(self.embedding_store_writer.codes).long()
+        doc_idcs = torch.arange(self.num_docs).repeat_interleave(torch.tensor(self.doc_lengths, dtype=torch.long))
+
+        # centroid bag of each document, i.e., the unique centroids of its token embeddings
+        doc_centroid_idcs = torch.unique(doc_idcs * num_centroids + codes)
+        bag_doc_idcs = doc_centroid_idcs // num_centroids
+        bag_centroid_idcs = doc_centroid_idcs % num_centroids
+        bag_indptr = torch.nn.functional.pad(torch.bincount(bag_doc_idcs, minlength=self.num_docs).cumsum(0), (1, 0))
+
+        # inverted lists of the documents containing each centroid
+        centroid_doc_idcs = torch.unique(bag_centroid_idcs * self.num_docs + bag_doc_idcs)
+        ivf_centroid_idcs = centroid_doc_idcs // self.num_docs
+        ivf_doc_idcs = centroid_doc_idcs % self.num_docs
+        ivf_indptr = torch.nn.functional.pad(
+            torch.bincount(ivf_centroid_idcs, minlength=num_centroids).cumsum(0), (1, 0)
+        )
+
+        # saved as plain tensors so that searchers can memory-map them
+        plaid = {
+            "bag_indptr": bag_indptr,
+            "bag_centroid_idcs": bag_centroid_idcs.int(),
+            "ivf_indptr": ivf_indptr,
+            "ivf_doc_idcs": ivf_doc_idcs.int(),
+        }
+        torch.save(plaid, self.index_dir / "plaid.pt")
+
+    def to_gpu(self) -> None:
+        pass
+
+    def to_cpu(self) -> None:
+        pass
+
+
+class PLAIDIndexConfig(IndexConfig):
+    indexer_class = PLAIDIndexer
+
+    def __init__(self, num_centroids: int = 16384, n_bits: int = 2, num_train_embeddings: int | None = None) -> None:
+        super().__init__()
+        self.num_centroids = num_centroids
+        self.n_bits = n_bits
+        self.num_train_embeddings = num_train_embeddings
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple
+
+import torch
+
+from ..bi_encoder.model import BiEncoderEmbedding
+from .embedding_store import ResidualEmbeddingStore
+from .searcher import SearchConfig, Searcher, segment_arange
+
+if TYPE_CHECKING:
+    from ..bi_encoder import BiEncoderModule
+
+
+class PLAIDSearcher(Searcher):
+    def __init__(
+        self, index_dir: Path | str, search_config: PLAIDSearchConfig, module: BiEncoderModule, use_gpu: bool = False
+    ) -> None:
+        """Searcher for PLAID indexes. Candidate documents are generated from the inverted lists of the centroids
+        closest to the query embeddings and are then pruned in stages that only use the documents' centroid bags.
+        Only the residuals of the surviving candidates are decompressed for exact late-interaction scoring.
+
+        :param index_dir: Directory of the index
+        :type index_dir: Path | str
+        :param search_config: Configuration of the searcher
+        :type search_config: PLAIDSearchConfig
+        :param module: Bi-encoder module used for exact scoring
+        :type module: BiEncoderModule
+        :param use_gpu: Whether to search on the gpu, defaults to False
+        :type use_gpu: bool, optional
+        """
+        self.search_config: PLAIDSearchConfig
+        self.embedding_store = ResidualEmbeddingStore(index_dir, use_gpu)
+        plaid = torch.load(Path(index_dir) / "plaid.pt", mmap=True, weights_only=True)
+        self.bag_indptr: torch.Tensor = plaid["bag_indptr"]
+        self.bag_centroid_idcs: torch.Tensor = plaid["bag_centroid_idcs"]
+        self.ivf_indptr: torch.Tensor = plaid["ivf_indptr"]
+        self.ivf_doc_idcs: torch.Tensor = plaid["ivf_doc_idcs"]
+        super().__init__(index_dir, search_config, module, use_gpu)
+
+    @property
+    def num_embeddings(self) -> int:
+        return self.embedding_store.num_embeddings
+
+    def to_gpu(self) -> None:
+        super().to_gpu()
+        self.bag_indptr = self.bag_indptr.to(self.device)
+        self.bag_centroid_idcs = self.bag_centroid_idcs.to(self.device)
+        self.ivf_indptr = self.ivf_indptr.to(self.device)
+        self.ivf_doc_idcs = self.ivf_doc_idcs.to(self.device)
+
+    def candidate_generation(self, centroid_scores: torch.Tensor) -> torch.Tensor:
+        """Retrieves all documents that contain any of the n_cells centroids closest to a query embedding.
+
+        :param centroid_scores: Scores between query embeddings and centroids of shape [query_length x num_centroids]
+        :type centroid_scores: torch.Tensor
+        :return: Candidate document indices
+        :rtype: torch.Tensor
+        """
+        n_cells = min(self.search_config.n_cells, centroid_scores.shape[1])
+        centroid_idcs = torch.unique(torch.topk(centroid_scores, n_cells, dim=1).indices)
+        starts = self.ivf_indptr[centroid_idcs]
+        lengths = self.ivf_indptr[centroid_idcs + 1] - starts
+        return torch.unique(self.ivf_doc_idcs[segment_arange(starts, lengths)].long())
+
+    def centroid_interaction(
+        self, centroid_scores: torch.Tensor, doc_idcs: torch.Tensor, threshold: float | None = None
+    ) -> torch.Tensor:
+        """Approximates late-interaction scores of documents by replacing their token embeddings with their centroid
+        bags. Centroids that score below the threshold for all query embeddings are pruned from the bags.
+
+        :param centroid_scores: Scores between query embeddings and centroids of shape [query_length x num_centroids]
+        :type centroid_scores: torch.Tensor
+        :param doc_idcs: Document indices to score
+        :type doc_idcs: torch.Tensor
+        :param threshold: Centroid pruning threshold, defaults to None
+        :type threshold: float | None, optional
+        :return: Approximate scores of the documents
+        :rtype: torch.Tensor
+        """
+        starts = self.bag_indptr[doc_idcs]
+        lengths = self.bag_indptr[doc_idcs + 1] - starts
+        bag_idcs = segment_arange(starts, lengths)
+        bag_doc_positions = torch.arange(doc_idcs.shape[0], device=doc_idcs.device).repeat_interleave(lengths)
+        bag_centroid_idcs = self.bag_centroid_idcs[bag_idcs].long()
+        if threshold is not None:
+            keep = centroid_scores.max(dim=0).values[bag_centroid_idcs] >= threshold
+            bag_doc_positions, bag_centroid_idcs = bag_doc_positions[keep], bag_centroid_idcs[keep]
+        bag_scores = centroid_scores[:, bag_centroid_idcs].T
+        # max over the centroid bag of each document, documents without centroids score 0
+        scores = torch.zeros(doc_idcs.shape[0], centroid_scores.shape[0], device=bag_scores.device)
+        scores = scores.index_reduce_(0, bag_doc_positions, bag_scores, "amax", include_self=False)
+        return self.module.scoring_function._aggregate(
+            scores, None, self.module.config.query_aggregation_function, dim=1
+        ).view(-1)
+
+    def _prune(self, scores: torch.Tensor, doc_idcs: torch.Tensor, num_candidates: int) -> torch.Tensor:
+        if doc_idcs.shape[0] <= num_candidates:
+            return doc_idcs
+        return doc_idcs[torch.topk(scores, num_candidates).indices]
+
+    def _search(self, query_embeddings: BiEncoderEmbedding) -> Tuple[torch.Tensor, torch.Tensor, List[int]]:
+        query_embeddings = query_embeddings.to(self.device)
+        centroids = self.embedding_store.codec.centroids.to(self.device)
+        candidate_k = self.search_config.candidate_k
+        doc_idcs = []
+        num_docs = []
+        for embeddings, scoring_mask in zip(query_embeddings.embeddings, query_embeddings.scoring_mask):
+            centroid_scores = embeddings[scoring_mask] @ centroids.T
+            candidate_doc_idcs = self.candidate_generation(centroid_scores)
+            # stage 1: centroid interaction with centroid pruning
+            scores = self.centroid_interaction(
+                centroid_scores, candidate_doc_idcs, self.search_config.centroid_score_threshold
+            )
+            candidate_doc_idcs = self._prune(scores, candidate_doc_idcs, candidate_k)
+            # stage 2: centroid interaction without centroid pruning
+            scores = self.centroid_interaction(centroid_scores, candidate_doc_idcs)
+            candidate_doc_idcs = self._prune(scores, candidate_doc_idcs, max(self.search_config.k, candidate_k // 4))
+            doc_idcs.append(candidate_doc_idcs)
+            num_docs.append(candidate_doc_idcs.shape[0])
+
+        # stage 3: exact late-interaction scoring with decompressed residuals
+        doc_idcs = torch.cat(doc_idcs)
+        doc_embeddings = self._gather_doc_embeddings(doc_idcs, self.embedding_store.lookup)
+        doc_scores = self.module.model.score(query_embeddings, doc_embeddings, num_docs)
+        return doc_scores, doc_idcs, num_docs
+
+
+class PLAIDSearchConfig(SearchConfig):
+    search_class = PLAIDSearcher
+
+    def __init__(
+        self, k: int = 10, candidate_k: int = 256, n_cells: int = 1, centroid_score_threshold: float = 0.5
+    ) -> None:
+        super().__init__(k)
+        self.candidate_k = candidate_k
+        self.n_cells = n_cells
+        self.centroid_score_threshold = centroid_score_threshold
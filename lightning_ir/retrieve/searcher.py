@@ -2,8 +2,9 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import TYPE_CHECKING, List, Sequence, Tuple, Type
+from typing import TYPE_CHECKING, Callable, List, Sequence, Tuple, Type
 
+import numpy as np
 import torch
 
 from ..bi_encoder.model import BiEncoderEmbedding
@@ -12,6 +13,86 @@ if TYPE_CHECKING:
     from ..bi_encoder import BiEncoderModule, BiEncoderOutput
 
 
+def segment_arange(starts: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+    """Concatenates the ranges ``[start, start + length)`` for all segments without iterating over the segments.
+
+    :param starts: Start index of each segment
+    :type starts: torch.Tensor
+    :param lengths: Length of each segment
+    :type lengths: torch.Tensor
+    :return: Concatenated indices of all segments
+    :rtype: torch.Tensor
+    """
+    offsets = torch.cumsum(lengths, dim=0) - lengths
+    idcs = torch.arange(int(lengths.sum().item()), device=lengths.device)
+    return idcs + (starts - offsets).repeat_interleave(lengths)
+
+
+def segment_ranks(values: torch.Tensor, segment_idcs: torch.Tensor) -> torch.Tensor:
+    """Ranks values in descending order within their segments without iterating over the segments.
+
+    :param values: Values to rank
+    :type values: torch.Tensor
+    :param segment_idcs: Segment index of each value
+    :type segment_idcs: torch.Tensor
+    :return: Zero-based rank of each value within its segment
+    :rtype: torch.Tensor
+    """
+    order = torch.argsort(values, descending=True, stable=True)
+    order = order[torch.argsort(segment_idcs[order], stable=True)]
+    segment_lengths = torch.bincount(segment_idcs)
+    offsets = torch.cumsum(segment_lengths, dim=0) - segment_lengths
+    ranks = torch.empty_like(order)
+    ranks[order] = torch.arange(order.shape[0], device=order.device) - offsets[segment_idcs[order]]
+    return ranks
+
+
+def segment_searchsorted(
+    sorted_sequence: torch.Tensor, starts: torch.Tensor, ends: torch.Tensor, values: torch.Tensor
+) -> torch.Tensor:
+    """Finds the insertion position of each value in its sorted segment ``sorted_sequence[start:end]``, i.e.,
+    ``torch.searchsorted(sorted_sequence[start:end], value) + start``, by binary searching all segments at once
+    instead of iterating over the segments.
+
+    :param sorted_sequence: Sequence whose segments are sorted in ascending order
+    :type sorted_sequence: torch.Tensor
+    :param starts: Start index of the segment of each value
+    :type starts: torch.Tensor
+    :param ends: End index (exclusive) of the segment of each value
+    :type ends: torch.Tensor
+    :param values: Values to search
+    :type values: torch.Tensor
+    :return: Position of the first element in the segment that is not smaller than the value
+    :rtype: torch.Tensor
+    """
+    lows, highs = starts.clone(), ends.clone()
+    if not lows.numel():
+        return lows
+    for _ in range(int((highs - lows).max().item()).bit_length()):
+        active = lows < highs
+        mids = (lows + highs) // 2
+        go_right = active & (sorted_sequence[mids.clamp(max=sorted_sequence.shape[0] - 1)] < values)
+        highs = torch.where(active & ~go_right, mids, highs)
+        lows = torch.where(go_right, mids + 1, lows)
+    return lows
+
+
+def load_doc_ids(index_dir: Path) -> np.ndarray:
+    """Loads the ids of the documents of an index in the order in which they were indexed.
+
+    :param index_dir: Directory of the index
+    :type index_dir: Path
+    :return: Document ids as utf-8 encoded bytes
+    :rtype: np.ndarray
+    """
+    doc_ids_path = index_dir / "doc_ids.npy"
+    if doc_ids_path.exists():
+        return np.load(doc_ids_path, mmap_mode="r")
+    # indexes created with older versions store doc_ids as plain text
+    doc_ids = (index_dir / "doc_ids.txt").read_text().split()
+    return np.array([doc_id.encode("utf-8") for doc_id in doc_ids], dtype=np.bytes_)
+
+
 class Searcher(ABC):
     def __init__(
         self, index_dir: Path | str, search_config: SearchConfig, module: BiEncoderModule, use_gpu: bool = True
@@ -22,20 +103,72 @@ class Searcher(ABC):
         self.module = module
         self.device = torch.device("cuda") if use_gpu and torch.cuda.is_available() else torch.device("cpu")
 
-        self.doc_ids = (self.index_dir / "doc_ids.txt").read_text().split()
-        self.doc_lengths = torch.load(self.index_dir / "doc_lengths.pt")
+        self.doc_ids = self._load_doc_ids()
+        self.doc_lengths = torch.load(self.index_dir / "doc_lengths.pt", mmap=True, weights_only=True)
 
         self.to_gpu()
 
-        self.num_docs = len(self.doc_ids)
+        self.num_docs = self.doc_ids.shape[0]
         self.cumulative_doc_lengths = torch.cumsum(self.doc_lengths, dim=0)
 
         if self.doc_lengths.shape[0] != self.num_docs or self.doc_lengths.sum() != self.num_embeddings:
             raise ValueError("doc_lengths do not match index")
 
+    def _load_doc_ids(self) -> np.ndarray:
+        return load_doc_ids(self.index_dir)
+
     def to_gpu(self) -> None:
         self.doc_lengths = self.doc_lengths.to(self.device)
 
+    def _gather_doc_embeddings(
+        self, doc_idcs: torch.Tensor, lookup: Callable[[torch.Tensor], torch.Tensor]
+    ) -> BiEncoderEmbedding:
+        """Gathers the padded token embeddings of the given documents. Embeddings of each unique document are only
+        looked up once.
+
+        :param doc_idcs: Document indices
+        :type doc_idcs: torch.Tensor
+        :param lookup: Function returning the embeddings for a tensor of embedding indices
+        :type lookup: Callable[[torch.Tensor], torch.Tensor]
+        :return: Embeddings and scoring mask of the documents
+        :rtype: BiEncoderEmbedding
+        """
+        unique_doc_idcs, inverse_idcs = torch.unique(doc_idcs, return_inverse=True)
+        doc_lengths = self.doc_lengths[unique_doc_idcs.to(self.doc_lengths.device)]
+        start_doc_idcs = self.cumulative_doc_lengths[unique_doc_idcs.to(self.doc_lengths.device)] - doc_lengths
+        all_doc_embeddings = lookup(segment_arange(start_doc_idcs, doc_lengths)).to(inverse_idcs.device)
+
+        # pad the embeddings of each unique doc
+        doc_lengths = doc_lengths.to(inverse_idcs.device)
+        max_doc_length = int(doc_lengths.max().item()) if doc_lengths.numel() else 0
+        unique_embeddings = torch.zeros(
+            unique_doc_idcs.shape[0],
+            max_doc_length,
+            all_doc_embeddings.shape[-1],
+            dtype=all_doc_embeddings.dtype,
+            device=inverse_idcs.device,
+        )
+        unique_doc_positions = torch.arange(unique_doc_idcs.shape[0], device=inverse_idcs.device)
+        token_positions = segment_arange(torch.zeros_like(doc_lengths), doc_lengths)
+        unique_embeddings[unique_doc_positions.repeat_interleave(doc_lengths), token_positions] = all_doc_embeddings
+        embeddings = unique_embeddings[inverse_idcs]
+
+        # mask out padding
+        doc_lengths = doc_lengths[inverse_idcs]
+        scoring_mask = torch.arange(embeddings.shape[1], device=embeddings.device) < doc_lengths[:, None]
+        return BiEncoderEmbedding(embeddings=embeddings, scoring_mask=scoring_mask)
+
+    def _gather_doc_ids(self, doc_idcs: torch.Tensor) -> List[str]:
+        """Resolves document indices to document ids with a single batched lookup.
+
+        :param doc_idcs: Document indices
+        :type doc_idcs: torch.Tensor
+        :return: Document ids
+        :rtype: List[str]
+        """
+        doc_ids = self.doc_ids[doc_idcs.cpu().numpy()]
+        return np.char.decode(doc_ids, "utf-8").tolist()
+
     @property
     @abstractmethod
     def num_embeddings(self) -> int: ...
@@ -45,6 +178,46 @@ class Searcher(ABC):
         self, query_embeddings: BiEncoderEmbedding
     ) -> Tuple[torch.Tensor, torch.Tensor | None, List[int] | None]: ...
 
+    def _top_k(
+        self, doc_scores: torch.Tensor, doc_idcs: torch.Tensor, num_docs: Sequence[int]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Selects the top-k documents per query and pads them to a [num_queries x k] matrix. Padded entries have a
+        score of -inf and a document index of -1."""
+        num_docs_t = torch.tensor(num_docs, device=doc_scores.device)
+        max_num_docs = max(num_docs, default=0)
+        query_idcs = torch.arange(num_docs_t.shape[0], device=doc_scores.device).repeat_interleave(num_docs_t)
+        positions = segment_arange(torch.zeros_like(num_docs_t), num_docs_t)
+        scores = torch.full(
+            (num_docs_t.shape[0], max_num_docs), float("-inf"), device=doc_scores.device, dtype=doc_scores.dtype
+        )
+        scores[query_idcs, positions] = doc_scores
+        idcs = torch.full_like(scores, -1, dtype=torch.long)
+        idcs[query_idcs, positions] = doc_idcs.to(idcs)
+        scores, top_idcs = torch.topk(scores, min(self.search_config.k, max_num_docs))
+        return scores, torch.gather(idcs, 1, top_idcs)
+
+    def _merge_top_k(
+        self, scores: torch.Tensor, idcs: torch.Tensor, other_scores: torch.Tensor, other_idcs: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Merges two padded [num_queries x k] top-k matrices as returned by :meth:`_top_k` into a single top-k
+        matrix.
+
+        :param scores: Scores of the first top-k matrix
+        :type scores: torch.Tensor
+        :param idcs: Document indices of the first top-k matrix
+        :type idcs: torch.Tensor
+        :param other_scores: Scores of the second top-k matrix
+        :type other_scores: torch.Tensor
+        :param other_idcs: Document indices of the second top-k matrix
+        :type other_idcs: torch.Tensor
+        :return: Merged scores and document indices
+        :rtype: Tuple[torch.Tensor, torch.Tensor]
+        """
+        scores = torch.cat([scores, other_scores], dim=1)
+        idcs = torch.cat([idcs, other_idcs], dim=1)
+        scores, merged_idcs = torch.topk(scores, min(self.search_config.k, scores.shape[1]))
+        return scores, torch.gather(idcs, 1, merged_idcs)
+
     def _filter_and_sort(
         self,
         doc_scores: torch.Tensor,
@@ -55,28 +228,19 @@ class Searcher(ABC):
             raise ValueError("doc_ids and num_docs must be both None or not None")
         if doc_idcs is None and num_docs is None:
             # assume we have searched the whole index
-            k = min(self.search_config.k, doc_scores.shape[0])
+            k = min(self.search_config.k, self.num_docs)
             values, idcs = torch.topk(doc_scores.view(-1, self.num_docs), k)
             num_queries = values.shape[0]
             values = values.view(-1)
             idcs = idcs.view(-1)
-            doc_ids = [self.doc_ids[doc_idx] for doc_idx in idcs.cpu()]
+            doc_ids = self._gather_doc_ids(idcs)
             return values, doc_ids, [k] * num_queries
 
         assert doc_idcs is not None and num_docs is not None
-        per_query_doc_scores = torch.split(doc_scores, num_docs)
-        per_query_doc_idcs = torch.split(doc_idcs, num_docs)
-        new_num_docs = []
-        _doc_scores = []
-        doc_ids = []
-        for query_idx, scores in enumerate(per_query_doc_scores):
-            k = min(self.search_config.k, scores.shape[0])
-            values, idcs = torch.topk(scores, k)
-            _doc_scores.append(values)
-            doc_ids.extend([self.doc_ids[doc_idx] for doc_idx in per_query_doc_idcs[query_idx][idcs].cpu()])
-            new_num_docs.append(k)
-        doc_scores = torch.cat(_doc_scores)
-        return doc_scores, doc_ids, new_num_docs
+        values, idcs = self._top_k(doc_scores, doc_idcs, num_docs)
+        mask = idcs != -1
+        doc_ids = self._gather_doc_ids(idcs[mask])
+        return values[mask], doc_ids, mask.sum(-1).tolist()
 
     def search(self, output: BiEncoderOutput) -> Tuple[torch.Tensor, List[str], List[int]]:
         query_embeddings = output.query_embeddings
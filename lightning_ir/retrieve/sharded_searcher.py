@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple
+
+import torch
+
+from .searcher import SearchConfig, Searcher
+
+if TYPE_CHECKING:
+    from ..bi_encoder import BiEncoderModule, BiEncoderOutput
+
+SHARDS_FILE_NAME = "shards.json"
+
+
+class ShardedSearcher:
+    def __init__(
+        self, index_dir: Path | str, search_config: SearchConfig, module: BiEncoderModule, use_gpu: bool = True
+    ) -> None:
+        """Searcher for indexes that were written as one shard per device. Every shard is searched with the searcher
+        of the search config and the top-k documents of all shards are merged per query.
+
+        :param index_dir: Directory of the sharded index containing the shard list
+        :type index_dir: Path | str
+        :param search_config: Configuration of the searchers of the shards
+        :type search_config: SearchConfig
+        :param module: Bi-encoder module used for searching
+        :type module: BiEncoderModule
+        :param use_gpu: Whether to search on the gpu, defaults to True
+        :type use_gpu: bool, optional
+        """
+        self.index_dir = Path(index_dir)
+        self.search_config = search_config
+        self.module = module
+        self.shards: List[Searcher] = [
+            search_config.search_class(shard_dir, search_config, module, use_gpu)
+            for shard_dir in self.shard_dirs(self.index_dir)
+        ]
+        self.num_docs = sum(shard.num_docs for shard in self.shards)
+        # documents of all shards are numbered consecutively in shard order
+        shard_num_docs = torch.tensor([shard.num_docs for shard in self.shards])
+        self.doc_offsets = torch.cumsum(shard_num_docs, dim=0) - shard_num_docs
+
+    @staticmethod
+    def is_sharded(index_dir: Path | str) -> bool:
+        """Checks whether an index directory contains a sharded index.
+
+        :param index_dir: Directory of the index
+        :type index_dir: Path | str
+        :return: Whether the index is sharded
+        :rtype: bool
+        """
+        return (Path(index_dir) / SHARDS_FILE_NAME).exists()
+
+    @staticmethod
+    def shard_dirs(index_dir: Path | str) -> List[Path]:
+        """Directories of the shards of a sharded index in shard order.
+
+        :param index_dir: Directory of the sharded index
+        :type index_dir: Path | str
+        :raises ValueError: If the index does not list any shards
+        :return: Directories of the shards
+        :rtype: List[Path]
+        """
+        index_dir = Path(index_dir)
+        shard_dirs = json.loads((index_dir / SHARDS_FILE_NAME).read_text())["shards"]
+        if not shard_dirs:
+            raise ValueError(f"No shards found in {index_dir / SHARDS_FILE_NAME}")
+        return [index_dir / shard_dir for shard_dir in shard_dirs]
+
+    @property
+    def num_embeddings(self) -> int:
+        return sum(shard.num_embeddings for shard in self.shards)
+
+    def search(self, output: BiEncoderOutput) -> Tuple[torch.Tensor, List[str], List[int]]:
+        query_embeddings = output.query_embeddings
+        if query_embeddings is None:
+            raise ValueError("Expected query_embeddings in BiEncoderOutput")
+        # merge the top-k documents of each shard with the running top-k documents
+        device = self.shards[0].device
+        top_scores = top_idcs = None
+        for shard, doc_offset in zip(self.shards, self.doc_offsets.tolist()):
+            scores, idcs = shard._top_k(*shard._search(query_embeddings))
+            scores, idcs = scores.to(device), idcs.to(device)
+            idcs = torch.where(idcs == -1, -1, idcs + doc_offset)
+            if top_scores is not None and top_idcs is not None:
+                scores, idcs = shard._merge_top_k(top_scores, top_idcs, scores, idcs)
+            top_scores, top_idcs = scores, idcs
+        assert top_scores is not None and top_idcs is not None
+        mask = top_idcs != -1
+        return top_scores[mask], self._gather_doc_ids(top_idcs[mask]), mask.sum(-1).tolist()
+
+    def _gather_doc_ids(self, doc_idcs: torch.Tensor) -> List[str]:
+        """Resolves document indices across all shards to document ids with one batched lookup per shard.
+
+        :param doc_idcs: Document indices across all shards
+        :type doc_idcs: torch.Tensor
+        :return: Document ids
+        :rtype: List[str]
+        """
+        doc_idcs = doc_idcs.cpu()
+        shard_idcs = torch.searchsorted(self.doc_offsets, doc_idcs, side="right") - 1
+        doc_ids: List[str] = [""] * doc_idcs.shape[0]
+        for shard_idx, (shard, doc_offset) in enumerate(zip(self.shards, self.doc_offsets.tolist())):
+            positions = torch.nonzero(shard_idcs == shard_idx).view(-1)
+            for position, doc_id in zip(positions.tolist(), shard._gather_doc_ids(doc_idcs[positions] - doc_offset)):
+                doc_ids[position] = doc_id
+        return doc_ids
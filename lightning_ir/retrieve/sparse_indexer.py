@@ -7,6 +7,9 @@ from ..bi_encoder import BiEncoderConfig, BiEncoderOutput
 from ..data import IndexBatch
 from .indexer import IndexConfig, Indexer
 
+# bumped whenever the layout of the saved postings changes so that searchers can detect incompatible indexes
+SPARSE_INDEX_VERSION = 1
+
 
 class SparseIndexer(Indexer):
     def __init__(
@@ -29,11 +32,13 @@ class SparseIndexer(Indexer):
 
         doc_lengths = doc_embeddings.scoring_mask.sum(dim=1)
         embeddings = doc_embeddings.embeddings[doc_embeddings.scoring_mask]
+        if self.bi_encoder_config.similarity_function == "cosine":
+            embeddings = torch.nn.functional.normalize(embeddings, dim=-1)
         num_docs = len(index_batch.doc_ids)
         self.doc_ids.extend(index_batch.doc_ids)
 
         token_idcs, dim_idcs = torch.nonzero(embeddings, as_tuple=True)
-        crow_indices = token_idcs.bincount().cumsum(0) + self.crow_indices[-1]
+        crow_indices = token_idcs.bincount(minlength=embeddings.shape[0]).cumsum(0) + self.crow_indices[-1]
         values = embeddings[token_idcs, dim_idcs]
         self.crow_indices.extend(crow_indices.cpu().tolist())
         self.col_indices.extend(dim_idcs.cpu().tolist())
@@ -51,14 +56,51 @@ class SparseIndexer(Indexer):
 
     def save(self) -> None:
         super().save()
+        # the index is stored as an inverted index, i.e., in compressed sparse column format with one posting list
+        # per vocabulary dimension, so that searchers only touch the postings of the non-zero query terms
         index = torch.sparse_csr_tensor(
             torch.frombuffer(self.crow_indices, dtype=torch.int64),
             torch.frombuffer(self.col_indices, dtype=torch.int64),
             torch.frombuffer(self.values, dtype=torch.float32),
             torch.Size([self.num_embeddings, self.bi_encoder_config.embedding_dim]),
+        ).to_sparse_csc()
+        ccol_indices = index.ccol_indices()
+        row_indices = index.row_indices()
+        values = index.values()
+
+        # per-term and per-block max impacts are used by searchers for safe dynamic pruning. each posting list is
+        # split into blocks of block_size consecutive postings
+        block_size = self.index_config.block_size
+        posting_lengths = ccol_indices.diff()
+        cblock_indices = torch.nn.functional.pad(((posting_lengths + block_size - 1) // block_size).cumsum(0), (1, 0))
+        term_idcs = torch.arange(posting_lengths.shape[0]).repeat_interleave(posting_lengths)
+        posting_positions = torch.arange(values.shape[0]) - ccol_indices[term_idcs]
+        block_idcs = cblock_indices[term_idcs] + posting_positions // block_size
+        num_blocks = int(cblock_indices[-1].item())
+        max_impacts = torch.zeros(posting_lengths.shape[0]).scatter_reduce(
+            0, term_idcs, values, "amax", include_self=False
         )
-        torch.save(index, self.index_dir / "index.pt")
+        block_max_impacts = torch.zeros(num_blocks).scatter_reduce(0, block_idcs, values, "amax", include_self=False)
+
+        # the postings are saved as plain tensors so that searchers can memory-map them instead of loading the full
+        # index into memory
+        postings = {
+            "version": SPARSE_INDEX_VERSION,
+            "ccol_indices": ccol_indices,
+            "row_indices": row_indices,
+            "values": values,
+            "num_embeddings": self.num_embeddings,
+            "max_impacts": max_impacts,
+            "cblock_indices": cblock_indices,
+            "block_max_impacts": block_max_impacts,
+            "non_negative": bool(values.numel() == 0 or values.min().item() >= 0),
+        }
+        torch.save(postings, self.index_dir / "index.pt")
 
 
 class SparseIndexConfig(IndexConfig):
     indexer_class = SparseIndexer
+
+    def __init__(self, block_size: int = 128) -> None:
+        super().__init__()
+        self.block_size = block_size
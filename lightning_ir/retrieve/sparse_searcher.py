@@ -1,12 +1,13 @@
 from __future__ import annotations
 
+import pickle
 from pathlib import Path
-from typing import TYPE_CHECKING, Literal, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Tuple
 
 import torch
 
-from .searcher import SearchConfig, Searcher
-from .sparse_indexer import SparseIndexConfig
+from .searcher import SearchConfig, Searcher, segment_arange, segment_ranks, segment_searchsorted
+from .sparse_indexer import SPARSE_INDEX_VERSION, SparseIndexConfig
 
 if TYPE_CHECKING:
     from ..bi_encoder import BiEncoderEmbedding, BiEncoderModule
@@ -14,35 +15,281 @@ if TYPE_CHECKING:
 
 class SparseIndex:
     def __init__(self, index_dir: Path, similarity_function: Literal["dot", "cosine"], use_gpu: bool = False) -> None:
-        self.index = torch.load(index_dir / "index.pt")
+        postings = self._load_postings(index_dir)
+        self.ccol_indices: torch.Tensor = postings["ccol_indices"]
+        self.row_indices: torch.Tensor = postings["row_indices"]
+        self.values: torch.Tensor = postings["values"]
+        self._num_embeddings: int = postings["num_embeddings"]
+        self.max_impacts: torch.Tensor = postings["max_impacts"]
+        self.cblock_indices: torch.Tensor = postings["cblock_indices"]
+        self.block_max_impacts: torch.Tensor = postings["block_max_impacts"]
+        self.non_negative: bool = postings["non_negative"]
         self.config = SparseIndexConfig.from_pretrained(index_dir)
-        if similarity_function == "dot":
-            self.similarity_function = self.dot_similarity
-        elif similarity_function == "cosine":
-            self.similarity_function = self.cosine_similarity
-        else:
+        if similarity_function not in ("dot", "cosine"):
             raise ValueError("Unknown similarity function")
+        self.similarity_function = similarity_function
         self.device = torch.device("cuda") if use_gpu and torch.cuda.is_available() else torch.device("cpu")
 
-    def score(self, embeddings: torch.Tensor) -> torch.Tensor:
+    @staticmethod
+    def _load_postings(index_dir: Path) -> Dict[str, Any]:
+        """Loads the postings of a sparse index. Indexes created by older versions of Lightning IR (a sparse CSR
+        tensor or separate crow_indices/col_indices/values files, or postings without block max impacts) cannot be
+        searched and need to be re-indexed.
+
+        :param index_dir: Directory of the index
+        :type index_dir: Path
+        :raises ValueError: If the index does not exist or was created with an incompatible version
+        :return: Postings of the index
+        :rtype: Dict[str, Any]
+        """
+        index_path = index_dir / "index.pt"
+        message = (
+            f"The sparse index in {index_dir} was created with an incompatible version of Lightning IR (expected "
+            f"index version {SPARSE_INDEX_VERSION}). Re-index the documents with the current version."
+        )
+        if not index_path.exists():
+            if (index_dir / "crow_indices.pt").exists():
+                raise ValueError(message)
+            raise ValueError(f"No sparse index found in {index_dir}")
+        try:
+            postings = torch.load(index_path, mmap=True, weights_only=True)
+        except (pickle.UnpicklingError, RuntimeError) as e:
+            raise ValueError(message) from e
+        if not isinstance(postings, dict) or postings.get("version") != SPARSE_INDEX_VERSION:
+            raise ValueError(message)
+        return postings
+
+    def _posting_ranges(
+        self, term_idcs: torch.Tensor, start_idx: int = 0, end_idx: int | None = None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Computes the start and end positions of the postings of the given terms, restricted to the document
+        embeddings in ``[start_idx, end_idx)``. Postings are sorted by document embedding index, so the restricted
+        ranges of all terms are found by binary search.
+
+        :param term_idcs: Term indices
+        :type term_idcs: torch.Tensor
+        :param start_idx: First document embedding index, defaults to 0
+        :type start_idx: int, optional
+        :param end_idx: End document embedding index (exclusive), defaults to None
+        :type end_idx: int | None, optional
+        :return: Start and end positions of the postings
+        :rtype: Tuple[torch.Tensor, torch.Tensor]
+        """
+        starts = self.ccol_indices[term_idcs]
+        ends = self.ccol_indices[term_idcs + 1]
+        if start_idx == 0 and (end_idx is None or end_idx >= self.num_embeddings):
+            return starts, ends
+        end_idx = self.num_embeddings if end_idx is None else end_idx
+        unique_term_idcs, inverse_idcs = torch.unique(term_idcs, return_inverse=True)
+        num_terms = unique_term_idcs.shape[0]
+        bounds = torch.tensor([start_idx, end_idx], device=self.device).repeat_interleave(num_terms)
+        positions = segment_searchsorted(
+            self.row_indices,
+            self.ccol_indices[unique_term_idcs].repeat(2),
+            self.ccol_indices[unique_term_idcs + 1].repeat(2),
+            bounds,
+        ).view(2, num_terms)
+        return positions[0][inverse_idcs], positions[1][inverse_idcs]
+
+    def score(
+        self, embeddings: torch.Tensor, start_idx: int = 0, end_idx: int | None = None
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Scores query embeddings against the index term-at-a-time. Only the postings of the non-zero query terms
+        are touched and scores are only accumulated for the document embeddings that occur in these postings.
+
+        :param embeddings: Query embeddings of shape [num_query_embeddings x embedding_dim]
+        :type embeddings: torch.Tensor
+        :param start_idx: Only score document embeddings starting from this index, defaults to 0
+        :type start_idx: int, optional
+        :param end_idx: Only score document embeddings up to this index (exclusive), defaults to None
+        :type end_idx: int | None, optional
+        :return: Scores, query embedding indices, and document embedding indices of all accumulated pairs
+        :rtype: Tuple[torch.Tensor, torch.Tensor, torch.Tensor]
+        """
         embeddings = embeddings.to(self.device)
-        similarity = self.similarity_function(embeddings, self.index).to_dense()
-        return similarity
+        if self.similarity_function == "cosine":
+            # document embeddings are normalized at indexing time
+            embeddings = torch.nn.functional.normalize(embeddings, dim=-1)
+        query_idcs, term_idcs = torch.nonzero(embeddings, as_tuple=True)
+        weights = embeddings[query_idcs, term_idcs]
 
-    @property
-    def num_embeddings(self) -> int:
-        return self.index.shape[0]
+        # gather the postings of all non-zero query terms
+        starts, ends = self._posting_ranges(term_idcs, start_idx, end_idx)
+        lengths = ends - starts
+        posting_idcs = segment_arange(starts, lengths)
+        doc_embedding_idcs = self.row_indices[posting_idcs]
+        impacts = self.values[posting_idcs] * weights.repeat_interleave(lengths)
+        query_idcs = query_idcs.repeat_interleave(lengths)
+
+        # accumulate impacts per query embedding and document embedding pair
+        pair_idcs = query_idcs * self.num_embeddings + doc_embedding_idcs
+        unique_pair_idcs, inverse_idcs = torch.unique(pair_idcs, return_inverse=True)
+        scores = torch.zeros(unique_pair_idcs.shape[0], device=impacts.device, dtype=impacts.dtype)
+        scores = scores.index_add_(0, inverse_idcs, impacts)
+        return scores, unique_pair_idcs // self.num_embeddings, unique_pair_idcs % self.num_embeddings
+
+    def score_pruned(
+        self, embeddings: torch.Tensor, k: int, start_idx: int = 0, end_idx: int | None = None
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Scores single-vector query embeddings against a single-vector index with safe dynamic pruning (block-max
+        MaxScore). Documents that provably cannot enter the top-k of a query are skipped. All queries are processed
+        at once. Requires non-negative impacts and query weights.
+
+        :param embeddings: Query embeddings of shape [num_queries x embedding_dim]
+        :type embeddings: torch.Tensor
+        :param k: Number of documents to retrieve
+        :type k: int
+        :param start_idx: Only score documents starting from this index, defaults to 0
+        :type start_idx: int, optional
+        :param end_idx: Only score documents up to this index (exclusive), defaults to None
+        :type end_idx: int | None, optional
+        :return: Scores and document indices of the candidate documents, containing at least the top-k documents of
+            each query, and number of candidate documents per query
+        :rtype: Tuple[torch.Tensor, torch.Tensor, torch.Tensor]
+        """
+        embeddings = embeddings.to(self.device)
+        if self.similarity_function == "cosine":
+            embeddings = torch.nn.functional.normalize(embeddings, dim=-1)
+        num_queries = embeddings.shape[0]
+        query_idcs, term_idcs = torch.nonzero(embeddings, as_tuple=True)
+        weights = embeddings[query_idcs, term_idcs]
+        upper_bounds = weights * self.max_impacts[term_idcs]
+        range_starts, range_ends = self._posting_ranges(term_idcs, start_idx, end_idx)
+        num_terms = torch.bincount(query_idcs, minlength=num_queries)
+
+        # restrict the blocks of all query terms to the document range
+        block_size = self.config.block_size
+        first_block_idcs = self.cblock_indices[term_idcs]
+        num_blocks = self.cblock_indices[term_idcs + 1] - first_block_idcs
+        block_idcs = segment_arange(first_block_idcs, num_blocks)
+        block_term_idcs = torch.arange(term_idcs.shape[0], device=self.device).repeat_interleave(num_blocks)
+        posting_starts = (
+            self.ccol_indices[term_idcs][block_term_idcs]
+            + (block_idcs - first_block_idcs[block_term_idcs]) * block_size
+        )
+        posting_ends = torch.minimum(posting_starts + block_size, range_ends[block_term_idcs])
+        posting_starts = torch.maximum(posting_starts, range_starts[block_term_idcs])
+        posting_lengths = (posting_ends - posting_starts).clamp(min=0)
+        block_max_impacts = self.block_max_impacts[block_idcs] * weights[block_term_idcs]
+
+        # lower bound for the k-th highest score of each query from the highest impact documents of each term. impacts
+        # are non-negative, so the score of a document is at least the impact of any of its postings. the top
+        # postings of a term are found in its blocks with the highest max impacts
+        num_seed_blocks = -(-k // block_size)
+        seed = (segment_ranks(block_max_impacts, block_term_idcs) < num_seed_blocks) & (posting_lengths > 0)
+        seed_term_idcs = block_term_idcs[seed].repeat_interleave(posting_lengths[seed])
+        seed_posting_idcs = segment_arange(posting_starts[seed], posting_lengths[seed])
+        seed_pair_idcs, inverse_idcs = torch.unique(
+            query_idcs[seed_term_idcs] * self.num_embeddings + self.row_indices[seed_posting_idcs], return_inverse=True
+        )
+        seed_scores = torch.zeros(seed_pair_idcs.shape[0], device=self.device, dtype=self.values.dtype)
+        seed_scores = seed_scores.scatter_reduce_(
+            0, inverse_idcs, self.values[seed_posting_idcs] * weights[seed_term_idcs], "amax", include_self=False
+        )
+        threshold = self._kth_highest(seed_scores, seed_pair_idcs // self.num_embeddings, num_queries, k)
+
+        # split terms into non-essential terms, whose upper bounds together cannot reach the threshold, and
+        # essential terms. only documents occurring in the postings of essential terms can enter the top-k
+        positions = segment_ranks(-upper_bounds, query_idcs)
+        cumulative_upper_bounds = torch.zeros(
+            num_queries, int(num_terms.max().item()) if num_queries else 0, device=self.device, dtype=weights.dtype
+        )
+        cumulative_upper_bounds[query_idcs, positions] = upper_bounds
+        cumulative_upper_bounds = cumulative_upper_bounds.cumsum(dim=1)[query_idcs, positions]
+        is_essential = cumulative_upper_bounds >= threshold[query_idcs]
+
+        # skip blocks of essential terms whose max impact together with the upper bounds of all other terms cannot
+        # reach the threshold
+        total_upper_bounds = torch.zeros(num_queries, device=self.device, dtype=weights.dtype)
+        total_upper_bounds = total_upper_bounds.index_add_(0, query_idcs, upper_bounds)
+        other_upper_bounds = total_upper_bounds[query_idcs] - upper_bounds
+        block_query_idcs = query_idcs[block_term_idcs]
+        keep = (
+            is_essential[block_term_idcs]
+            & (posting_lengths > 0)
+            & (block_max_impacts + other_upper_bounds[block_term_idcs] >= threshold[block_query_idcs])
+        )
 
-    def cosine_similarity(self, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
-        dot_product = self.dot_similarity(x, y)
-        dot_product = dot_product / (torch.norm(x, dim=-1) * torch.norm(y, dim=-1))
-        return -1 * torch.cdist(x, y).squeeze(-2)
+        # accumulate the essential postings term-at-a-time
+        posting_lengths = posting_lengths[keep]
+        posting_idcs = segment_arange(posting_starts[keep], posting_lengths)
+        impacts = self.values[posting_idcs] * weights[block_term_idcs[keep]].repeat_interleave(posting_lengths)
+        pair_idcs = (
+            block_query_idcs[keep].repeat_interleave(posting_lengths) * self.num_embeddings
+            + self.row_indices[posting_idcs]
+        )
+        pair_idcs, inverse_idcs = torch.unique(pair_idcs, return_inverse=True)
+        scores = torch.zeros(pair_idcs.shape[0], device=self.device, dtype=impacts.dtype)
+        scores = scores.index_add_(0, inverse_idcs, impacts)
+        pair_query_idcs = pair_idcs // self.num_embeddings
+
+        # the essential scores are lower bounds of the full scores, so their k-th highest score tightens the
+        # threshold. skip candidates whose score together with the upper bounds of the non-essential terms cannot
+        # reach the threshold
+        threshold = torch.maximum(threshold, self._kth_highest(scores, pair_query_idcs, num_queries, k))
+        non_essential = ~is_essential
+        non_essential_upper_bounds = torch.zeros(num_queries, device=self.device, dtype=weights.dtype)
+        non_essential_upper_bounds = non_essential_upper_bounds.index_add_(
+            0, query_idcs[non_essential], upper_bounds[non_essential]
+        )
+        keep = scores + non_essential_upper_bounds[pair_query_idcs] >= threshold[pair_query_idcs]
+        scores, pair_idcs = scores[keep], pair_idcs[keep]
 
-    def dot_similarity(self, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
-        return torch.matmul(y, x.T).T
+        # add the non-essential impacts of the remaining candidates by joining the non-essential postings with the
+        # sorted candidates
+        posting_lengths = range_ends[non_essential] - range_starts[non_essential]
+        posting_idcs = segment_arange(range_starts[non_essential], posting_lengths)
+        posting_pair_idcs = (
+            query_idcs[non_essential].repeat_interleave(posting_lengths) * self.num_embeddings
+            + self.row_indices[posting_idcs]
+        )
+        positions = torch.searchsorted(pair_idcs, posting_pair_idcs)
+        in_candidates = positions < pair_idcs.shape[0]
+        found = torch.zeros_like(in_candidates)
+        found[in_candidates] = pair_idcs[positions[in_candidates]] == posting_pair_idcs[in_candidates]
+        impacts = self.values[posting_idcs[found]] * weights[non_essential].repeat_interleave(posting_lengths)[found]
+        scores = scores.index_add_(0, positions[found], impacts)
+        pair_query_idcs = pair_idcs // self.num_embeddings
+        num_docs = torch.bincount(pair_query_idcs, minlength=num_queries)
+        return scores, pair_idcs % self.num_embeddings, num_docs
+
+    def _kth_highest(self, scores: torch.Tensor, query_idcs: torch.Tensor, num_queries: int, k: int) -> torch.Tensor:
+        """Computes the k-th highest score of each query, or 0 if a query has fewer than k scores.
+
+        :param scores: Scores grouped by query
+        :type scores: torch.Tensor
+        :param query_idcs: Query index of each score
+        :type query_idcs: torch.Tensor
+        :param num_queries: Number of queries
+        :type num_queries: int
+        :param k: Rank of the score
+        :type k: int
+        :return: k-th highest score of each query
+        :rtype: torch.Tensor
+        """
+        num_scores = torch.bincount(query_idcs, minlength=num_queries)
+        max_num_scores = int(num_scores.max().item()) if num_queries else 0
+        if max_num_scores < k:
+            return torch.zeros(num_queries, device=self.device, dtype=scores.dtype)
+        positions = (
+            torch.arange(scores.shape[0], device=self.device) - (torch.cumsum(num_scores, 0) - num_scores)[query_idcs]
+        )
+        padded_scores = torch.full((num_queries, max_num_scores), float("-inf"), device=self.device, dtype=scores.dtype)
+        padded_scores[query_idcs, positions] = scores
+        kth_scores = torch.topk(padded_scores, k, dim=1).values[:, -1]
+        return torch.where(num_scores >= k, kth_scores, 0)
+
+    @property
+    def num_embeddings(self) -> int:
+        return self._num_embeddings
 
     def to_gpu(self) -> None:
-        self.index = self.index.to(self.device)
+        self.ccol_indices = self.ccol_indices.to(self.device)
+        self.row_indices = self.row_indices.to(self.device)
+        self.values = self.values.to(self.device)
+        self.max_impacts = self.max_impacts.to(self.device)
+        self.cblock_indices = self.cblock_indices.to(self.device)
+        self.block_max_impacts = self.block_max_impacts.to(self.device)
 
 
 class SparseSearcher(Searcher):
@@ -56,9 +303,6 @@ class SparseSearcher(Searcher):
         self.search_config: SparseSearchConfig
         self.index = SparseIndex(index_dir, module.config.similarity_function, use_gpu)
         super().__init__(index_dir, search_config, module, use_gpu)
-        self.doc_token_idcs = (
-            torch.arange(self.doc_lengths.shape[0]).to(self.doc_lengths).repeat_interleave(self.doc_lengths)
-        )
         self.use_gpu = use_gpu
         self.device = torch.device("cuda") if use_gpu and torch.cuda.is_available() else torch.device("cpu")
 
@@ -74,35 +318,110 @@ class SparseSearcher(Searcher):
     def num_embeddings(self) -> int:
         return self.index.num_embeddings
 
-    def _search(self, query_embeddings: BiEncoderEmbedding) -> Tuple[torch.Tensor, None, None]:
+    def _search(self, query_embeddings: BiEncoderEmbedding) -> Tuple[torch.Tensor, torch.Tensor, List[int]]:
+        if self.search_config.shard_size is None:
+            return self._search_shard(query_embeddings, 0, self.num_docs)
+        return self._search_sharded(query_embeddings)
+
+    def _search_sharded(self, query_embeddings: BiEncoderEmbedding) -> Tuple[torch.Tensor, torch.Tensor, List[int]]:
+        """Searches the index in shards of ``search_config.shard_size`` documents and merges the top-k documents of
+        each shard with the running top-k documents, so memory is bounded by the shard size and not the number of
+        documents in the index."""
+        shard_size = self.search_config.shard_size
+        assert shard_size is not None
+        top_scores = top_idcs = None
+        for doc_start_idx in range(0, self.num_docs, shard_size):
+            doc_end_idx = min(doc_start_idx + shard_size, self.num_docs)
+            scores, idcs = self._top_k(*self._search_shard(query_embeddings, doc_start_idx, doc_end_idx))
+            if top_scores is not None and top_idcs is not None:
+                scores, idcs = self._merge_top_k(top_scores, top_idcs, scores, idcs)
+            top_scores, top_idcs = scores, idcs
+        assert top_scores is not None and top_idcs is not None
+        mask = top_idcs != -1
+        return top_scores[mask], top_idcs[mask], mask.sum(-1).tolist()
+
+    def _search_shard(
+        self, query_embeddings: BiEncoderEmbedding, doc_start_idx: int, doc_end_idx: int
+    ) -> Tuple[torch.Tensor, torch.Tensor, List[int]]:
+        """Searches only the documents in ``[doc_start_idx, doc_end_idx)``. Only the postings of these documents are
+        read.
+
+        :param query_embeddings: Query embeddings
+        :type query_embeddings: BiEncoderEmbedding
+        :param doc_start_idx: Index of the first document of the shard
+        :type doc_start_idx: int
+        :param doc_end_idx: Index of the end document of the shard (exclusive)
+        :type doc_end_idx: int
+        :return: Scores, document indices, and number of documents per query
+        :rtype: Tuple[torch.Tensor, torch.Tensor, List[int]]
+        """
         embeddings = query_embeddings.embeddings[query_embeddings.scoring_mask]
-        query_lengths = query_embeddings.scoring_mask.sum(-1)
-        scores = self.index.score(embeddings)
+        query_lengths = query_embeddings.scoring_mask.sum(-1).to(self.device)
+        if (
+            self.search_config.dynamic_pruning
+            and self.index.non_negative
+            and self.doc_is_single_vector
+            and bool((query_lengths == 1).all())
+            and bool((embeddings >= 0).all())
+        ):
+            scores, doc_idcs, num_docs = self.index.score_pruned(
+                embeddings, self.search_config.k, doc_start_idx, doc_end_idx
+            )
+            return scores, doc_idcs, num_docs.tolist()
+        start_idx = int(self.cumulative_doc_lengths[doc_start_idx - 1].item()) if doc_start_idx else 0
+        end_idx = int(self.cumulative_doc_lengths[doc_end_idx - 1].item()) if doc_end_idx else 0
+        scores, query_token_idcs, doc_token_idcs = self.index.score(embeddings, start_idx, end_idx)
 
         # aggregate doc token scores
-        if not self.doc_is_single_vector:
+        if self.doc_is_single_vector:
+            doc_idcs = doc_token_idcs
+        else:
+            doc_idcs = torch.searchsorted(self.cumulative_doc_lengths, doc_token_idcs, side="right")
+            pair_idcs = query_token_idcs * self.num_docs + doc_idcs
+            unique_pair_idcs, inverse_idcs = torch.unique(pair_idcs, return_inverse=True)
+            token_scores = scores
             scores = torch.scatter_reduce(
-                torch.zeros(scores.shape[0], self.num_docs, device=scores.device),
-                1,
-                self.doc_token_idcs[None].expand_as(scores),
-                scores,
+                torch.zeros(unique_pair_idcs.shape[0], device=scores.device, dtype=scores.dtype),
+                0,
+                inverse_idcs,
+                token_scores,
                 "amax",
+                include_self=False,
             )
+            query_token_idcs = unique_pair_idcs // self.num_docs
+            doc_idcs = unique_pair_idcs % self.num_docs
+            # doc tokens without any matching postings have a score of 0
+            num_scored_tokens = torch.bincount(inverse_idcs, minlength=unique_pair_idcs.shape[0])
+            has_unscored_tokens = num_scored_tokens < self.doc_lengths[doc_idcs]
+            scores = torch.where(has_unscored_tokens, scores.clamp(min=0), scores)
 
         # aggregate query token scores
-        query_is_single_vector = (query_lengths == 1).all()
-        if not query_is_single_vector:
-            query_token_idcs = torch.arange(query_lengths.shape[0]).to(query_lengths).repeat_interleave(query_lengths)
-            scores = torch.scatter_reduce(
-                torch.zeros(query_lengths.shape[0], self.num_docs, device=scores.device),
-                0,
-                query_token_idcs[:, None].expand_as(scores),
-                scores,
-                self.module.config.query_aggregation_function,
-            )
-        scores = scores.reshape(-1)
-        return scores, None, None
+        query_idcs = torch.arange(query_lengths.shape[0], device=self.device).repeat_interleave(query_lengths)
+        query_idcs = query_idcs[query_token_idcs]
+        query_offsets = torch.cumsum(query_lengths, dim=0) - query_lengths
+        query_token_positions = query_token_idcs - query_offsets[query_idcs]
+        pair_idcs = query_idcs * self.num_docs + doc_idcs
+        unique_pair_idcs, inverse_idcs = torch.unique(pair_idcs, return_inverse=True)
+        max_query_length = int(query_lengths.max().item())
+        # query tokens without any matching postings have a score of 0
+        query_token_scores = torch.zeros(
+            unique_pair_idcs.shape[0], max_query_length, device=scores.device, dtype=scores.dtype
+        )
+        query_token_scores[inverse_idcs, query_token_positions] = scores
+        query_idcs = unique_pair_idcs // self.num_docs
+        doc_idcs = unique_pair_idcs % self.num_docs
+        mask = torch.arange(max_query_length, device=self.device) < query_lengths[query_idcs, None]
+        scores = self.module.scoring_function._aggregate(
+            query_token_scores, mask, self.module.config.query_aggregation_function, dim=1
+        ).view(-1)
+        num_docs = torch.bincount(query_idcs, minlength=query_lengths.shape[0])
+        return scores, doc_idcs, num_docs.tolist()
 
 
 class SparseSearchConfig(SearchConfig):
     search_class = SparseSearcher
+
+    def __init__(self, k: int = 10, dynamic_pruning: bool = True, shard_size: int | None = None) -> None:
+        super().__init__(k)
+        self.dynamic_pruning = dynamic_pruning
+        self.shard_size = shard_size
@@ -0,0 +1,509 @@
+"""
+Serving module for Lightning IR.
+
+This module defines an asynchronous server that loads a bi-encoder, its searcher, and optionally a re-ranking module
+once and answers concurrent search requests over HTTP, and a thread-safe micro-batcher to embed Lightning IR modules in
+Python services. Concurrent requests are collected into micro-batches that are encoded, searched, and re-ranked
+together.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Sequence, Tuple
+
+import torch
+
+from .base import LightningIRModule, LightningIROutput
+from .bi_encoder import BiEncoderModule
+from .data import DocDataset, RankBatch, SearchBatch
+from .lightning_utils.callbacks import fetch_doc_texts, re_rank_candidates
+from .retrieve import SearchConfig, Searcher, ShardedSearcher
+
+STAGES = ("queue", "search", "fetch", "re_rank", "total")
+
+
+@dataclass
+class _BatchRequest:
+    kind: Literal["score", "search"]
+    queries: Sequence[str]
+    docs: Sequence[Sequence[str]] | None
+    future: Future
+    enqueued: float = field(default_factory=time.perf_counter)
+    # latency of every stage in milliseconds, set before the future is resolved
+    latency: Dict[str, float] = field(default_factory=dict)
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        module: LightningIRModule,
+        max_batch_size: int = 32,
+        max_latency: float = 0.005,
+        re_rank_module: LightningIRModule | None = None,
+        docs: str | None = None,
+        re_rank_depth: int = 100,
+        re_rank_batch_size: int = 256,
+    ) -> None:
+        """Thread-safe front-end that coalesces concurrent :meth:`score` and :meth:`search` calls into micro-batches.
+        Calls return futures immediately. A worker thread collects the calls until a micro-batch holds max_batch_size
+        queries or max_latency seconds passed since its first call, and runs a single forward pass of the module per
+        micro-batch. Score and search calls are run in separate forward passes. The retrieved documents of a search
+        micro-batch are optionally re-ranked by a re-ranking module.
+
+        .. code-block:: python
+
+            with MicroBatcher(module, max_batch_size=64) as batcher:
+                future = batcher.score("what is a bi-encoder", ["A bi-encoder encodes ...", "A cross-encoder ..."])
+                scores = future.result().scores
+
+        :param module: Module to score queries and documents with, must have a searcher to search
+        :type module: LightningIRModule
+        :param max_batch_size: Maximum number of queries per micro-batch, a call with more queries is run on its own,
+            defaults to 32
+        :type max_batch_size: int, optional
+        :param max_latency: Maximum number of seconds a call waits for further calls to fill its micro-batch, defaults
+            to 0.005
+        :type max_latency: float, optional
+        :param re_rank_module: Module that re-ranks the retrieved documents, defaults to None
+        :type re_rank_module: LightningIRModule | None, optional
+        :param docs: Path to file containing documents or valid ir_datasets id to look up the texts of the retrieved
+            documents for re-ranking, defaults to None
+        :type docs: str | None, optional
+        :param re_rank_depth: Number of retrieved documents per query that are re-ranked, defaults to 100
+        :type re_rank_depth: int, optional
+        :param re_rank_batch_size: Maximum number of query-document pairs re-ranked at once, defaults to 256
+        :type re_rank_batch_size: int, optional
+        :raises ValueError: If a re-ranking module is passed without documents
+        """
+        if re_rank_module is not None and docs is None:
+            raise ValueError("Re-ranking requires the documents to look up their texts")
+        self.module = module.eval()
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.re_rank_module = re_rank_module.eval() if re_rank_module is not None else None
+        self.docs = DocDataset(docs).docs if docs is not None else None
+        self.re_rank_depth = re_rank_depth
+        self.re_rank_batch_size = re_rank_batch_size
+        self.num_batches = 0
+        self._queue: queue.Queue[_BatchRequest | None] = queue.Queue()
+        self._pending: _BatchRequest | None = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="MicroBatcher", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> MicroBatcher:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def score(
+        self, queries: Sequence[str] | str, docs: Sequence[Sequence[str]] | Sequence[str]
+    ) -> Future[LightningIROutput]:
+        """Computes relevance scores for queries and documents together with the queries and documents of other
+        concurrent calls. See :meth:`.LightningIRModule.score`.
+
+        :param queries: Queries to score
+        :type queries: Sequence[str] | str
+        :param docs: Documents to score
+        :type docs: Sequence[Sequence[str]] | Sequence[str]
+        :raises ValueError: If no documents are passed or the number of document sequences does not match the number
+            of queries
+        :return: Future of the model output containing the scores of the call
+        :rtype: Future[LightningIROutput]
+        """
+        if isinstance(queries, str):
+            queries = (queries,)
+        if not docs:
+            raise ValueError("Expected at least one document to score")
+        if isinstance(docs[0], str):
+            docs = (docs,)
+        if len(queries) != len(docs):
+            raise ValueError("Expected one sequence of documents per query")
+        return self._submit("score", queries, docs).future
+
+    def search(self, queries: Sequence[str] | str) -> Future[List[Tuple[List[str], List[float]]]]:
+        """Retrieves documents for queries together with the queries of other concurrent calls using the searcher of
+        the module. If a re-ranking module is set, the top re_rank_depth documents of every query are re-ranked.
+
+        :param queries: Queries to search for
+        :type queries: Sequence[str] | str
+        :raises ValueError: If the module has no searcher
+        :return: Future of the retrieved document ids and their scores per query
+        :rtype: Future[List[Tuple[List[str], List[float]]]]
+        """
+        if getattr(self.module, "searcher", None) is None:
+            raise ValueError(f"{self.module.__class__.__name__} has no searcher")
+        if isinstance(queries, str):
+            queries = (queries,)
+        return self._submit("search", queries, None).future
+
+    def close(self) -> None:
+        """Processes the pending calls and stops the worker thread. Further calls raise a ValueError."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _submit(
+        self, kind: Literal["score", "search"], queries: Sequence[str], docs: Sequence[Sequence[str]] | None
+    ) -> _BatchRequest:
+        request = _BatchRequest(kind, queries, docs, Future())
+        with self._lock:
+            if self._closed:
+                raise ValueError("MicroBatcher is closed")
+            self._queue.put(request)
+        return request
+
+    def _next_batch(self) -> Tuple[List[_BatchRequest], bool]:
+        request = self._pending if self._pending is not None else self._queue.get()
+        self._pending = None
+        if request is None:
+            return [], True
+        requests = [request]
+        num_queries = len(request.queries)
+        deadline = request.enqueued + self.max_latency
+        while num_queries < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                return requests, True
+            if num_queries + len(request.queries) > self.max_batch_size:
+                # the call starts the next micro-batch
+                self._pending = request
+                break
+            requests.append(request)
+            num_queries += len(request.queries)
+        return requests, False
+
+    def _run(self) -> None:
+        closed = False
+        while not closed or self._pending is not None:
+            requests, closed = self._next_batch()
+            requests = [request for request in requests if request.future.set_running_or_notify_cancel()]
+            for kind in ("score", "search"):
+                kind_requests = [request for request in requests if request.kind == kind]
+                if not kind_requests:
+                    continue
+                self.num_batches += 1
+                try:
+                    with torch.no_grad():
+                        self._process(kind_requests)
+                except Exception as e:
+                    for request in kind_requests:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+
+    def _process(self, requests: List[_BatchRequest]) -> None:
+        queries = [query for request in requests for query in request.queries]
+        if requests[0].kind == "score":
+            docs = [docs for request in requests for docs in request.docs or []]
+            output = self.module.forward(RankBatch(queries, docs, None, None))
+            if output.scores is None:
+                raise ValueError(f"{self.module.__class__.__name__} did not return scores")
+            num_docs = [sum(len(docs) for docs in request.docs or []) for request in requests]
+            for request, scores in zip(requests, output.scores.view(-1).split(num_docs)):
+                request.future.set_result(output.__class__(scores=scores))
+            return
+        start = time.perf_counter()
+        results, latencies = self._search(queries)
+        result_iter = iter(results)
+        for request in requests:
+            request.latency = {"queue": (start - request.enqueued) * 1000, **latencies}
+            request.future.set_result([next(result_iter) for _ in request.queries])
+
+    def _search(self, queries: Sequence[str]) -> Tuple[List[Tuple[List[str], List[float]]], Dict[str, float]]:
+        """Retrieves and optionally re-ranks the documents of the queries of a micro-batch.
+
+        :param queries: Queries of the micro-batch
+        :type queries: Sequence[str]
+        :raises ValueError: If the module does not return document ids and scores
+        :return: Ranked document ids and their scores per query, and the latency of every stage in milliseconds
+        :rtype: Tuple[List[Tuple[List[str], List[float]]], Dict[str, float]]
+        """
+        latencies = {}
+        start = time.perf_counter()
+        query_ids = [str(idx) for idx in range(len(queries))]
+        batch = SearchBatch(query_ids, queries)
+        output = self.module.forward(batch)
+        if batch.doc_ids is None or output.scores is None:
+            raise ValueError(f"{self.module.__class__.__name__} did not return doc_ids and scores when searching")
+        scores = iter(output.scores.view(-1).tolist())
+        results = [(list(doc_ids), [next(scores) for _ in doc_ids]) for doc_ids in batch.doc_ids]
+        latencies["search"] = (time.perf_counter() - start) * 1000
+
+        if self.re_rank_module is None or self.docs is None:
+            return results, {**latencies, "fetch": 0.0, "re_rank": 0.0}
+
+        start = time.perf_counter()
+        candidates = [list(zip(doc_ids, scores))[: self.re_rank_depth] for doc_ids, scores in results]
+        doc_texts = fetch_doc_texts(
+            self.docs, list({doc_id for _candidates in candidates for doc_id, _ in _candidates})
+        )
+        latencies["fetch"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        candidates = re_rank_candidates(
+            self.re_rank_module, queries, query_ids, candidates, doc_texts, self.re_rank_batch_size
+        )
+        results = []
+        for _candidates in candidates:
+            ranking = sorted(_candidates, key=lambda x: x[1], reverse=True)
+            results.append(([doc_id for doc_id, _ in ranking], [score for _, score in ranking]))
+        latencies["re_rank"] = (time.perf_counter() - start) * 1000
+        return results, latencies
+
+
+class SearchServer:
+    def __init__(
+        self,
+        module: BiEncoderModule,
+        index_dir: Path | str,
+        search_config: SearchConfig,
+        re_rank_module: LightningIRModule | None = None,
+        docs: str | None = None,
+        re_rank_depth: int = 100,
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        use_gpu: bool = True,
+        re_rank_batch_size: int = 256,
+        max_body_size: int = 2**20,
+    ) -> None:
+        """Asynchronous server that answers search requests with a bi-encoder and an optional re-ranking module. The
+        modules and the searcher are loaded once. Requests are passed to a :class:`MicroBatcher` that collects them
+        into micro-batches of up to max_batch_size queries, a micro-batch is processed as soon as it is full or
+        max_wait seconds after its first request arrived.
+
+        The server accepts ``POST /search`` requests with a JSON body ``{"query": str, "k": int}``, where k is
+        optional and at most the number of documents retrieved (or re-ranked) per query, and responds with the ranked
+        ``doc_ids``, their ``scores``, and the ``latency`` of every stage in milliseconds. ``GET /stats`` returns the
+        mean latency of every stage over all requests. Requests with a body larger than max_body_size bytes are
+        rejected.
+
+        :param module: Bi-encoder module used for searching
+        :type module: BiEncoderModule
+        :param index_dir: Directory of the index to search
+        :type index_dir: Path | str
+        :param search_config: Configuration of the searcher
+        :type search_config: SearchConfig
+        :param re_rank_module: Module that re-ranks the retrieved documents, defaults to None
+        :type re_rank_module: LightningIRModule | None, optional
+        :param docs: Path to file containing documents or valid ir_datasets id to look up the texts of the retrieved
+            documents for re-ranking, defaults to None
+        :type docs: str | None, optional
+        :param re_rank_depth: Number of retrieved documents per query that are re-ranked, defaults to 100
+        :type re_rank_depth: int, optional
+        :param max_batch_size: Maximum number of queries per micro-batch, defaults to 32
+        :type max_batch_size: int, optional
+        :param max_wait: Maximum number of seconds a request waits for further requests to fill its micro-batch,
+            defaults to 0.005
+        :type max_wait: float, optional
+        :param host: Host to listen on, defaults to "127.0.0.1"
+        :type host: str, optional
+        :param port: Port to listen on, 0 selects a free port, defaults to 8080
+        :type port: int, optional
+        :param use_gpu: Whether to search on the gpu, defaults to True
+        :type use_gpu: bool, optional
+        :param re_rank_batch_size: Maximum number of query-document pairs re-ranked at once, defaults to 256
+        :type re_rank_batch_size: int, optional
+        :param max_body_size: Maximum size of a request body in bytes, defaults to 2**20
+        :type max_body_size: int, optional
+        :raises ValueError: If a re-ranking module is passed without documents
+        """
+        self.search_config = search_config
+        self.re_rank_depth = re_rank_depth
+        self.max_body_size = max_body_size
+        self.host = host
+        self.port = port
+        if ShardedSearcher.is_sharded(index_dir):
+            self.searcher: Searcher | ShardedSearcher = ShardedSearcher(index_dir, search_config, module, use_gpu)
+        else:
+            self.searcher = search_config.search_class(index_dir, search_config, module, use_gpu)
+        module.searcher = self.searcher
+        self.batcher = MicroBatcher(
+            module, max_batch_size, max_wait, re_rank_module, docs, re_rank_depth, re_rank_batch_size
+        )
+        self.module = self.batcher.module
+        self.re_rank_module = self.batcher.re_rank_module
+        self.docs = self.batcher.docs
+
+        self._server: asyncio.Server | None = None
+        self._latencies: Dict[str, float] = defaultdict(float)
+        self._num_requests = 0
+
+    async def start(self) -> None:
+        """Starts listening for requests. Sets :attr:`port` to the port the server listens on."""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Stops listening for requests. The server can be started again."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def close(self) -> None:
+        """Answers the pending requests and stops the micro-batcher. The server cannot be started again."""
+        self.batcher.close()
+
+    async def serve(self) -> None:
+        """Starts the server and serves requests until cancelled."""
+        await self.start()
+        assert self._server is not None
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    def run(self) -> None:
+        """Runs the server in a new event loop until interrupted and closes it afterwards."""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    async def search(self, query: str, k: int | None = None) -> Dict[str, Any]:
+        """Searches for the documents most relevant to a query. The query is processed together with the other
+        queries of its micro-batch.
+
+        :param query: Query text
+        :type query: str
+        :param k: Number of documents to return, None returns :attr:`max_k` documents, defaults to None
+        :type k: int | None, optional
+        :raises ValueError: If the server was not started
+        :raises ValueError: If k is not a positive integer or larger than :attr:`max_k`
+        :return: Ranked document ids, their scores, and the latency of every stage in milliseconds
+        :rtype: Dict[str, Any]
+        """
+        if self._server is None:
+            raise ValueError("Server was not started")
+        if not self._valid_k(k):
+            raise ValueError(f"k must be a positive integer of at most {self.max_k}, got {k!r}")
+        k = k if k is not None else self.max_k
+        request = self.batcher._submit("search", (query,), None)
+        # the micro-batcher runs the model in its worker thread, so the event loop keeps accepting requests
+        ((doc_ids, scores),) = await asyncio.wrap_future(request.future)
+        latency = {**request.latency, "total": (time.perf_counter() - request.enqueued) * 1000}
+        for stage, value in latency.items():
+            self._latencies[stage] += value
+        self._num_requests += 1
+        return {"doc_ids": doc_ids[:k], "scores": scores[:k], "latency": latency}
+
+    @property
+    def max_k(self) -> int:
+        """Maximum number of documents a request can ask for, the number of documents retrieved per query or, if
+        re-ranking, the number of documents re-ranked per query.
+
+        :return: Maximum number of documents per request
+        :rtype: int
+        """
+        if self.re_rank_module is None:
+            return self.search_config.k
+        return min(self.search_config.k, self.re_rank_depth)
+
+    def _valid_k(self, k: Any) -> bool:
+        # bool is a subclass of int but not a valid number of documents
+        return k is None or (isinstance(k, int) and not isinstance(k, bool) and 0 < k <= self.max_k)
+
+    def stats(self) -> Dict[str, Any]:
+        """Mean latency of every stage in milliseconds over all processed requests.
+
+        :return: Number of requests and micro-batches and the mean latencies
+        :rtype: Dict[str, Any]
+        """
+        num_requests = max(self._num_requests, 1)
+        return {
+            "num_requests": self._num_requests,
+            "num_batches": self.batcher.num_batches,
+            "latency": {stage: self._latencies[stage] / num_requests for stage in STAGES},
+        }
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                    headers = {}
+                    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        key, value = line.decode("latin-1").split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                    content_length = int(headers.get("content-length", 0))
+                    if content_length < 0:
+                        raise ValueError("Negative Content-Length")
+                except ValueError:
+                    # the rest of a malformed request cannot be delimited, so the connection is closed after answering
+                    await self._write_response(writer, "400 Bad Request", {"error": "Malformed request"}, False)
+                    break
+                if content_length > self.max_body_size:
+                    # the body is not read, so the connection is closed after answering
+                    error = {"error": f"Request body exceeds {self.max_body_size} bytes"}
+                    await self._write_response(writer, "413 Payload Too Large", error, False)
+                    break
+                body = await reader.readexactly(content_length)
+                status, response = await self._route(method, path, body)
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                await self._write_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _write_response(
+        writer: asyncio.StreamWriter, status: str, response: Dict[str, Any], keep_alive: bool
+    ) -> None:
+        payload = json.dumps(response).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[str, Dict[str, Any]]:
+        if method == "GET" and path == "/stats":
+            return "200 OK", self.stats()
+        if method != "POST" or path != "/search":
+            return "404 Not Found", {"error": f"Unknown endpoint {method} {path}"}
+        try:
+            request = json.loads(body)
+            query = request["query"]
+            k = request.get("k", None)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return "400 Bad Request", {"error": 'Expected a JSON body {"query": str, "k": int}'}
+        if not isinstance(query, str):
+            return "400 Bad Request", {"error": "query must be a string"}
+        if not self._valid_k(k):
+            return "400 Bad Request", {
+                "error": f"k must be a positive integer of at most {self.max_k}, got {json.dumps(k)}"
+            }
+        try:
+            return "200 OK", await self.search(query, k)
+        except Exception as e:
+            return "500 Internal Server Error", {"error": str(e)}
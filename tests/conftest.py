@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 from typing import Any, Dict, List, Union
 
+import ir_datasets
 import pytest
 from _pytest.fixtures import SubRequest
 
@@ -170,6 +171,34 @@ def query_datamodule() -> LightningIRDataModule:
     return datamodule
 
 
+@pytest.fixture(scope="session")
+def stripped_dataset_id(tmp_path_factory: pytest.TempPathFactory) -> str:
+    # the doc_ids of the test corpus contain trailing whitespace which is stripped in indexes
+    dataset_id = "lightning-ir-stripped"
+    docs_path = tmp_path_factory.mktemp("corpus") / "docs.tsv"
+    docs = (line.split("\t", 1) for line in (CORPUS_DIR / "docs.tsv").read_text().splitlines())
+    docs_path.write_text("".join(f"{doc_id.strip()}\t{doc}\n" for doc_id, doc in docs))
+    _register_local_dataset(
+        dataset_id=dataset_id,
+        docs=str(docs_path),
+        queries=str(CORPUS_DIR / "queries.tsv"),
+        qrels=str(CORPUS_DIR / "qrels.tsv"),
+    )
+    return dataset_id
+
+
+@pytest.fixture()
+def stripped_doc_datamodule(stripped_dataset_id: str) -> LightningIRDataModule:
+    num_docs = sum(1 for _ in ir_datasets.load(stripped_dataset_id).docs_iter())
+    datamodule = LightningIRDataModule(
+        num_workers=0,
+        inference_batch_size=2,
+        inference_datasets=[DocDataset(stripped_dataset_id, num_docs=num_docs)],
+    )
+    datamodule.setup(stage="test")
+    return datamodule
+
+
 @pytest.fixture()
 def doc_datamodule() -> LightningIRDataModule:
     datamodule = LightningIRDataModule(
@@ -1,13 +1,30 @@
+import shutil
 from pathlib import Path
 from typing import Sequence
 
 import ir_datasets
+import numpy as np
 import pandas as pd
 import pytest
+import torch
 from _pytest.fixtures import SubRequest
 
-from lightning_ir import BiEncoderModule, LightningIRDataModule, LightningIRModule, LightningIRTrainer, RunDataset
+from lightning_ir import (
+    BiEncoderConfig,
+    BiEncoderEmbedding,
+    BiEncoderModule,
+    BiEncoderOutput,
+    DocDataset,
+    DocEmbeddingCache,
+    IndexBatch,
+    LightningIRDataModule,
+    LightningIRModule,
+    LightningIRTrainer,
+    QueryDataset,
+    RunDataset,
+)
 from lightning_ir.lightning_utils.callbacks import (
+    CascadeCallback,
     IndexCallback,
     RegisterLocalDatasetCallback,
     ReRankCallback,
@@ -16,18 +33,25 @@ from lightning_ir.lightning_utils.callbacks import (
 from lightning_ir.retrieve import (
     FaissFlatIndexConfig,
     FaissSearchConfig,
+    PLAIDIndexConfig,
+    PLAIDSearchConfig,
+    ResidualEmbeddingStore,
+    ResidualEmbeddingStoreConfig,
     SearchConfig,
+    ShardedSearcher,
     SparseIndexConfig,
+    SparseIndexer,
     SparseSearchConfig,
 )
 from lightning_ir.retrieve.indexer import IndexConfig
+from lightning_ir.retrieve.sparse_searcher import SparseIndex
 
 from .conftest import CORPUS_DIR, DATA_DIR
 
 
 @pytest.fixture(
-    params=[FaissFlatIndexConfig(), SparseIndexConfig()],
-    ids=["Faiss", "Sparse"],
+    params=[FaissFlatIndexConfig(), SparseIndexConfig(), PLAIDIndexConfig(num_centroids=8)],
+    ids=["Faiss", "Sparse", "PLAID"],
 )
 def index_config(request: SubRequest) -> IndexConfig:
     return request.param
@@ -62,15 +86,104 @@ def test_index_callback(
     assert index_callback.indexer.num_embeddings and index_callback.indexer.num_docs
     assert index_callback.indexer.num_embeddings >= index_callback.indexer.num_docs
 
-    assert (index_dir / "index.faiss").exists() or (index_dir / "index.pt").exists()
-    assert (index_dir / "doc_ids.txt").exists()
-    doc_ids_path = index_dir / "doc_ids.txt"
-    doc_ids = doc_ids_path.read_text().split()
+    assert any((index_dir / file_name).exists() for file_name in ("index.faiss", "index.pt", "plaid.pt"))
+    assert (index_dir / "doc_ids.npy").exists()
+    doc_ids = np.load(index_dir / "doc_ids.npy")
     for idx, doc_id in enumerate(doc_ids):
-        assert doc_id == f"doc_id_{idx+1}"
+        assert doc_id.decode() == f"doc_id_{idx+1}"
     assert (index_dir / "config.json").exists()
 
 
+def test_index_callback_sorted_by_length(tmp_path: Path, bi_encoder_module: BiEncoderModule):
+    indexes = []
+    for inference_sort_window in (None, 2):
+        datamodule = LightningIRDataModule(
+            num_workers=0,
+            inference_batch_size=2,
+            inference_datasets=[DocDataset("lightning-ir")],
+            inference_sort_window=inference_sort_window,
+        )
+        index_dir = tmp_path / f"index-{inference_sort_window}"
+        index_callback = IndexCallback(index_config=SparseIndexConfig(), index_dir=index_dir)
+        trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[index_callback])
+        trainer.test(bi_encoder_module, datamodule=datamodule)
+        assert not index_callback._pending_docs
+        indexes.append((np.load(index_dir / "doc_ids.npy"), torch.load(index_dir / "index.pt", weights_only=True)))
+
+    assert (indexes[0][0] == indexes[1][0]).all()
+    assert torch.equal(indexes[0][1]["row_indices"], indexes[1][1]["row_indices"])
+    assert torch.allclose(indexes[0][1]["values"], indexes[1][1]["values"], atol=1e-5)
+
+
+def test_index_callback_embedding_store(
+    tmp_path: Path,
+    bi_encoder_module: BiEncoderModule,
+    doc_datamodule: LightningIRDataModule,
+    query_datamodule: LightningIRDataModule,
+):
+    index_dir = tmp_path / "index"
+    index_callback = IndexCallback(
+        index_config=FaissFlatIndexConfig(),
+        index_dir=index_dir,
+        embedding_store_config=ResidualEmbeddingStoreConfig(num_centroids=4, n_bits=2),
+    )
+    trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[index_callback])
+    trainer.test(bi_encoder_module, datamodule=doc_datamodule)
+
+    assert (index_dir / "residuals.pt").exists()
+    store = ResidualEmbeddingStore(index_dir)
+    assert store.num_embeddings == index_callback.indexer.num_embeddings
+    embeddings = store.lookup(torch.arange(store.num_embeddings))
+    assert embeddings.shape == (store.num_embeddings, bi_encoder_module.config.embedding_dim)
+
+    save_dir = tmp_path / "runs"
+    search_config = FaissSearchConfig(k=5, imputation_strategy="gather", candidate_k=10)
+    search_callback = SearchCallback(search_config=search_config, index_dir=index_dir, save_dir=save_dir)
+    trainer = LightningIRTrainer(
+        logger=False, enable_checkpointing=False, callbacks=[search_callback], inference_mode=False
+    )
+    trainer.test(bi_encoder_module, datamodule=query_datamodule)
+    assert search_callback.searcher.embedding_store is not None
+    for dataloader in trainer.test_dataloaders:
+        dataset_id = dataloader.dataset.dataset_id.replace("/", "-")
+        assert (save_dir / f"{dataset_id}.run").exists()
+
+
+def test_search_callback_sharded_index(
+    tmp_path: Path,
+    bi_encoder_module: BiEncoderModule,
+    doc_datamodule: LightningIRDataModule,
+    query_datamodule: LightningIRDataModule,
+):
+    index_dir = tmp_path / "index"
+    for shard in range(2):
+        index_callback = IndexCallback(index_config=SparseIndexConfig(), index_dir=index_dir / f"shard-{shard}")
+        trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[index_callback])
+        trainer.test(bi_encoder_module, datamodule=doc_datamodule)
+    (index_dir / "shards.json").write_text('{"shards": ["shard-0", "shard-1"]}')
+
+    save_dir = tmp_path / "runs"
+    search_config = SparseSearchConfig(k=5)
+    search_callback = SearchCallback(search_config=search_config, index_dir=index_dir, save_dir=save_dir)
+    trainer = LightningIRTrainer(
+        logger=False, enable_checkpointing=False, callbacks=[search_callback], inference_mode=False
+    )
+    trainer.test(bi_encoder_module, datamodule=query_datamodule)
+
+    assert isinstance(search_callback.searcher, ShardedSearcher)
+    assert search_callback.searcher.num_docs == 2 * search_callback.searcher.shards[0].num_docs
+    for dataloader in trainer.test_dataloaders:
+        dataset_id = dataloader.dataset.dataset_id.replace("/", "-")
+        run_df = pd.read_csv(
+            save_dir / f"{dataset_id}.run",
+            sep="\t",
+            header=None,
+            names=["query_id", "Q0", "doc_id", "rank", "score", "system"],
+        )
+        assert run_df["query_id"].nunique() == len(dataloader.dataset)
+        assert run_df.groupby("query_id").size().max() <= search_config.k
+
+
 def get_index(
     bi_encoder_module: BiEncoderModule,
     doc_datamodule: LightningIRDataModule,
@@ -82,11 +195,14 @@ def get_index(
     elif isinstance(search_config, SparseSearchConfig):
         index_type = "sparse"
         index_config = SparseIndexConfig()
+    elif isinstance(search_config, PLAIDSearchConfig):
+        index_type = "plaid"
+        index_config = PLAIDIndexConfig(num_centroids=8)
     else:
         raise ValueError("Unknown search_config type")
-    index_dir = DATA_DIR / "indexes" / f"{index_type}-{bi_encoder_module.config.similarity_function}"
+    index_dir = DATA_DIR / "indexes" / f"{index_type}-{bi_encoder_module.config.similarity_function}" / "lightning-ir"
     if index_dir.exists():
-        return index_dir / "lightning-ir"
+        return index_dir
 
     index_callback = IndexCallback(index_config=index_config, index_dir=index_dir)
 
@@ -96,7 +212,7 @@ def get_index(
         callbacks=[index_callback],
     )
     trainer.test(bi_encoder_module, datamodule=doc_datamodule)
-    return index_dir / "lightning-ir"
+    return index_dir
 
 
 @pytest.mark.parametrize(
@@ -105,8 +221,10 @@ def get_index(
         FaissSearchConfig(k=5, imputation_strategy="min", candidate_k=10),
         FaissSearchConfig(k=5, imputation_strategy="gather", candidate_k=10),
         SparseSearchConfig(k=5),
+        SparseSearchConfig(k=5, shard_size=2),
+        PLAIDSearchConfig(k=5, candidate_k=10, n_cells=2, centroid_score_threshold=0),
     ),
-    ids=["FaissMin", "FaissGather", "Sparse"],
+    ids=["FaissMin", "FaissGather", "Sparse", "SparseSharded", "PLAID"],
 )
 def test_search_callback(
     tmp_path: Path,
@@ -140,6 +258,24 @@ def test_search_callback(
         assert run_df["query_id"].nunique() == len(dataset)
 
 
+@pytest.mark.parametrize("imputation_strategy", ("min", "gather"))
+def test_faiss_searcher_padded_candidates(
+    bi_encoder_module: BiEncoderModule, doc_datamodule: LightningIRDataModule, imputation_strategy: str
+):
+    search_config = FaissSearchConfig(k=5, imputation_strategy=imputation_strategy, candidate_k=1000)
+    index_dir = get_index(bi_encoder_module, doc_datamodule, search_config)
+    searcher = search_config.search_class(index_dir, search_config, bi_encoder_module, False)
+    embedding_dim = bi_encoder_module.config.embedding_dim
+    query_embeddings = BiEncoderEmbedding(torch.randn(2, 3, embedding_dim), torch.ones(2, 3, dtype=torch.bool))
+
+    # faiss pads candidates beyond the number of indexed embeddings with -1
+    _, candidate_doc_idcs = searcher.candidate_retrieval(query_embeddings)
+    assert ((candidate_doc_idcs == -1).sum(-1) == 1000 - searcher.num_embeddings).all()
+    _, doc_idcs, num_docs = searcher._search(query_embeddings)
+    assert (doc_idcs >= 0).all()
+    assert num_docs == [searcher.num_docs, searcher.num_docs]
+
+
 def test_rerank_callback(tmp_path: Path, module: LightningIRModule, inference_datasets: Sequence[RunDataset]):
     datamodule = run_datamodule(module, inference_datasets)
     save_dir = tmp_path / "runs"
@@ -160,6 +296,57 @@ def test_rerank_callback(tmp_path: Path, module: LightningIRModule, inference_da
         assert run_df["query_id"].nunique() == len(dataset)
 
 
+def test_rerank_callback_tokenize_in_collate(
+    tmp_path: Path, module: LightningIRModule, inference_datasets: Sequence[RunDataset]
+):
+    run_dfs = []
+    for tokenize in (False, True):
+        datamodule = LightningIRDataModule(
+            num_workers=0, inference_batch_size=2, inference_datasets=inference_datasets, tokenize=tokenize
+        )
+        save_dir = tmp_path / f"runs-{tokenize}"
+        rerank_callback = ReRankCallback(save_dir)
+        trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[rerank_callback])
+        trainer.re_rank(module, datamodule)
+        assert (datamodule.tokenizer is not None) == tokenize
+        run_dfs.append(
+            pd.concat(
+                pd.read_csv(
+                    run_path, sep="\t", header=None, names=["query_id", "Q0", "doc_id", "rank", "score", "system"]
+                )
+                for run_path in sorted(save_dir.glob("*.run"))
+            )
+        )
+    assert run_dfs[0][["query_id", "doc_id"]].equals(run_dfs[1][["query_id", "doc_id"]])
+    assert np.allclose(run_dfs[0]["score"], run_dfs[1]["score"], atol=1e-5)
+
+
+def test_rerank_callback_sorted_by_length(
+    tmp_path: Path, module: LightningIRModule, inference_datasets: Sequence[RunDataset]
+):
+    run_dfs = []
+    for inference_sort_window in (None, 2):
+        datamodule = LightningIRDataModule(
+            num_workers=0,
+            inference_batch_size=1,
+            inference_datasets=inference_datasets,
+            inference_sort_window=inference_sort_window,
+        )
+        save_dir = tmp_path / f"runs-{inference_sort_window}"
+        trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[ReRankCallback(save_dir)])
+        trainer.re_rank(module, datamodule)
+        run_dfs.append(
+            pd.concat(
+                pd.read_csv(
+                    run_path, sep="\t", header=None, names=["query_id", "Q0", "doc_id", "rank", "score", "system"]
+                )
+                for run_path in sorted(save_dir.glob("*.run"))
+            )
+        )
+    assert run_dfs[0][["query_id", "doc_id"]].equals(run_dfs[1][["query_id", "doc_id"]])
+    assert np.allclose(run_dfs[0]["score"], run_dfs[1]["score"], atol=1e-5)
+
+
 def test_register_local_dataset_callback(module: LightningIRModule):
     callback = RegisterLocalDatasetCallback(
         dataset_id="test",
@@ -175,3 +362,165 @@ def test_register_local_dataset_callback(module: LightningIRModule):
     trainer.test(module, datamodule)
 
     assert ir_datasets.registry._registered.get("test") is not None
+
+
+@pytest.mark.parametrize("from_index", [False, True])
+def test_rerank_callback_doc_cache(
+    tmp_path: Path,
+    bi_encoder_module: BiEncoderModule,
+    doc_datamodule: LightningIRDataModule,
+    inference_datasets: Sequence[RunDataset],
+    from_index: bool,
+):
+    index_dir = None
+    if from_index:
+        index_dir = tmp_path / "index"
+        index_callback = IndexCallback(index_config=FaissFlatIndexConfig(), index_dir=index_dir)
+        trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[index_callback])
+        trainer.index(bi_encoder_module, doc_datamodule)
+    doc_cache = DocEmbeddingCache(index_dir=index_dir)
+    run_dfs = []
+    # the second cached run re-ranks documents that were already encoded
+    for run_idx, cache in enumerate((None, doc_cache, doc_cache)):
+        bi_encoder_module.doc_cache = cache
+        save_dir = tmp_path / f"runs-{run_idx}"
+        trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[ReRankCallback(save_dir)])
+        trainer.re_rank(bi_encoder_module, run_datamodule(bi_encoder_module, inference_datasets))
+        run_dfs.append(
+            pd.concat(
+                pd.read_csv(
+                    run_path, sep="\t", header=None, names=["query_id", "Q0", "doc_id", "rank", "score", "system"]
+                )
+                for run_path in sorted(save_dir.glob("*.run"))
+            )
+        )
+    bi_encoder_module.doc_cache = None
+    assert doc_cache.hits >= 20 and len(doc_cache) == 20
+    for run_df in run_dfs[1:]:
+        assert run_dfs[0][["query_id", "doc_id"]].equals(run_df[["query_id", "doc_id"]])
+        assert np.allclose(run_dfs[0]["score"], run_df["score"], atol=1e-5)
+
+
+def test_doc_embedding_cache_sharded_index(
+    tmp_path: Path, bi_encoder_module: BiEncoderModule, doc_datamodule: LightningIRDataModule
+):
+    index_dir = get_index(bi_encoder_module, doc_datamodule, FaissSearchConfig(k=5))
+    doc_cache = DocEmbeddingCache(index_dir=index_dir)
+    doc_ids = np.char.decode(np.load(index_dir / "doc_ids.npy"), "utf-8").tolist()
+    # sharded index whose shards store the doc ids in the legacy plain text format
+    sharded_index_dir = tmp_path / "index"
+    for shard in range(2):
+        shard_dir = sharded_index_dir / f"shard-{shard}"
+        shutil.copytree(index_dir, shard_dir)
+        (shard_dir / "doc_ids.npy").unlink()
+        (shard_dir / "doc_ids.txt").write_text("\n".join(f"{shard}-{doc_id}" for doc_id in doc_ids))
+    (sharded_index_dir / "shards.json").write_text('{"shards": ["shard-0", "shard-1"]}')
+
+    sharded_doc_cache = DocEmbeddingCache(index_dir=sharded_index_dir)
+    for doc_id in (doc_ids[0], doc_ids[-1]):
+        expected = doc_cache.get(doc_id)
+        assert expected is not None
+        for shard in range(2):
+            embedding = sharded_doc_cache.get(f"{shard}-{doc_id}")
+            assert embedding is not None and torch.equal(embedding.embeddings, expected.embeddings)
+    with pytest.raises(ValueError, match="No per-token document embeddings"):
+        DocEmbeddingCache(index_dir=tmp_path)
+
+
+def test_cascade_callback(
+    tmp_path: Path,
+    bi_encoder_module: BiEncoderModule,
+    cross_encoder_module: LightningIRModule,
+    stripped_dataset_id: str,
+    stripped_doc_datamodule: LightningIRDataModule,
+):
+    index_dir = tmp_path / "index"
+    index_callback = IndexCallback(index_config=SparseIndexConfig(), index_dir=index_dir)
+    trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[index_callback])
+    trainer.index(bi_encoder_module, stripped_doc_datamodule)
+
+    save_dir = tmp_path / "runs"
+    cascade_callback = CascadeCallback(
+        SparseSearchConfig(k=5),
+        [cross_encoder_module, cross_encoder_module],
+        depths=[4, 2],
+        index_dir=index_dir,
+        save_dir=save_dir,
+        re_rank_batch_size=3,
+    )
+    trainer = LightningIRTrainer(
+        logger=False, enable_checkpointing=False, callbacks=[cascade_callback], inference_mode=False
+    )
+    query_datamodule = LightningIRDataModule(
+        num_workers=0, inference_batch_size=2, inference_datasets=[QueryDataset(stripped_dataset_id, num_queries=2)]
+    )
+    trainer.cascade(bi_encoder_module, datamodule=query_datamodule)
+
+    dataset = query_datamodule.inference_datasets[0]
+    run_df = pd.read_csv(
+        save_dir / f"{dataset.dataset_id.replace('/', '-')}.run",
+        sep="\t",
+        header=None,
+        names=["query_id", "Q0", "doc_id", "rank", "score", "system"],
+    )
+    assert run_df["query_id"].nunique() == len(dataset)
+    for query_id, group in run_df.groupby("query_id"):
+        assert len(group) <= 2
+        docs = [dataset.docs.get(doc_id).default_text() for doc_id in group["doc_id"]]
+        scores = cross_encoder_module.score(dataset.queries[str(query_id)], docs).scores
+        assert np.allclose(group["score"], scores.cpu().numpy(), atol=1e-5)
+
+
+def test_sparse_index_legacy_formats(tmp_path: Path):
+    index = torch.sparse_csr_tensor(torch.tensor([0, 1, 2]), torch.tensor([0, 2]), torch.tensor([1.0, 2.0]), (2, 4))
+    legacy_dirs = {name: tmp_path / name for name in ("tensor", "files", "unversioned")}
+    for index_dir in legacy_dirs.values():
+        index_dir.mkdir()
+    torch.save(index, legacy_dirs["tensor"] / "index.pt")
+    torch.save(index.crow_indices(), legacy_dirs["files"] / "crow_indices.pt")
+    torch.save({"ccol_indices": torch.tensor([0, 1, 1, 2, 2])}, legacy_dirs["unversioned"] / "index.pt")
+    for index_dir in legacy_dirs.values():
+        with pytest.raises(ValueError, match="Re-index"):
+            SparseIndex(index_dir, "dot")
+    with pytest.raises(ValueError, match="No sparse index"):
+        SparseIndex(tmp_path, "dot")
+
+
+def test_sparse_dynamic_pruning(tmp_path: Path):
+    # small integer impacts produce many tied scores, and a small block size exercises block skipping
+    generator = torch.Generator().manual_seed(42)
+    num_docs, vocab_size = 64, 16
+    doc_embeddings = torch.randint(0, 4, (num_docs, 1, vocab_size), generator=generator).float()
+    doc_embeddings *= torch.rand(num_docs, 1, vocab_size, generator=generator) < 0.3
+    indexer = SparseIndexer(
+        tmp_path, SparseIndexConfig(block_size=4), BiEncoderConfig(similarity_function="dot", embedding_dim=vocab_size)
+    )
+    doc_ids = [str(idx) for idx in range(num_docs)]
+    scoring_mask = torch.ones(num_docs, 1, dtype=torch.bool)
+    indexer.add(
+        IndexBatch(doc_ids, doc_ids), BiEncoderOutput(doc_embeddings=BiEncoderEmbedding(doc_embeddings, scoring_mask))
+    )
+    indexer.save()
+    index = SparseIndex(tmp_path, "dot")
+
+    query_embeddings = torch.randint(0, 3, (6, vocab_size), generator=generator).float()
+    query_embeddings *= torch.rand(6, vocab_size, generator=generator) < 0.4
+    # single-term queries
+    query_embeddings[4:] = 0
+    query_embeddings[4, 3] = 1
+    query_embeddings[5, 7] = 2
+    all_scores = query_embeddings @ doc_embeddings[:, 0].T
+    for k in (1, 3, 10, num_docs):
+        for start_idx, end_idx in ((0, None), (0, 10), (13, 42), (40, num_docs)):
+            scores, doc_idcs, num_candidates = index.score_pruned(query_embeddings, k, start_idx, end_idx)
+            end_idx = num_docs if end_idx is None else end_idx
+            for query_idx, (_scores, _doc_idcs) in enumerate(
+                zip(scores.split(num_candidates.tolist()), doc_idcs.split(num_candidates.tolist()))
+            ):
+                assert bool(((_doc_idcs >= start_idx) & (_doc_idcs < end_idx)).all())
+                # candidate scores are exact and the top-k scores match exhaustive search up to ties
+                assert torch.equal(_scores, all_scores[query_idx, _doc_idcs])
+                exhaustive_scores = all_scores[query_idx, start_idx:end_idx]
+                exhaustive_scores = exhaustive_scores[exhaustive_scores != 0]
+                _k = min(k, exhaustive_scores.shape[0])
+                assert torch.equal(_scores.topk(_k).values, exhaustive_scores.topk(_k).values)
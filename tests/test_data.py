@@ -1,11 +1,13 @@
+from pathlib import Path
 from typing import Sequence
 
 import pytest
 import torch
 
+from lightning_ir import BiEncoderModule, LightningIRModule, TokenizedDocCache
 from lightning_ir.data.data import IndexBatch, SearchBatch, TrainBatch
 from lightning_ir.data.datamodule import LightningIRDataModule
-from lightning_ir.data.dataset import RunDataset, TupleDataset
+from lightning_ir.data.dataset import DocDataset, QueryDataset, RunDataset, TupleDataset
 
 from .conftest import RUNS_DIR
 
@@ -91,8 +93,11 @@ def test_rank_run_dataset(rank_run_datamodule: LightningIRDataModule):
 
     batch = next(iter(dataloader))
     assert isinstance(batch, TrainBatch)
-    for value in batch.__dict__.values():
-        assert value is not None
+    for field, value in batch.__dict__.items():
+        if field in ("doc_input_ids", "encodings", "positions"):
+            assert value is None
+        else:
+            assert value is not None
     assert batch.targets.shape[0] == datamodule.train_batch_size * dataset.sample_size
     target_ranks = dataset.depth - torch.arange(dataset.sample_size).repeat(datamodule.train_batch_size)
     assert (batch.targets[..., 0] == target_ranks).all()
@@ -105,8 +110,11 @@ def test_relevance_run_dataset(relevance_run_datamodule: LightningIRDataModule):
 
     batch = next(iter(dataloader))
     assert isinstance(batch, TrainBatch)
-    for value in batch.__dict__.values():
-        assert value is not None
+    for field, value in batch.__dict__.items():
+        if field in ("doc_input_ids", "encodings", "positions"):
+            assert value is None
+        else:
+            assert value is not None
     assert batch.targets.shape[0] == datamodule.train_batch_size * dataset.sample_size
 
 
@@ -118,8 +126,11 @@ def test_single_relevant_run_dataset(
 
     batch = next(iter(dataloader))
     assert isinstance(batch, TrainBatch)
-    for value in batch.__dict__.values():
-        assert value is not None
+    for field, value in batch.__dict__.items():
+        if field in ("doc_input_ids", "encodings", "positions"):
+            assert value is None
+        else:
+            assert value is not None
     assert (batch.targets.max(-1).values > 0).sum() == datamodule.train_batch_size
 
 
@@ -131,7 +142,7 @@ def test_tuples_dataset(tuples_datamodule: LightningIRDataModule):
     assert isinstance(batch, TrainBatch)
     for field in batch.__dict__.keys():
         value = getattr(batch, field)
-        if field == "qrels":
+        if field in ("qrels", "doc_input_ids", "encodings", "positions"):
             assert value is None
         else:
             assert value is not None
@@ -174,3 +185,100 @@ def test_json_dataset():
     assert sample is not None
     assert sample.query_id is not None
     assert len(sample.doc_ids) == 5
+
+
+def test_run_dataset_sort_window_fetches_docs_once():
+    dataset = RunDataset(RUNS_DIR / "run.jsonl", depth=5, sample_size=5, sampling_strategy="top")
+    dataset._setup()
+    docs = dataset._docs
+    assert isinstance(docs, dict)
+    fetched = []
+
+    class CountingDocs(dict):
+        def get(self, doc_id, default=None):
+            fetched.append(doc_id)
+            return super().get(doc_id, default)
+
+    dataset._docs = CountingDocs(docs)
+    dataset.sort_window = len(dataset)
+    samples = [dataset[idx] for idx in range(len(dataset))]
+    assert fetched and len(fetched) == len(set(fetched))
+    for sample in samples:
+        assert sample.docs == tuple(docs[doc_id].default_text() for doc_id in sample.doc_ids)
+
+
+def test_doc_dataset_multiple_workers():
+    dataset = DocDataset("lightning-ir")
+    datamodule = LightningIRDataModule(num_workers=2, inference_batch_size=3, inference_datasets=[dataset])
+    datamodule.setup(stage="test")
+    dataloader = datamodule.inference_dataloader()[0]
+
+    batches = list(dataloader)
+    assert len(batches) == len(dataloader)
+    doc_ids = [doc_id for batch in batches for doc_id in batch.doc_ids]
+    assert doc_ids == [doc.doc_id for doc in dataset.ir_dataset.docs_iter()]
+
+
+@pytest.mark.parametrize(
+    "dataset", (DocDataset("lightning-ir"), QueryDataset("lightning-ir", num_queries=2)), ids=["Doc", "Query"]
+)
+def test_data_parallel_dataset_ranks(monkeypatch: pytest.MonkeyPatch, dataset: DocDataset | QueryDataset):
+    world_size = 3
+    samples = []
+    positions = []
+    dataset.sort_by_length = True
+    for rank in range(world_size):
+        monkeypatch.setattr(dataset, "_process_info", lambda rank=rank: (world_size, rank))
+        rank_samples = list(dataset)
+        assert len(rank_samples) == len(dataset)
+        samples.extend(rank_samples)
+        for sample in rank_samples:
+            positions.append(dataset.global_position(sample.position))
+            sample.position = None
+    monkeypatch.undo()
+    dataset.sort_by_length = False
+    # positions of all processes map to distinct positions in the dataset
+    assert sorted(positions) == list(range(len(dataset)))
+    ordered = [sample for _, sample in sorted(zip(positions, samples), key=lambda item: item[0])]
+    assert [str(sample) for sample in ordered] == [str(sample) for sample in dataset]
+
+
+def test_tokenized_doc_cache(
+    tmp_path: Path,
+    bi_encoder_module: BiEncoderModule,
+    cross_encoder_module: LightningIRModule,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    tokenizer = bi_encoder_module.tokenizer
+    cache = TokenizedDocCache.build("lightning-ir", tokenizer, tmp_path, batch_size=3)
+    assert cache.matches(tokenizer)
+
+    dataset = DocDataset("lightning-ir")
+    cached_dataset = DocDataset("lightning-ir", tokenized_cache_dir=cache.cache_dir)
+    assert len(cached_dataset) == len(dataset)
+    samples = list(dataset)
+    cached_samples = list(cached_dataset)
+    assert [sample.doc_id.strip() for sample in samples] == [sample.doc_id for sample in cached_samples]
+
+    with torch.no_grad():
+        output = bi_encoder_module(IndexBatch([s.doc_id for s in samples], [s.doc for s in samples]))
+        cached_output = bi_encoder_module(
+            IndexBatch(
+                [s.doc_id for s in cached_samples],
+                [s.doc for s in cached_samples],
+                [s.doc_input_ids for s in cached_samples],
+            )
+        )
+    assert torch.allclose(output.doc_embeddings.embeddings, cached_output.doc_embeddings.embeddings)
+
+    # the datamodule refuses caches that do not match the tokenizer of the module
+    datamodule = LightningIRDataModule(inference_datasets=[cached_dataset], inference_batch_size=2)
+    datamodule.tokenizer = tokenizer
+    datamodule.setup("test")
+    datamodule.tokenizer = cross_encoder_module.tokenizer
+    with pytest.raises(ValueError, match="only supported for bi-encoders"):
+        datamodule.setup("test")
+    monkeypatch.setattr(tokenizer, "doc_length", tokenizer.doc_length + 1)
+    datamodule.tokenizer = tokenizer
+    with pytest.raises(ValueError, match="different tokenizer"):
+        datamodule.setup("test")
@@ -1,13 +1,24 @@
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Sequence
 
 import pytest
+import torch
+from lightning.pytorch.trainer.states import TrainerFn
 from transformers import AutoModel
 
 from lightning_ir.base import LightningIRModel, LightningIRModule
-from lightning_ir.cross_encoder import CrossEncoderModule
+from lightning_ir.bi_encoder import (
+    BiEncoderConfig,
+    BiEncoderEmbedding,
+    BiEncoderModule,
+    QueryEmbeddingCache,
+    ScoringFunction,
+)
+from lightning_ir.cross_encoder import CrossEncoderConfig, CrossEncoderModule
 from lightning_ir.data import LightningIRDataModule, RunDataset, TupleDataset
-from lightning_ir.loss.loss import InBatchLossFunction
+from lightning_ir.flash import VARLEN_FORWARD_MAP
+from lightning_ir.loss.loss import InBatchLossFunction, RankNet
 from lightning_ir.main import LightningIRTrainer
 
 DATA_DIR = Path(__file__).parent / "data"
@@ -83,3 +94,159 @@ def test_seralize_deserialize(module: LightningIRModule, tmp_path: Path):
             assert getattr(new_model.config, key) == value
         for key, value in model.state_dict().items():
             assert new_model.state_dict()[key].equal(value)
+
+
+def test_unpadded_encoding(module: LightningIRModule, monkeypatch: pytest.MonkeyPatch):
+    queries = ["what is the capital of france", "a"]
+    docs = [["paris is the capital of france and the largest city of the country", "short"], ["hello world", "x y"]]
+    module.eval()
+    with torch.no_grad():
+        unpadded_scores = module.score(queries, docs).scores
+        monkeypatch.setattr(module.model, "UNPAD_INPUTS", False)
+        padded_scores = module.score(queries, docs).scores
+    assert torch.allclose(unpadded_scores, padded_scores, atol=1e-5)
+
+
+def test_unpadded_encoding_fallback(module: LightningIRModule, monkeypatch: pytest.MonkeyPatch):
+    queries = ["what is the capital of france", "a"]
+    docs = [["paris is the capital of france and the largest city of the country", "short"], ["hello world", "x y"]]
+    calls = []
+    backbone_model_type = module.model.config.backbone_model_type
+    varlen_forward = VARLEN_FORWARD_MAP[backbone_model_type]
+    monkeypatch.setitem(
+        VARLEN_FORWARD_MAP,
+        backbone_model_type,
+        lambda *args, **kwargs: calls.append(1) or varlen_forward(*args, **kwargs),
+    )
+    module.eval()
+    with torch.no_grad():
+        module.score(queries, docs)
+        assert calls
+        calls.clear()
+        # relative position embeddings are not supported by the packed encoding
+        monkeypatch.setattr(module.model.config, "position_embedding_type", "relative_key", raising=False)
+        module.score(queries, docs)
+        assert not calls
+
+
+@pytest.mark.parametrize("similarity_function", ["dot", "cosine", "l2"])
+@pytest.mark.parametrize("query_aggregation_function", ["sum", "mean", "max", "harmonic_mean"])
+def test_packed_scoring(similarity_function: str, query_aggregation_function: str, monkeypatch: pytest.MonkeyPatch):
+    config = BiEncoderConfig(
+        similarity_function=similarity_function, query_aggregation_function=query_aggregation_function
+    )
+    scoring_function = ScoringFunction(config)
+    query_embeddings = BiEncoderEmbedding(torch.randn(3, 5, 4), torch.rand(3, 5) > 0.3)
+    doc_embeddings = BiEncoderEmbedding(torch.randn(7, 6, 4), torch.rand(7, 6) > 0.3)
+    query_embeddings.scoring_mask[:, 0] = True
+    doc_embeddings.scoring_mask[:, 0] = True
+
+    packed_scores = scoring_function(query_embeddings, doc_embeddings, [2, 4, 1])
+    monkeypatch.setattr(scoring_function, "_use_packed_scoring", lambda *args: False)
+    padded_scores = scoring_function(query_embeddings, doc_embeddings, [2, 4, 1])
+    assert torch.allclose(packed_scores, padded_scores, atol=1e-4)
+
+
+def test_masked_broadcast_scoring():
+    scoring_function = ScoringFunction(BiEncoderConfig(query_aggregation_function="mean"))
+    # grouped re-ranking batch whose vectors are mostly not masked
+    query_embeddings = BiEncoderEmbedding(torch.randn(2, 5, 4), torch.ones(2, 5, dtype=torch.bool))
+    doc_embeddings = BiEncoderEmbedding(torch.randn(6, 6, 4), torch.ones(6, 6, dtype=torch.bool))
+    query_embeddings.scoring_mask[0, -1] = False
+    doc_embeddings.scoring_mask[::2, -2:] = False
+    num_docs = torch.tensor([3, 3])
+
+    assert not scoring_function._use_packed_scoring(query_embeddings, doc_embeddings, num_docs)
+    scores = scoring_function(query_embeddings, doc_embeddings, num_docs.tolist())
+    packed_scores = scoring_function._packed_scores(query_embeddings, doc_embeddings, num_docs)
+    assert torch.allclose(scores, packed_scores, atol=1e-5)
+
+
+@pytest.mark.parametrize("query_aggregation_function", ["sum", "mean", "max", "harmonic_mean"])
+def test_scoring_empty_query(query_aggregation_function: str, monkeypatch: pytest.MonkeyPatch):
+    scoring_function = ScoringFunction(BiEncoderConfig(query_aggregation_function=query_aggregation_function))
+    query_embeddings = BiEncoderEmbedding(torch.randn(2, 5, 4), torch.ones(2, 5, dtype=torch.bool))
+    query_embeddings.scoring_mask[1] = False
+    doc_embeddings = BiEncoderEmbedding(torch.randn(5, 6, 4), torch.ones(5, 6, dtype=torch.bool))
+
+    packed_scores = scoring_function(query_embeddings, doc_embeddings, [2, 3])
+    monkeypatch.setattr(scoring_function, "_use_packed_scoring", lambda *args: False)
+    padded_scores = scoring_function(query_embeddings, doc_embeddings, [2, 3])
+    assert torch.allclose(packed_scores, padded_scores, atol=1e-4)
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_scoring_memory_budget(packed: bool, monkeypatch: pytest.MonkeyPatch):
+    scoring_function = ScoringFunction(BiEncoderConfig())
+    monkeypatch.setattr(scoring_function, "_use_packed_scoring", lambda *args: packed)
+    query_embeddings = BiEncoderEmbedding(torch.randn(3, 5, 4), torch.ones(3, 5, dtype=torch.bool))
+    doc_embeddings = BiEncoderEmbedding(torch.randn(7, 6, 4), torch.ones(7, 6, dtype=torch.bool))
+
+    scores = scoring_function(query_embeddings, doc_embeddings, [2, 4, 1])
+    scoring_function = ScoringFunction(BiEncoderConfig(memory_budget=64))
+    monkeypatch.setattr(scoring_function, "_use_packed_scoring", lambda *args: packed)
+    chunked_scores = scoring_function(query_embeddings, doc_embeddings, [2, 4, 1])
+    assert torch.allclose(scores, chunked_scores, atol=1e-5)
+
+
+def test_query_embedding_cache(
+    bi_encoder_config: BiEncoderConfig, model_name_or_path: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    module = BiEncoderModule(model_name_or_path, bi_encoder_config)
+    module.eval()
+    queries = ["what is the capital of france", "a"]
+    docs = [["paris is the capital of france", "short"], ["hello world", "x y"]]
+    with torch.no_grad():
+        expected = module.score(queries, docs)
+
+        module.query_cache = QueryEmbeddingCache(max_size=1, cache_dir=tmp_path)
+        assert torch.allclose(module.score(queries, docs).scores, expected.scores, atol=1e-5)
+        assert (module.query_cache.hits, module.query_cache.misses) == (0, 2)
+        assert len(module.query_cache) == 1
+
+        # the first query was evicted from memory but is loaded from disk, whitespace is normalized
+        output = module.score(["what is  the capital of france ", "a"], docs)
+        assert torch.allclose(output.scores, expected.scores, atol=1e-5)
+        assert (module.query_cache.hits, module.query_cache.misses) == (2, 2)
+
+        # repeated queries that are not cached are encoded once but are all misses
+        module.query_cache = QueryEmbeddingCache()
+        module.score([queries[0], queries[0]], docs)
+        assert (module.query_cache.hits, module.query_cache.misses) == (0, 2)
+
+        # the cache is not used while fitting
+        monkeypatch.setattr(module, "_trainer", SimpleNamespace(state=SimpleNamespace(fn=TrainerFn.FITTING)))
+        module.score(queries, docs)
+        assert (module.query_cache.hits, module.query_cache.misses) == (0, 2)
+        monkeypatch.undo()
+
+        # the fingerprint changes with the weights
+        fingerprint = QueryEmbeddingCache.fingerprint(module.model)
+        next(module.model.parameters()).add_(1)
+        assert QueryEmbeddingCache.fingerprint(module.model) != fingerprint
+
+
+def test_cross_encoder_early_exit(model_name_or_path: str, inference_datasets: Sequence[RunDataset]):
+    config = CrossEncoderConfig(num_hidden_layers=3, exit_layers=[1, 2], exit_k=2, query_length=8, doc_length=8)
+    module = CrossEncoderModule(
+        model_name_or_path, config=config, loss_functions=[RankNet()], evaluation_metrics=["nDCG@10"]
+    )
+    datamodule = tuples_datamodule(module, inference_datasets)
+    assert module.training_step(next(iter(datamodule.train_dataloader())), 0)
+
+    module.eval()
+    batch = next(iter(datamodule.val_dataloader()[0]))
+    num_docs = [len(doc_ids) for doc_ids in batch.doc_ids]
+    with torch.no_grad():
+        output = module.forward(batch)
+        encoding = module.prepare_input(batch.queries, [doc for docs in batch.docs for doc in docs], num_docs)
+        full_output = module.model.forward(encoding["encoding"])
+    assert output.num_layers is not None and (output.num_layers < 3).any()
+    simulated_output = module.model.simulate_early_exit(full_output, num_docs)
+    assert torch.allclose(output.scores, simulated_output.scores, atol=1e-5)
+    # candidates that exit early are ranked below the candidates that pass the exit layers
+    for scores, num_layers in zip(output.scores.split(num_docs), output.num_layers.split(num_docs)):
+        assert (num_layers[scores.argsort(descending=True)].diff() <= 0).all()
+
+    metrics = module.validate_metrics(full_output, batch)
+    assert {"nDCG@10", "early-exit-nDCG@10", "early-exit-layers"} <= set(metrics)
@@ -0,0 +1,142 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ir_datasets
+import pytest
+import torch
+
+from lightning_ir import (
+    BiEncoderModule,
+    IndexCallback,
+    LightningIRDataModule,
+    LightningIRModule,
+    LightningIRTrainer,
+    MicroBatcher,
+    SearchServer,
+)
+from lightning_ir.retrieve import SparseIndexConfig, SparseSearchConfig
+
+
+async def send(port: int, request: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def post(port: int, path: str, body: dict | None = None) -> dict:
+    payload = json.dumps(body).encode() if body is not None else b""
+    method = "POST" if body is not None else "GET"
+    response = await send(
+        port,
+        f"{method} {path} HTTP/1.1\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload,
+    )
+    return json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+
+def test_search_server(
+    tmp_path: Path,
+    bi_encoder_module: BiEncoderModule,
+    cross_encoder_module: LightningIRModule,
+    stripped_dataset_id: str,
+    stripped_doc_datamodule: LightningIRDataModule,
+):
+    index_dir = tmp_path / "index"
+    index_callback = IndexCallback(index_config=SparseIndexConfig(), index_dir=index_dir)
+    trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[index_callback])
+    trainer.index(bi_encoder_module, stripped_doc_datamodule)
+
+    queries = [query.default_text() for query in ir_datasets.load(stripped_dataset_id).queries_iter()]
+    server = SearchServer(
+        bi_encoder_module,
+        index_dir,
+        SparseSearchConfig(k=5),
+        re_rank_module=cross_encoder_module,
+        docs=stripped_dataset_id,
+        re_rank_depth=3,
+        re_rank_batch_size=4,
+        max_batch_size=len(queries),
+        max_wait=1.0,
+        port=0,
+        use_gpu=False,
+        max_body_size=1024,
+    )
+
+    async def run() -> tuple:
+        await server.start()
+        try:
+            responses = await asyncio.gather(*(post(server.port, "/search", {"query": query}) for query in queries))
+            stats = await post(server.port, "/stats")
+            # invalid requests are answered with errors and do not stop the server from answering valid requests
+            invalid_responses = await asyncio.gather(
+                *(post(server.port, "/search", {"query": queries[0], "k": k}) for k in (0, True, "3", -1, 4))
+            )
+            malformed_response = await send(server.port, b"garbage\r\n\r\n")
+            too_large_response = await send(server.port, b"POST /search HTTP/1.1\r\nContent-Length: 1025\r\n\r\n")
+            valid_response = await asyncio.wait_for(post(server.port, "/search", {"query": queries[0], "k": 2}), 60)
+        finally:
+            await server.stop()
+        return responses, stats, invalid_responses, malformed_response, too_large_response, valid_response
+
+    responses, stats, invalid_responses, malformed_response, too_large_response, valid_response = asyncio.run(run())
+    server.close()
+    assert all("error" in response for response in invalid_responses)
+    assert malformed_response.startswith(b"HTTP/1.1 400 Bad Request")
+    assert too_large_response.startswith(b"HTTP/1.1 413 Payload Too Large")
+    assert len(valid_response["doc_ids"]) == 2
+
+    # all concurrent requests are processed in a single micro-batch
+    assert stats["num_requests"] == len(queries)
+    assert stats["num_batches"] == 1
+    assert set(stats["latency"]) == {"queue", "search", "fetch", "re_rank", "total"}
+    for query, response in zip(queries, responses):
+        assert 0 < len(response["doc_ids"]) <= 3
+        assert response["scores"] == sorted(response["scores"], reverse=True)
+        docs = [server.docs.get(doc_id).default_text() for doc_id in response["doc_ids"]]
+        scores = cross_encoder_module.score(query, docs).scores
+        assert torch.allclose(torch.tensor(response["scores"]), scores, atol=1e-5)
+
+
+def test_micro_batcher(
+    tmp_path: Path,
+    bi_encoder_module: BiEncoderModule,
+    cross_encoder_module: LightningIRModule,
+    doc_datamodule: LightningIRDataModule,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    queries = ["what is the capital of france", "a", "hello world"]
+    docs = [["paris is the capital of france", "short"], ["hello world", "x y", "z"], ["hello"]]
+    expected = [cross_encoder_module.score(query, _docs).scores for query, _docs in zip(queries, docs)]
+
+    batches = []
+    forward = cross_encoder_module.forward
+    monkeypatch.setattr(cross_encoder_module, "forward", lambda batch: batches.append(batch) or forward(batch))
+    with MicroBatcher(cross_encoder_module, max_batch_size=2, max_latency=1.0) as batcher:
+        with ThreadPoolExecutor(len(queries)) as executor:
+            futures = list(executor.map(batcher.score, queries, docs))
+        outputs = [future.result() for future in futures]
+        with pytest.raises(ValueError, match="at least one document"):
+            batcher.score(queries[0], [])
+    # the concurrent calls are coalesced into micro-batches of at most two queries
+    assert sorted(len(batch.queries) for batch in batches) == [1, 2]
+    for output, scores in zip(outputs, expected):
+        assert torch.allclose(output.scores, scores, atol=1e-5)
+    with pytest.raises(ValueError):
+        batcher.score(queries[0], docs[0])
+
+    index_dir = tmp_path / "index"
+    index_callback = IndexCallback(index_config=SparseIndexConfig(), index_dir=index_dir)
+    trainer = LightningIRTrainer(logger=False, enable_checkpointing=False, callbacks=[index_callback])
+    trainer.index(bi_encoder_module, doc_datamodule)
+    search_config = SparseSearchConfig(k=3)
+    bi_encoder_module.searcher = search_config.search_class(index_dir, search_config, bi_encoder_module, False)
+    with MicroBatcher(bi_encoder_module) as batcher:
+        results = batcher.search(queries).result()
+    assert len(results) == len(queries)
+    for doc_ids, scores in results:
+        assert 0 < len(doc_ids) == len(scores) <= 3
+    bi_encoder_module.searcher = None
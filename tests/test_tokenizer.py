@@ -1,3 +1,5 @@
+import warnings
+
 import pytest
 from transformers import AutoTokenizer
 
@@ -69,3 +71,32 @@ def test_cross_encoder_tokenizer(model_name_or_path: str):
     encoding = tokenizer.tokenize(query, doc)["encoding"]
     assert encoding is not None
     assert len(encoding.input_ids[0]) == tokenizer.query_length + tokenizer.doc_length + 3
+
+
+def test_cross_encoder_tokenizer_shared_queries(model_name_or_path: str):
+    Tokenizer = LightningIRTokenizerClassFactory(CrossEncoderConfig).from_pretrained(model_name_or_path)
+    tokenizer = Tokenizer.from_pretrained(model_name_or_path, query_length=8, doc_length=8)
+    tokenizer.model_max_length = 16
+
+    queries = ["What is the capital of France?", "Where is the Eiffel Tower?"]
+    docs = ["Paris is the capital of France.", "France is in Europe.", "The Eiffel Tower is in Paris.", "Paris"]
+    encoding = tokenizer.tokenize(queries, docs, num_docs=2, padding=True, truncation=True)["encoding"]
+    repeated_queries = [query for query in queries for _ in range(2)]
+    expected = tokenizer(
+        tokenizer._truncate(repeated_queries, 8), tokenizer._truncate(docs, 8), padding=True, truncation=True
+    )
+    assert encoding.keys() == expected.keys()
+    for key in expected:
+        assert encoding[key] == expected[key]
+
+
+def test_bi_encoder_tokenizer_pre_tokenized_docs(model_name_or_path: str):
+    Tokenizer = LightningIRTokenizerClassFactory(BiEncoderConfig).from_pretrained(model_name_or_path)
+    tokenizer = Tokenizer.from_pretrained(model_name_or_path, doc_length=8)
+
+    docs = ["Paris is the capital of France and the largest city of the country.", "France is in Europe."]
+    expected = tokenizer.tokenize(docs=docs, padding=True, truncation=True)["doc_encoding"]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        encoding = tokenizer.tokenize(doc_input_ids=tokenizer.pre_tokenize_doc(docs), padding=True, truncation=True)
+    assert encoding["doc_encoding"]["input_ids"] == expected["input_ids"]